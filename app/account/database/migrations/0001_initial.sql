@@ -1,7 +1,7 @@
 -- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
 -- Systems
 
-CREATE TABLE Accounts(
+CREATE TABLE IF NOT EXISTS Accounts(
   id SERIAL PRIMARY KEY,
   created_at INTEGER NOT NULL,
   active BOOLEAN DEFAULT true,
@@ -11,5 +11,5 @@ CREATE TABLE Accounts(
   last_name VARCHAR(64) NOT NULL
 );
 
-CREATE INDEX idx_created_at ON Accounts(created_at);
-CREATE INDEX idx_username ON Accounts(username);
+CREATE INDEX IF NOT EXISTS idx_created_at ON Accounts(created_at);
+CREATE INDEX IF NOT EXISTS idx_username ON Accounts(username);
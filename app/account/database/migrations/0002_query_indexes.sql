@@ -0,0 +1,7 @@
+-- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+-- Systems
+
+-- Accounts are only looked up by id (primary key) and by username (unique
+-- constraint), so other indexes only slow down writes.
+DROP INDEX IF EXISTS idx_created_at;
+DROP INDEX IF EXISTS idx_username;
@@ -0,0 +1,9 @@
+-- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+-- Systems
+
+-- Time (milliseconds since epoch) of the last update or deletion of each
+-- account, before which its sessions are invalid. API gateways poll recent
+-- revocations ('list_session_revocations').
+ALTER TABLE Accounts ADD COLUMN sessions_revoked_at BIGINT NOT NULL DEFAULT 0;
+CREATE INDEX idx_sessions_revoked_at
+    ON Accounts(sessions_revoked_at) WHERE sessions_revoked_at > 0;
@@ -0,0 +1,6 @@
+-- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+-- Systems
+
+-- Sequence number of the last change of each account, incremented whenever it
+-- is updated or deleted. Changes are published to the change log with it.
+ALTER TABLE Accounts ADD COLUMN change_seq BIGINT NOT NULL DEFAULT 1;
@@ -8,6 +8,8 @@
 #include <spdlog/spdlog.h>
 #include <spdlog/sinks/basic_file_sink.h>
 #include <thrift/protocol/TBinaryProtocol.h>
+#include <thrift/protocol/TCompactProtocol.h>
+#include <thrift/protocol/THeaderProtocol.h>
 #include <thrift/transport/TSocket.h>
 #include <thrift/transport/TTransportUtils.h>
 
@@ -30,13 +32,23 @@ class Client {
     std::shared_ptr<TAccountServiceClient> _client;
 
  public:
-    Client(const std::string& ip_address, int port, int conn_timeout_ms) {
+    Client(const std::string& ip_address, int port, int conn_timeout_ms,
+        const std::string& transport = "buffered",
+        const std::string& protocol = "binary") {
       _ip_address = ip_address;
       _port = port;
       _socket = std::make_shared<TSocket>(ip_address, port);
       _socket->setConnTimeout(conn_timeout_ms);
-      _transport = std::make_shared<TBufferedTransport>(_socket);
-      _protocol = std::make_shared<TBinaryProtocol>(_transport);
+      if (transport == "framed")
+        _transport = std::make_shared<TFramedTransport>(_socket);
+      else
+        _transport = std::make_shared<TBufferedTransport>(_socket);
+      if (transport == "header")
+        _protocol = std::make_shared<THeaderProtocol>(_transport);
+      else if (protocol == "compact")
+        _protocol = std::make_shared<TCompactProtocol>(_transport);
+      else
+        _protocol = std::make_shared<TBinaryProtocol>(_transport);
       _client = std::make_shared<TAccountServiceClient>(_protocol);
       _transport->open();
     }
@@ -135,5 +147,19 @@ class Client {
           "function=account:delete_account latency={}", request_metadata.id,
           _ip_address, _port, latency.count());
       }
+
+    std::map<int32_t, int64_t> list_session_revocations(
+        const TRequestMetadata& request_metadata, const int64_t since) {
+      std::map<int32_t, int64_t> _return;
+      auto logger = spdlog::get("logger");
+      auto start_time = std::chrono::steady_clock::now();
+      _client->list_session_revocations(_return, request_metadata, since);
+      std::chrono::duration<double> latency = \
+          std::chrono::steady_clock::now() - start_time;
+      logger->info("request_id={} server={}:{} "
+          "function=account:list_session_revocations latency={}",
+          request_metadata.id, _ip_address, _port, latency.count());
+      return _return;
+    }
 };
 }  // namespace account_service
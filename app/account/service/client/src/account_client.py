@@ -4,12 +4,17 @@
 TODO : Sample string decribing the purpose of this file.
 """
 
+import collections
+import threading
 import time
 
 import spdlog as spd
+from thrift.transport import THeaderTransport
 from thrift.transport import TSocket
 from thrift.transport import TTransport
 from thrift.protocol import TBinaryProtocol
+from thrift.protocol import TCompactProtocol
+from thrift.protocol import THeaderProtocol
 
 from buzzblog.gen import TAccountService
 
@@ -30,15 +35,61 @@ def instrumented(func):
         return ret
     return func_wrapper
 
+# Time (in seconds) reads are memoized for the request that made them.
+REQUEST_CACHE_TTL = 1.0
+_request_cache = collections.OrderedDict()
+_request_cache_lock = threading.Lock()
+
+
+def memoized(func):
+    """Memoize the result of a read for the request of 'request_metadata'.
+
+    Repeated reads with the same arguments within a request are served
+    locally. Reads are scoped by the 'scope_id' of the request, which the API
+    gateway mints for each request, and by the requester; they are not
+    memoized without a scope id. Results are kept for REQUEST_CACHE_TTL
+    seconds, which bounds the duration of a request.
+    """
+    def func_wrapper(self, request_metadata, *args, **kwargs):
+        if request_metadata.scope_id is None:
+            return func(self, request_metadata, *args, **kwargs)
+        key = (request_metadata.scope_id, request_metadata.requester_id,
+            func.__name__, repr(args), repr(sorted(kwargs.items())))
+        now = time.monotonic()
+        with _request_cache_lock:
+            # Entries expire in insertion order.
+            while _request_cache and \
+                    next(iter(_request_cache.values()))[0] <= now:
+                _request_cache.popitem(last=False)
+            if key in _request_cache:
+                return _request_cache[key][1]
+        ret = func(self, request_metadata, *args, **kwargs)
+        with _request_cache_lock:
+            _request_cache.setdefault(key, (now + REQUEST_CACHE_TTL, ret))
+        return ret
+    return func_wrapper
+
 class Client:
     """ TODO : Class description """
-    def __init__(self, ip_address, port, timeout=10000):
+    def __init__(self, ip_address, port, timeout=10000, transport="buffered",
+        protocol="binary"):
         self._ip_address = ip_address
         self._port = port
         self._socket = TSocket.TSocket(ip_address, port)
         self._socket.setTimeout(timeout)
-        self._transport = TTransport.TBufferedTransport(self._socket)
-        self._protocol = TBinaryProtocol.TBinaryProtocol(self._transport)
+        if transport == "framed":
+            self._transport = TTransport.TFramedTransport(self._socket)
+        else:
+            self._transport = TTransport.TBufferedTransport(self._socket)
+        if transport == "header":
+            self._protocol = THeaderProtocol.THeaderProtocol(self._transport,
+                [THeaderTransport.THeaderClientType.HEADERS])
+        elif protocol == "compact":
+            self._protocol = TCompactProtocol.TCompactProtocolAccelerated(
+                self._transport)
+        else:
+            self._protocol = TBinaryProtocol.TBinaryProtocolAccelerated(
+                self._transport)
         self._tclient = TAccountService.Client(self._protocol)
         self._transport.open()
 
@@ -71,12 +122,14 @@ class Client:
             username=username, password=password, first_name=first_name,
             last_name=last_name)
 
+    @memoized
     @instrumented
     def retrieve_standard_account(self, request_metadata, account_id):
         """ TODO : Method description """
         return self._tclient.retrieve_standard_account(
             request_metadata=request_metadata, account_id=account_id)
 
+    @memoized
     @instrumented
     def retrieve_expanded_account(self, request_metadata, account_id):
         """ TODO : Method description """
@@ -96,3 +149,9 @@ class Client:
         """ TODO : Method description """
         return self._tclient.delete_account(request_metadata=request_metadata,
             account_id=account_id)
+
+    @instrumented
+    def list_session_revocations(self, request_metadata, since):
+        """ TODO : Method description """
+        return self._tclient.list_session_revocations(
+            request_metadata=request_metadata, since=since)
@@ -1,18 +1,19 @@
 // Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
 // Systems
 
+#include <chrono>
+#include <memory>
 #include <string>
+#include <thread>
 
 #include <cxxopts.hpp>
 #include <pqxx/pqxx>
 #include <spdlog/sinks/basic_file_sink.h>
-#include <thrift/protocol/TBinaryProtocol.h>
-#include <thrift/server/TThreadedServer.h>
-#include <thrift/transport/TBufferTransports.h>
-#include <thrift/transport/TServerSocket.h>
 
 #include <buzzblog/gen/TAccountService.h>
 #include <buzzblog/base_server.h>
+#include <buzzblog/change_log.h>
+#include <buzzblog/lru_cache.h>
 
 
 using apache::thrift;
@@ -34,12 +35,52 @@ class TAccountServiceHandler : public BaseServer, public TAccountServiceIf {
         last_name.size() > 0 && last_name.size() <= 32);
   }
 
+  // Standard accounts cached by id.
+  LRUCache<int32_t, TAccount> _account_cache;
+  // Log of the changes of accounts (null if changes are not logged).
+  std::unique_ptr<ChangeLog> _change_log;
+
+  // Queue change 'seq' of account 'account_id' in 'txn', if changes are
+  // logged.
+  void queue_change(pqxx::work& txn, const int32_t account_id,
+      const int64_t seq, const std::string& op) {
+    if (_change_log)
+      _change_log->queue(txn, Change{"account", account_id, seq, op, {}});
+  }
+
+  // Publish the changes queued by a committed transaction, if changes are
+  // logged.
+  void publish_changes() {
+    if (_change_log)
+      _change_log->notify();
+  }
+
+  void log_cache_stats(int interval_s) {
+    while (true) {
+      std::this_thread::sleep_for(std::chrono::seconds(interval_s));
+      auto logger = spdlog::get("logger");
+      if (logger)
+        logger->info("cache=account size={} hits={} misses={} "
+            "hit_ratio={:.4f}", _account_cache.size(), _account_cache.hits(),
+            _account_cache.misses(), _account_cache.hit_ratio());
+    }
+  }
+
  public:
   TAccountServiceHandler(const std::string& backend_filepath,
       const std::string& postgres_user, const std::string& postgres_password,
-      const std::string& postgres_dbname)
+      const std::string& postgres_dbname, int cache_capacity, int cache_ttl_ms,
+      int cache_stats_interval_s, bool change_log,
+      const std::string& change_log_dirpath)
   : BaseServer(backend_filepath, postgres_user, postgres_password,
-      postgres_dbname) {
+      postgres_dbname),
+    _account_cache(cache_capacity, cache_ttl_ms) {
+    if (cache_capacity > 0 && cache_stats_interval_s > 0)
+      std::thread(&TAccountServiceHandler::log_cache_stats, this,
+          cache_stats_interval_s).detach();
+    if (change_log)
+      _change_log = std::make_unique<ChangeLog>(change_log_dirpath, "account",
+          [this] { return list_db_conn_strs("account"); });
   }
 
   void authenticate_user(TAccount& _return,
@@ -54,7 +95,9 @@ class TAccountServiceHandler : public BaseServer, public TAccountServiceIf {
     snprintf(query_str, sizeof(query_str), query_fmt, username.c_str());
 
     // Execute query.
-    pqxx::connection conn(account_db_conn_str);
+    // NOTE: Credentials are always checked against the primary, so that an
+    // account can log in right after it is created or updated.
+    pqxx::connection conn(get_db_conn_str("account"));
     pqxx::work txn(conn);
     pqxx::result db_res(txn.exec(query_str));
     txn.commit();
@@ -95,12 +138,12 @@ class TAccountServiceHandler : public BaseServer, public TAccountServiceIf {
         "INSERT INTO Accounts (created_at, username, password, first_name, "
             "last_name) "
         "VALUES (extract(epoch from now()), '%s', '%s', '%s', '%s') "
-        "RETURNING id, created_at";
+        "RETURNING id, created_at, change_seq";
     snprintf(query_str, sizeof(query_str), query_fmt, username.c_str(),
                password.c_str(), first_name.c_str(), last_name.c_str());
 
     // Execute query.
-    pqxx::connection conn(account_db_conn_str);
+    pqxx::connection conn(get_db_conn_str("account"));
     pqxx::work txn(conn);
     pqxx::result db_res;
     try {
@@ -109,8 +152,12 @@ class TAccountServiceHandler : public BaseServer, public TAccountServiceIf {
     catch (pqxx::sql_error& e) {
       throw TAccountUsernameAlreadyExistsException();
     }
+    queue_change(txn, db_res[0][0].as<int>(), db_res[0][2].as<int64_t>(),
+        "created");
     txn.commit();
     conn.disconnect();
+    mark_db_write("account", request_metadata.requester_id);
+    publish_changes();
 
     // Build account (standard mode).
     _return.id = db_res[0][0].as<int>();
@@ -123,6 +170,11 @@ class TAccountServiceHandler : public BaseServer, public TAccountServiceIf {
 
   void retrieve_standard_account(TAccount& _return,
       const TRequestMetadata& request_metadata, int32_t account_id) {
+    // Check cache.
+    uint64_t cache_generation;
+    if (_account_cache.get(account_id, _return, cache_generation))
+      return;
+
     // Build query string.
     char query_str[1024];
     const char *query_fmt = \
@@ -131,12 +183,17 @@ class TAccountServiceHandler : public BaseServer, public TAccountServiceIf {
         "WHERE id = %d";
     snprintf(query_str, sizeof(query_str), query_fmt, account_id);
 
-    // Execute query.
-    pqxx::connection conn(account_db_conn_str);
-    pqxx::work txn(conn);
+    // Execute query. Accounts that are cached are read from the primary, as
+    // a lagging replica would fill the cache with a row that every requester
+    // then reads.
+    auto conn = _account_cache.enabled() ?
+        std::make_unique<pqxx::connection>(get_db_conn_str("account")) :
+        connect_db_replica<pqxx::connection>("account",
+            request_metadata.requester_id);
+    pqxx::work txn(*conn);
     pqxx::result db_res(txn.exec(query_str));
     txn.commit();
-    conn.disconnect();
+    conn->disconnect();
 
     // Check if account exists.
     if (db_res.begin() == db_res.end())
@@ -149,6 +206,9 @@ class TAccountServiceHandler : public BaseServer, public TAccountServiceIf {
     _return.username = db_res[0][2].as<std::string>();
     _return.first_name = db_res[0][3].as<std::string>();
     _return.last_name = db_res[0][4].as<std::string>();
+    // The account is not cached if it was updated or deleted since the miss,
+    // as the row read may predate the change.
+    _account_cache.put(account_id, _return, cache_generation);
   }
 
   void retrieve_expanded_account(TAccount& _return,
@@ -207,22 +267,29 @@ class TAccountServiceHandler : public BaseServer, public TAccountServiceIf {
     char query_str[1024];
     const char *query_fmt = \
         "UPDATE Accounts "
-        "SET password = '%s', first_name = '%s', last_name = '%s' "
+        "SET password = '%s', first_name = '%s', last_name = '%s', "
+            "sessions_revoked_at = (extract(epoch from now()) * 1000)::bigint, "
+            "change_seq = change_seq + 1 "
         "WHERE id = %d "
-        "RETURNING created_at, active, username";
+        "RETURNING created_at, active, username, change_seq";
     snprintf(query_str, sizeof(query_str), query_fmt, password.c_str(),
               first_name.c_str(), last_name.c_str(), account_id);
 
     // Execute query.
-    pqxx::connection conn(account_db_conn_str);
+    pqxx::connection conn(get_db_conn_str("account"));
     pqxx::work txn(conn);
     pqxx::result db_res(txn.exec(query_str));
+    if (db_res.begin() != db_res.end())
+      queue_change(txn, account_id, db_res[0][3].as<int64_t>(), "updated");
     txn.commit();
     conn.disconnect();
+    mark_db_write("account", request_metadata.requester_id);
+    _account_cache.erase(account_id);
 
     // Check if account exists.
     if (db_res.begin() == db_res.end())
       throw TAccountNotFoundException();
+    publish_changes();
 
     // Build account (standard mode).
     _return.id = account_id;
@@ -243,21 +310,52 @@ class TAccountServiceHandler : public BaseServer, public TAccountServiceIf {
     char query_str[1024];
     const char *query_fmt = \
         "UPDATE Accounts "
-        "SET active = FALSE "
+        "SET active = FALSE, "
+            "sessions_revoked_at = (extract(epoch from now()) * 1000)::bigint, "
+            "change_seq = change_seq + 1 "
         "WHERE id = %d "
-        "RETURNING id";
+        "RETURNING id, change_seq";
     snprintf(query_str, sizeof(query_str), query_fmt, account_id);
 
     // Execute query.
-    pqxx::connection conn(account_db_conn_str);
+    pqxx::connection conn(get_db_conn_str("account"));
     pqxx::work txn(conn);
     pqxx::result db_res(txn.exec(query_str));
+    if (db_res.begin() != db_res.end())
+      queue_change(txn, account_id, db_res[0][1].as<int64_t>(), "deleted");
     txn.commit();
     conn.disconnect();
+    mark_db_write("account", request_metadata.requester_id);
+    _account_cache.erase(account_id);
 
     // Check if account exists.
     if (db_res.begin() == db_res.end())
       throw TAccountNotFoundException();
+    publish_changes();
+  }
+
+  void list_session_revocations(std::map<int32_t, int64_t>& _return,
+      const TRequestMetadata& request_metadata, const int64_t since) {
+    // Build query string.
+    char query_str[1024];
+    const char *query_fmt = \
+        "SELECT id, sessions_revoked_at "
+        "FROM Accounts "
+        "WHERE sessions_revoked_at > %lld";
+    snprintf(query_str, sizeof(query_str), query_fmt,
+        static_cast<long long>(since));
+
+    // Execute query.
+    // NOTE: Revocations are read from the primary, so that they are never
+    // missed because of replication lag.
+    pqxx::connection conn(get_db_conn_str("account"));
+    pqxx::work txn(conn);
+    pqxx::result db_res(txn.exec(query_str));
+    txn.commit();
+    conn.disconnect();
+
+    for (auto row : db_res)
+      _return[row["id"].as<int>()] = row["sessions_revoked_at"].as<int64_t>();
   }
 };
 
@@ -269,6 +367,10 @@ int main(int argc, char** argv) {
       ("host", "", cxxopts::value<std::string>()->default_value("0.0.0.0"))
       ("port", "", cxxopts::value<int>())
       ("threads", "", cxxopts::value<int>())
+      ("server_mode", "", cxxopts::value<std::string>()->default_value(
+          "threaded"))
+      ("io_threads", "", cxxopts::value<int>()->default_value("1"))
+      ("queue_depth", "", cxxopts::value<int>()->default_value("0"))
       ("backend_filepath", "", cxxopts::value<std::string>()->default_value(
           "/etc/opt/BuzzBlogApp/backend.yml"))
       ("postgres_user", "", cxxopts::value<std::string>()->default_value(
@@ -276,34 +378,50 @@ int main(int argc, char** argv) {
       ("postgres_password", "", cxxopts::value<std::string>()->default_value(
           "postgres"))
       ("postgres_dbname", "", cxxopts::value<std::string>()->default_value(
-          "postgres"));
+          "postgres"))
+      ("cache_capacity", "", cxxopts::value<int>()->default_value("10000"))
+      ("cache_ttl_ms", "", cxxopts::value<int>()->default_value("5000"))
+      ("cache_stats_interval_s", "", cxxopts::value<int>()->default_value(
+          "60"))
+      ("change_log", "", cxxopts::value<bool>()->default_value("false"))
+      ("change_log_dirpath", "", cxxopts::value<std::string>()->default_value(
+          "/var/opt/BuzzBlogApp/changes"));
 
   // Parse command-line arguments.
   auto result = options.parse(argc, argv);
   std::string host = result["host"].as<std::string>();
   int port = result["port"].as<int>();
   int threads = result["threads"].as<int>();
+  std::string server_mode = result["server_mode"].as<std::string>();
+  int io_threads = result["io_threads"].as<int>();
+  int queue_depth = result["queue_depth"].as<int>();
   std::string backend_filepath = result["backend_filepath"].as<std::string>();
   std::string postgres_user = result["postgres_user"].as<std::string>();
   std::string postgres_password = result["postgres_password"].as<std::string>();
   std::string postgres_dbname = result["postgres_dbname"].as<std::string>();
+  int cache_capacity = result["cache_capacity"].as<int>();
+  int cache_ttl_ms = result["cache_ttl_ms"].as<int>();
+  int cache_stats_interval_s = result["cache_stats_interval_s"].as<int>();
+  bool change_log = result["change_log"].as<bool>();
+  std::string change_log_dirpath =
+      result["change_log_dirpath"].as<std::string>();
 
   // Initialize logger.
   auto logger = spdlog::basic_logger_mt("logger", "/tmp/calls.log");
   logger->set_pattern("[%H:%M:%S.%F] pid=%P tid=%t %v");
 
   // Create server.
-  TThreadedServer server(
+  auto server = BaseServer::create_server(
       std::make_shared<TAccountServiceProcessor>(
           std::make_shared<TAccountServiceHandler>(backend_filepath,
-              postgres_user, postgres_password, postgres_dbname)),
-      std::make_shared<TServerSocket>(host, port),
-      std::make_shared<TBufferedTransportFactory>(),
-      std::make_shared<TBinaryProtocolFactory>());
-  server.setConcurrentClientLimit(threads);
+              postgres_user, postgres_password, postgres_dbname, cache_capacity,
+              cache_ttl_ms, cache_stats_interval_s, change_log,
+              change_log_dirpath)),
+      backend_filepath, "account", host, port, server_mode, threads, io_threads,
+      queue_depth);
 
   // Serve requests.
-  server.serve();
+  server->serve();
 
   return 0;
 }
@@ -4,12 +4,29 @@
 TODO : Sample string decribing the purpose of this file.
 """
 
+import base64
+import binascii
+import collections
+import concurrent.futures
+import hashlib
+import hmac
+import json
+import os
 import random
+import socket
+import threading
+import time
+import urllib.parse
 
 import flask
 import flask_httpauth
 import spdlog as spd
 import yaml
+try:
+    import uwsgi
+except ImportError:
+    # Not running under uWSGI, so responses are not cached.
+    uwsgi = None
 
 from buzzblog.account_client import Client as AccountClient
 from buzzblog.follow_client import Client as FollowClient
@@ -20,34 +37,647 @@ from buzzblog.gen.ttypes import *
 
 class ThriftClientFactory:
     """ TODO : Class description """
+    BACKEND_FILENAME = "/etc/opt/BuzzBlogApp/backend.yml"
+    RELOAD_INTERVAL = 1.0
+
     def __init__(self):
-        backend_filename = "/etc/opt/BuzzBlogApp/backend.yml"
-        with open(backend_filename, encoding="utf-8") as backend_file:
+        self._lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        self._backend_mtime = os.stat(self.BACKEND_FILENAME).st_mtime_ns
+        self._load_backend()
+
+    def _load_backend(self):
+        """Read the replica lists and codecs of every service."""
+        with open(self.BACKEND_FILENAME, encoding="utf-8") as backend_file:
             backend = yaml.safe_load(backend_file)
-            self._account_servers = backend["account"]["service"]
-            self._follow_servers = backend["follow"]["service"]
-            self._like_servers = backend["like"]["service"]
-            self._post_servers = backend["post"]["service"]
+        servers = {
+            service: backend[service]["service"]
+            for service in ["account", "follow", "like", "post"]
+        }
+        # A service without replicas could not be called.
+        for service, replicas in servers.items():
+            if not isinstance(replicas, list) or not replicas:
+                raise ValueError("no replicas of service " + service)
+        codecs = {
+            service: {
+                "transport": backend[service].get("transport", "buffered"),
+                "protocol": backend[service].get("protocol", "binary")
+            } for service in ["account", "follow", "like", "post"]
+        }
+        # Swap both maps at once. Clients already handed out keep their
+        # connections, so calls to removed replicas finish normally.
+        self._backend = (servers, codecs)
+
+    def _reload_backend(self):
+        """Reload the configuration if backend.yml changed on disk.
+
+        The file is stat'ed at most once every RELOAD_INTERVAL seconds. A
+        configuration that fails to parse or has a service without replicas is
+        ignored and the previous one is kept.
+        """
+        now = time.monotonic()
+        if now - self._checked_at < self.RELOAD_INTERVAL:
+            return
+        with self._lock:
+            if now - self._checked_at < self.RELOAD_INTERVAL:
+                return
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.BACKEND_FILENAME).st_mtime_ns
+                if mtime == self._backend_mtime:
+                    return
+                self._backend_mtime = mtime
+                self._load_backend()
+            except (OSError, KeyError, TypeError, ValueError, yaml.YAMLError):
+                pass
+
+    def _select_server(self, service):
+        self._reload_backend()
+        servers, codecs = self._backend
+        server = random.choice(servers[service])
+        return server.split(':')[0], int(server.split(':')[1]), codecs[service]
 
     def get_account_client(self):
         """ TODO : Method description """
-        server = random.choice(self._account_servers)
-        return AccountClient(server.split(':')[0], int(server.split(':')[1]))
+        host, port, codec = self._select_server("account")
+        return AccountClient(host, port, **codec)
 
     def get_follow_client(self):
         """ TODO : Method description """
-        server = random.choice(self._follow_servers)
-        return FollowClient(server.split(':')[0], int(server.split(':')[1]))
+        host, port, codec = self._select_server("follow")
+        return FollowClient(host, port, **codec)
 
     def get_like_client(self):
         """ TODO : Method description """
-        server = random.choice(self._like_servers)
-        return LikeClient(server.split(':')[0], int(server.split(':')[1]))
+        host, port, codec = self._select_server("like")
+        return LikeClient(host, port, **codec)
 
     def get_post_client(self):
         """ TODO : Method description """
-        server = random.choice(self._post_servers)
-        return PostClient(server.split(':')[0], int(server.split(':')[1]))
+        host, port, codec = self._select_server("post")
+        return PostClient(host, port, **codec)
+
+class SessionManager:
+    """Issue and verify signed session tokens.
+
+    A token holds an account id, its issue time, and its expiration time,
+    signed with HMAC-SHA256, so it is verified without calling the account
+    service. Sessions of an account are revoked when it is updated or deleted.
+    Revocations are polled from the account service at most once every
+    'revocation_poll_interval_s' seconds.
+    """
+    CONF_FILENAME = "/etc/opt/BuzzBlogApp/apigateway.yml"
+    # Revocations committed up to this long after their time are still seen.
+    REVOCATION_POLL_OVERLAP_MS = 5000
+
+    def __init__(self, account_client_factory):
+        with open(self.CONF_FILENAME, encoding="utf-8") as conf_file:
+            conf = yaml.safe_load(conf_file)
+        self._secret = conf["session_secret"].encode("utf-8")
+        self._ttl = conf.get("session_ttl_s", 3600)
+        self._poll_interval = conf.get("revocation_poll_interval_s", 1.0)
+        self._account_client_factory = account_client_factory
+        self._lock = threading.Lock()
+        self._polled_at = 0.0
+        # Revocations older than a token lifetime cannot invalidate a token.
+        self._revoked_since = int((time.time() - self._ttl) * 1000)
+        self._revocations = {}
+
+    def _sign(self, payload):
+        return base64.urlsafe_b64encode(hmac.new(self._secret, payload,
+            hashlib.sha256).digest()).rstrip(b"=")
+
+    def create_session(self, account_id):
+        """Return a new token of 'account_id' and its expiration time."""
+        expires_at = int(time.time()) + self._ttl
+        payload = base64.urlsafe_b64encode("{}:{}:{}".format(account_id,
+            int(time.time() * 1000), expires_at).encode("utf-8")).rstrip(b"=")
+        return (payload + b"." + self._sign(payload)).decode("utf-8"), \
+            expires_at
+
+    def _decode(self, token):
+        """Return the account id, issue time, and expiration time of 'token',
+        or None if its signature is invalid."""
+        try:
+            payload, signature = token.encode("utf-8").split(b".")
+            if not hmac.compare_digest(signature, self._sign(payload)):
+                return None
+            account_id, issued_at, expires_at = [int(field) for field in
+                base64.urlsafe_b64decode(payload + b"=" * (-len(payload) % 4))
+                    .decode("utf-8").split(":")]
+        except (ValueError, binascii.Error, UnicodeError):
+            return None
+        return account_id, issued_at, expires_at
+
+    def get_expiration_time(self, token):
+        """Return the expiration time of 'token', or None if it is invalid."""
+        session = self._decode(token)
+        return session[2] if session is not None else None
+
+    def verify_session(self, token):
+        """Return the account id of 'token', or None if it is invalid."""
+        session = self._decode(token)
+        if session is None:
+            return None
+        account_id, issued_at, expires_at = session
+        if expires_at < time.time():
+            return None
+        self._poll_revocations()
+        if issued_at <= self._revocations.get(account_id, 0):
+            return None
+        return account_id
+
+    def revoke_sessions(self, account_id):
+        """Revoke the sessions of 'account_id' in this process right away."""
+        self._revocations[account_id] = int(time.time() * 1000)
+
+    def _poll_revocations(self):
+        now = time.monotonic()
+        if now - self._polled_at < self._poll_interval:
+            return
+        with self._lock:
+            if now - self._polled_at < self._poll_interval:
+                return
+            self._polled_at = now
+            since = self._revoked_since - self.REVOCATION_POLL_OVERLAP_MS
+            try:
+                with self._account_client_factory() as account_client:
+                    revocations = account_client.list_session_revocations(
+                        request_metadata=TRequestMetadata(
+                            id="session_revocations"),
+                        since=since)
+            except Exception:
+                # Keep the known revocations, and retry at the next poll.
+                return
+            for account_id, revoked_at in revocations.items():
+                if revoked_at > self._revocations.get(account_id, 0):
+                    self._revocations[account_id] = revoked_at
+                self._revoked_since = max(self._revoked_since, revoked_at)
+            # Forget revocations older than any unexpired token.
+            expired_at = int((time.time() - self._ttl) * 1000)
+            for account_id, revoked_at in list(self._revocations.items()):
+                if revoked_at < expired_at:
+                    del self._revocations[account_id]
+
+
+class QueryResolver:
+    """Resolve a query over accounts, follows, likes, and posts.
+
+    A query maps names to selections of entities by type and id. A selection
+    may include the lists related to its entity (with "limit" and "offset",
+    and a selection of their elements) and the entities embedded in it, e.g.:
+
+        {"profile": {"type": "account", "id": 42, "expanded": true,
+            "posts": {"limit": 10, "offset": 0},
+            "followers": {"limit": 10, "offset": 0,
+                "follower": {"expanded": true}}}}
+
+    The query is resolved one level at a time. The backend calls of a level
+    are deduplicated and made concurrently, and their results are reused by
+    the rest of the query, so each distinct lookup costs one RPC. The posts
+    of a level are retrieved with a single RPC.
+    """
+    # Lists related to each type of entity, with the type of their elements
+    # and the query field set to the id of the entity.
+    RELATED_LISTS = {
+        "account": {
+            "posts": ("post", "author_id"),
+            "followers": ("follow", "followee_id"),
+            "followees": ("follow", "follower_id"),
+            "likes": ("like", "account_id")
+        },
+        "follow": {},
+        "like": {},
+        "post": {
+            "likes": ("like", "post_id")
+        }
+    }
+    # Entities embedded in each type of entity, with their type.
+    EMBEDDED_ENTITIES = {
+        "account": {},
+        "follow": {"follower": "account", "followee": "account"},
+        "like": {"account": "account", "post": "post"},
+        "post": {"author": "account"}
+    }
+    LIST_QUERY_TYPES = {
+        "follow": TFollowQuery,
+        "like": TLikeQuery,
+        "post": TPostQuery
+    }
+    NOT_FOUND_EXCEPTIONS = (TAccountNotFoundException,
+        TFollowNotFoundException, TLikeNotFoundException,
+        TPostNotFoundException)
+    MAX_DEPTH = 4
+    MAX_SELECTIONS = 20
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 100
+    # Maximum number of entities a query may return. It bounds the posts of a
+    # level, which are retrieved with a single call of up to 1000 posts.
+    MAX_ENTITIES = 1000
+    MAX_CONCURRENT_CALLS = 8
+
+    # A node of the query: the output of an entity or of a list of entities
+    # of type 'kind', to be stored at 'container[key]'. Its value is the result
+    # of the backend 'call' or, if there is no call, 'obj'.
+    _Node = collections.namedtuple("_Node", ["kind", "is_list", "call", "obj",
+        "selection", "container", "key"])
+
+    def __init__(self, request_metadata, client_factory):
+        self._request_metadata = request_metadata
+        self._client_factory = client_factory
+        self._results = {}
+
+    @classmethod
+    def validate(cls, query):
+        """Raise ValueError if 'query' is malformed."""
+        if not isinstance(query, dict) or not query:
+            raise ValueError("query must be a non-empty object")
+        if len(query) > cls.MAX_SELECTIONS:
+            raise ValueError("query has more than {} selections".format(
+                cls.MAX_SELECTIONS))
+        n_entities = 0
+        for selection in query.values():
+            if not isinstance(selection, dict) or \
+                    selection.get("type") not in cls.RELATED_LISTS or \
+                    not cls._is_int(selection.get("id")):
+                raise ValueError("selection must have a type and an id")
+            n_entities += cls._validate_selection(selection["type"],
+                cls._strip(selection, ["type", "id"]), 1)
+        if n_entities > cls.MAX_ENTITIES:
+            raise ValueError("query may return more than {} entities".format(
+                cls.MAX_ENTITIES))
+
+    @classmethod
+    def _validate_selection(cls, kind, selection, depth):
+        """Return the maximum number of entities returned by 'selection'."""
+        if depth > cls.MAX_DEPTH:
+            raise ValueError("query is too deep")
+        n_entities = 1
+        for name, value in selection.items():
+            if kind == "account" and name == "expanded":
+                if not isinstance(value, bool):
+                    raise ValueError("expanded must be a boolean")
+            elif name in cls.RELATED_LISTS[kind] and isinstance(value, dict):
+                if not all(cls._is_int(value.get(key, 0)) and
+                        value.get(key, 0) >= 0 for key in ["limit", "offset"]):
+                    raise ValueError("limit and offset must be integers")
+                limit = value.get("limit", cls.DEFAULT_LIMIT)
+                if limit > cls.MAX_LIMIT:
+                    raise ValueError("limit must be at most {}".format(
+                        cls.MAX_LIMIT))
+                n_entities += limit * cls._validate_selection(
+                    cls.RELATED_LISTS[kind][name][0],
+                    cls._strip(value, ["limit", "offset"]), depth + 1)
+            elif name in cls.EMBEDDED_ENTITIES[kind] and \
+                    isinstance(value, dict):
+                n_entities += cls._validate_selection(
+                    cls.EMBEDDED_ENTITIES[kind][name], value, depth + 1)
+            else:
+                raise ValueError("invalid field {} of {}".format(name, kind))
+        return n_entities
+
+    @staticmethod
+    def _is_int(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    @staticmethod
+    def _strip(selection, keys):
+        return {name: value for name, value in selection.items()
+            if name not in keys}
+
+    def resolve(self, query):
+        """Return the result of 'query', which must be valid."""
+        result = {}
+        level = [self._entity_node(selection["type"], selection["id"], None,
+                self._strip(selection, ["type", "id"]), result, name)
+            for name, selection in query.items()]
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.MAX_CONCURRENT_CALLS) as executor:
+            while level:
+                calls = list(set(node.call for node in level
+                    if node.call is not None) - set(self._results))
+                # Posts are retrieved with a single call.
+                post_calls = [call for call in calls
+                    if call[1] == "retrieve_expanded_post"]
+                calls = [call for call in calls if call not in post_calls]
+                if post_calls:
+                    calls.append(("post", "retrieve_posts",
+                        [call[2] for call in post_calls], True))
+                for call, value in zip(calls, executor.map(self._call, calls)):
+                    if call[1] == "retrieve_posts":
+                        posts = {post.id: post for post in value or []}
+                        for post_call in post_calls:
+                            self._results[post_call] = posts.get(post_call[2])
+                    else:
+                        self._results[call] = value
+                level = [child for node in level for child in self._build(node)]
+        return result
+
+    def _call(self, call):
+        service, method, *args = call
+        if method.startswith("list_"):
+            field, entity_id, limit, offset = args
+            args = [self.LIST_QUERY_TYPES[service](**{field: entity_id}), limit,
+                offset]
+        get_client = getattr(self._client_factory,
+            "get_{}_client".format(service))
+        with get_client() as client:
+            try:
+                return getattr(client, method)(self._request_metadata, *args)
+            except self.NOT_FOUND_EXCEPTIONS:
+                return None
+
+    def _entity_node(self, kind, entity_id, obj, selection, container, key):
+        # Embedded accounts are standard, so expanded ones are retrieved.
+        if kind == "account" and selection.get("expanded"):
+            call = ("account", "retrieve_expanded_account", entity_id)
+        elif obj is None:
+            call = (kind, "retrieve_{}_{}".format(
+                "standard" if kind == "account" else "expanded", kind),
+                entity_id)
+        else:
+            call = None
+        return self._Node(kind, False, call, obj, selection, container, key)
+
+    def _build(self, node):
+        """Store the output of 'node' and return its child nodes."""
+        value = self._results[node.call] if node.call is not None else node.obj
+        if value is None:
+            node.container[node.key] = None
+            return []
+        if node.is_list:
+            output = [None] * len(value)
+            node.container[node.key] = output
+            return [self._entity_node(node.kind, entity.id, entity,
+                    node.selection, output, i)
+                for i, entity in enumerate(value)]
+        output = self.to_object(node.kind, value)
+        node.container[node.key] = output
+        children = []
+        for name, selection in node.selection.items():
+            if name in self.RELATED_LISTS[node.kind]:
+                kind, field = self.RELATED_LISTS[node.kind][name]
+                call = (kind, "list_{}s".format(kind), field, value.id,
+                    selection.get("limit", self.DEFAULT_LIMIT),
+                    selection.get("offset", 0))
+                children.append(self._Node(kind, True, call, None,
+                    self._strip(selection, ["limit", "offset"]), output, name))
+            elif name in self.EMBEDDED_ENTITIES[node.kind]:
+                entity = getattr(value, name)
+                children.append(self._entity_node(
+                    self.EMBEDDED_ENTITIES[node.kind][name], entity.id, entity,
+                    selection, output, name))
+        return children
+
+    @classmethod
+    def to_object(cls, kind, entity):
+        """Return the JSON object of 'entity', of type 'kind'."""
+        if kind == "account":
+            obj = {
+              "object": "account",
+              "mode": "standard",
+              "id": entity.id,
+              "created_at": entity.created_at,
+              "active": entity.active,
+              "username": entity.username,
+              "first_name": entity.first_name,
+              "last_name": entity.last_name
+            }
+            if entity.follows_you is not None:
+                obj.update({
+                  "mode": "expanded",
+                  "follows_you": entity.follows_you,
+                  "followed_by_you": entity.followed_by_you,
+                  "n_followers": entity.n_followers,
+                  "n_following": entity.n_following,
+                  "n_posts": entity.n_posts,
+                  "n_likes": entity.n_likes
+                })
+            return obj
+        if kind == "follow":
+            return {
+              "object": "follow",
+              "mode": "expanded",
+              "id": entity.id,
+              "created_at": entity.created_at,
+              "follower_id": entity.follower_id,
+              "followee_id": entity.followee_id,
+              "follower": cls.to_object("account", entity.follower),
+              "followee": cls.to_object("account", entity.followee)
+            }
+        if kind == "like":
+            return {
+              "object": "like",
+              "mode": "expanded",
+              "id": entity.id,
+              "created_at": entity.created_at,
+              "account_id": entity.account_id,
+              "post_id": entity.post_id,
+              "account": cls.to_object("account", entity.account),
+              "post": cls.to_object("post", entity.post)
+            }
+        return {
+          "object": "post",
+          "mode": "expanded",
+          "id": entity.id,
+          "created_at": entity.created_at,
+          "active": entity.active,
+          "text": entity.text,
+          "author_id": entity.author_id,
+          "author": cls.to_object("account", entity.author),
+          "n_likes": entity.n_likes
+        }
+
+
+class BatchRunner:
+    """Run the sub-requests of a batch concurrently.
+
+    A batch is a list of sub-requests ({"method", "path", "body"}), which are
+    independent of each other. They are dispatched to the views of the
+    application, authenticated as the requester of the batch, with request ids
+    derived from the one of the batch.
+    """
+    CONF_FILENAME = SessionManager.CONF_FILENAME
+
+    def __init__(self, application):
+        with open(self.CONF_FILENAME, encoding="utf-8") as conf_file:
+            conf = yaml.safe_load(conf_file)
+        self._max_size = conf.get("batch_max_size", 50)
+        self._max_concurrent_requests = conf.get(
+            "batch_max_concurrent_requests", 8)
+        self._application = application
+
+    def validate(self, sub_requests):
+        """Raise ValueError if 'sub_requests' is not a valid batch."""
+        if not isinstance(sub_requests, list) or not sub_requests:
+            raise ValueError("batch must be a non-empty list")
+        if len(sub_requests) > self._max_size:
+            raise ValueError("batch has more than {} sub-requests".format(
+                self._max_size))
+        for sub_request in sub_requests:
+            if not isinstance(sub_request, dict) or \
+                    not isinstance(sub_request.get("method"), str) or \
+                    not isinstance(sub_request.get("path"), str) or \
+                    not sub_request["path"].startswith("/"):
+                raise ValueError("sub-request must have a method and a path")
+
+    def run(self, request_id, authorization, sub_requests):
+        """Return the status and body of each sub-request of a valid batch.
+
+        Sub-request i has request id '<request_id>.<i>' and is sent with the
+        'authorization' header.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(
+                len(sub_requests), self._max_concurrent_requests)) as executor:
+            return list(executor.map(self._run_sub_request,
+                ["{}.{}".format(request_id, i)
+                    for i in range(len(sub_requests))],
+                [authorization] * len(sub_requests), sub_requests))
+
+    def _run_sub_request(self, request_id, authorization, sub_request):
+        url = urllib.parse.urlsplit(sub_request["path"])
+        # Batches are not nested.
+        if url.path.rstrip("/") == "/batch":
+            return {"status": 400, "body": {}}
+        query_string = [(name, value)
+            for name, value in urllib.parse.parse_qsl(url.query)
+            if name != "request_id"] + [("request_id", request_id)]
+        with self._application.test_request_context(url.path,
+                method=sub_request["method"].upper(),
+                query_string=query_string, json=sub_request.get("body"),
+                headers={"Authorization": authorization}):
+            try:
+                response = self._application.full_dispatch_request()
+            except Exception:
+                # Only this sub-request fails, as it would outside a batch.
+                return {"status": 500, "body": {}}
+        return {"status": response.status_code, "body": response.get_json()}
+
+
+class ResponseCache:
+    """Cache the responses of GET routes across the workers of a host.
+
+    Responses are kept in the uWSGI cache 'responses' (see uwsgi.ini), which
+    lives in a memory-mapped file shared by all workers. A response is cached
+    by route and requester, with the versions of the objects it was built
+    from (e.g., ("account", 42)). Write routes change the versions of the
+    objects they modify, so a cached response is served without calling the
+    backend while the versions of its objects are unchanged, and for at most
+    'response_cache_ttl_s' seconds. Responses have strong ETags, and requests
+    with a matching If-None-Match header get a 304 response.
+    """
+    CONF_FILENAME = SessionManager.CONF_FILENAME
+    CACHE_NAME = "responses"
+
+    def __init__(self):
+        with open(self.CONF_FILENAME, encoding="utf-8") as conf_file:
+            conf = yaml.safe_load(conf_file)
+        self._ttl = conf.get("response_cache_ttl_s", 10)
+
+    def _get_version(self, obj, create=False):
+        key = "version:{}:{}".format(*obj)
+        version = uwsgi.cache_get(key, self.CACHE_NAME)
+        if version is None and create:
+            # Another worker may create it first.
+            uwsgi.cache_set(key, os.urandom(8).hex().encode("utf-8"), 0,
+                self.CACHE_NAME)
+            version = uwsgi.cache_get(key, self.CACHE_NAME)
+        return version.decode("utf-8") if version is not None else None
+
+    def _respond(self, etag, body):
+        response = flask.Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        return response.make_conditional(flask.request)
+
+    def lookup(self, key, objects):
+        """Return the cached response of 'key' if it is still valid.
+
+        Return None instead if there is no valid response, along with the
+        versions of 'objects', to be passed to 'store'.
+        """
+        if uwsgi is None:
+            return None, {}
+        # Read the versions before the backend is called, so that writes
+        # made in the meantime invalidate the response.
+        versions = {"{}:{}".format(*obj): self._get_version(obj, create=True)
+            for obj in objects}
+        entry = uwsgi.cache_get("response:" + key, self.CACHE_NAME)
+        if entry is None:
+            return None, versions
+        header, body = entry.split(b"\n", 1)
+        header = json.loads(header)
+        for obj, version in header["versions"].items():
+            if self._get_version(obj.split(":")) != version:
+                return None, versions
+        return self._respond(header["etag"], body), versions
+
+    def store(self, key, versions, data, objects=()):
+        """Cache 'data' as the response of 'key' and return it.
+
+        The response depends on the objects whose 'versions' were returned by
+        'lookup', and on 'objects'.
+        """
+        body = flask.json.dumps(data).encode("utf-8")
+        etag = hashlib.sha256(body).hexdigest()
+        if uwsgi is not None:
+            versions = dict(versions)
+            versions.update({"{}:{}".format(*obj): self._get_version(obj,
+                create=True) for obj in objects})
+            if None not in versions.values():
+                header = json.dumps({"etag": etag, "versions": versions})
+                uwsgi.cache_update("response:" + key,
+                    header.encode("utf-8") + b"\n" + body, self._ttl,
+                    self.CACHE_NAME)
+        return self._respond(etag, body)
+
+    def invalidate(self, *objects):
+        """Invalidate the cached responses built from 'objects'."""
+        if uwsgi is None:
+            return
+        for obj in objects:
+            uwsgi.cache_update("version:{}:{}".format(*obj),
+                os.urandom(8).hex().encode("utf-8"), 0, self.CACHE_NAME)
+
+
+class EventPublisher:
+    """Publish change events to the stream servers of all API gateways.
+
+    An event has a name, the object it is about, and the accounts it is
+    pushed to (see 'StreamServer' in stream.py). It is sent as a JSON datagram
+    to each of 'stream_servers', without waiting: events are a hint to poll,
+    so a lost event only delays a client until its next poll.
+    """
+    CONF_FILENAME = SessionManager.CONF_FILENAME
+
+    def __init__(self):
+        with open(self.CONF_FILENAME, encoding="utf-8") as conf_file:
+            conf = yaml.safe_load(conf_file)
+        self._servers = [(server.split(":")[0], int(server.split(":")[1]))
+            for server in conf.get("stream_servers", [])]
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    @property
+    def enabled(self):
+        """Whether events are published to any stream server."""
+        return bool(self._servers)
+
+    def publish(self, event, data, account_ids=(), followers_of=None):
+        """Publish 'event' about 'data'.
+
+        The event is pushed to 'account_ids', and to the followers of account
+        'followers_of'.
+        """
+        message = {"event": event, "data": data,
+            "account_ids": list(account_ids)}
+        if followers_of is not None:
+            message["followers_of"] = followers_of
+        message = json.dumps(message).encode("utf-8")
+        for server in self._servers:
+            try:
+                self._socket.sendto(message, server)
+            except OSError:
+                pass
 
 
 def setup_app():
@@ -64,15 +694,21 @@ def setup_logger():
 
 
 app = setup_app()
-auth = flask_httpauth.HTTPBasicAuth()
+basic_auth = flask_httpauth.HTTPBasicAuth()
+token_auth = flask_httpauth.HTTPTokenAuth(scheme="Bearer")
+auth = flask_httpauth.MultiAuth(basic_auth, token_auth)
 thrift_client_factory = ThriftClientFactory()
+session_manager = SessionManager(thrift_client_factory.get_account_client)
+batch_runner = BatchRunner(app)
+response_cache = ResponseCache()
+event_publisher = EventPublisher()
 logger = setup_logger()
 
 
-@auth.verify_password
+@basic_auth.verify_password
 def verify_password(username, password):
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"])
+    request_metadata = new_request_metadata()
     with thrift_client_factory.get_account_client() as account_client:
         try:
             account = account_client.authenticate_user(
@@ -83,10 +719,63 @@ def verify_password(username, password):
     return account
 
 
+@token_auth.verify_token
+def verify_token(token):
+    """ TODO : Method description """
+    account_id = session_manager.verify_session(token)
+    return TAccount(id=account_id) if account_id is not None else None
+
+
+def new_request_metadata(**kwargs):
+    """Return the metadata of the calls made for the current request.
+
+    Calls carry the request id and a scope id minted for the request, which
+    scopes the reads memoized by the clients and the services to it. Request
+    ids are chosen by clients, so they may be reused.
+    """
+    if "scope_id" not in flask.g:
+        flask.g.scope_id = os.urandom(16).hex()
+    return TRequestMetadata(id=flask.request.args["request_id"],
+        scope_id=flask.g.scope_id, **kwargs)
+
+
+def list_etag(version, *params):
+    """Return a weak ETag of the current list request, at 'version'.
+
+    The ETag identifies the route, its query string (other than the request
+    id), 'params', and the version of the listed objects.
+    """
+    args = sorted((key, value) for key, value in flask.request.args.items()
+        if key != "request_id")
+    return hashlib.sha256(json.dumps([flask.request.path, args, params,
+        version]).encode("utf-8")).hexdigest()
+
+
+def not_modified(etag):
+    """ TODO : Method description """
+    response = flask.Response(status=304)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+@app.route("/session", methods=["POST"])
+@basic_auth.login_required
+def create_session():
+    """ TODO : Method description """
+    account = basic_auth.current_user()
+    token, expires_at = session_manager.create_session(account.id)
+    return {
+      "object": "session",
+      "account_id": account.id,
+      "token": token,
+      "expires_at": expires_at
+    }
+
+
 @app.route("/account", methods=["POST"])
 def create_account():
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"])
+    request_metadata = new_request_metadata()
     params = flask.request.get_json()
     try:
         username = params["username"]
@@ -120,15 +809,21 @@ def create_account():
 @auth.login_required
 def retrieve_account(account_id):
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
+    cache_key = "/account/{}:{}".format(account_id,
+        request_metadata.requester_id)
+    response, versions = response_cache.lookup(cache_key,
+        [("account", account_id)])
+    if response is not None:
+        return response
     with thrift_client_factory.get_account_client() as account_client:
         try:
             account = account_client.retrieve_expanded_account(
                 request_metadata=request_metadata, account_id=account_id)
         except TAccountNotFoundException:
             return ({}, 404)
-    return {
+    return response_cache.store(cache_key, versions, {
       "object": "account",
       "mode": "expanded",
       "id": account.id,
@@ -143,14 +838,14 @@ def retrieve_account(account_id):
       "n_following": account.n_following,
       "n_posts": account.n_posts,
       "n_likes": account.n_likes
-    }
+    })
 
 
 @app.route("/account/<int:account_id>", methods=["PUT"])
 @auth.login_required
 def update_account(account_id):
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
     params = flask.request.get_json()
     try:
@@ -170,6 +865,8 @@ def update_account(account_id):
             return ({}, 403)
         except TAccountNotFoundException:
             return ({}, 404)
+    session_manager.revoke_sessions(account_id)
+    response_cache.invalidate(("account", account_id))
     return {
       "object": "account",
       "mode": "standard",
@@ -186,7 +883,7 @@ def update_account(account_id):
 @auth.login_required
 def delete_account(account_id):
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
     with thrift_client_factory.get_account_client() as account_client:
         try:
@@ -196,14 +893,42 @@ def delete_account(account_id):
             return ({}, 403)
         except TAccountNotFoundException:
             return ({}, 404)
+    session_manager.revoke_sessions(account_id)
+    response_cache.invalidate(("account", account_id))
     return {}
 
 
+@app.route("/account/<int:account_id>/suggestions", methods=["GET"])
+@auth.login_required
+def list_suggested_accounts(account_id):
+    """ TODO : Method description """
+    request_metadata = new_request_metadata(
+        requester_id=auth.current_user().id)
+    try:
+        limit = int(flask.request.args.get("limit", 10))
+    except ValueError:
+        return ({}, 400)
+    with thrift_client_factory.get_follow_client() as follow_client:
+        accounts = follow_client.list_suggested_accounts(
+            request_metadata=request_metadata, account_id=account_id,
+            limit=limit)
+    return flask.jsonify([{
+      "object": "account",
+      "mode": "standard",
+      "id": account.id,
+      "created_at": account.created_at,
+      "active": account.active,
+      "username": account.username,
+      "first_name": account.first_name,
+      "last_name": account.last_name
+    } for account in accounts])
+
+
 @app.route("/follow", methods=["POST"])
 @auth.login_required
 def follow_account():
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
     params = flask.request.get_json()
     try:
@@ -216,7 +941,9 @@ def follow_account():
                 account_id=account_id)
         except TFollowAlreadyExistsException:
             return ({}, 400)
-    return {
+    response_cache.invalidate(("account", request_metadata.requester_id),
+        ("account", account_id))
+    follow = {
       "object": "follow",
       "mode": "standard",
       "id": follow.id,
@@ -224,13 +951,16 @@ def follow_account():
       "follower_id": follow.follower_id,
       "followee_id": follow.followee_id
     }
+    event_publisher.publish("follow", follow,
+        account_ids=[follow["followee_id"]])
+    return follow
 
 
 @app.route("/follow/<int:follow_id>", methods=["GET"])
 @auth.login_required
 def retrieve_follow(follow_id):
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
     with thrift_client_factory.get_follow_client() as follow_client:
         try:
@@ -272,16 +1002,29 @@ def retrieve_follow(follow_id):
 @auth.login_required
 def delete_follow(follow_id):
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
     with thrift_client_factory.get_follow_client() as follow_client:
         try:
+            # Retrieve the follow first, to invalidate its accounts.
+            follow = follow_client.retrieve_standard_follow(
+                request_metadata=request_metadata, follow_id=follow_id)
             follow_client.delete_follow(request_metadata=request_metadata,
                 follow_id=follow_id)
         except TFollowNotAuthorizedException:
             return ({}, 403)
         except TFollowNotFoundException:
             return ({}, 404)
+    response_cache.invalidate(("account", follow.follower_id),
+        ("account", follow.followee_id))
+    event_publisher.publish("unfollow", {
+      "object": "follow",
+      "mode": "standard",
+      "id": follow.id,
+      "created_at": follow.created_at,
+      "follower_id": follow.follower_id,
+      "followee_id": follow.followee_id
+    })
     return {}
 
 
@@ -289,7 +1032,7 @@ def delete_follow(follow_id):
 @auth.login_required
 def list_follows():
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
     params = flask.request.get_json()
     try:
@@ -342,7 +1085,7 @@ def list_follows():
 @auth.login_required
 def create_post():
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
     params = flask.request.get_json()
     try:
@@ -355,7 +1098,8 @@ def create_post():
                 text=text)
         except TPostInvalidAttributesException:
             return ({}, 400)
-    return {
+    response_cache.invalidate(("account", request_metadata.requester_id))
+    post = {
       "object": "post",
       "mode": "standard",
       "id": post.id,
@@ -364,21 +1108,27 @@ def create_post():
       "text": post.text,
       "author_id": post.author_id
     }
+    event_publisher.publish("post", post, followers_of=post["author_id"])
+    return post
 
 
 @app.route("/post/<int:post_id>", methods=["GET"])
 @auth.login_required
 def retrieve_post(post_id):
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
+    cache_key = "/post/{}:{}".format(post_id, request_metadata.requester_id)
+    response, versions = response_cache.lookup(cache_key, [("post", post_id)])
+    if response is not None:
+        return response
     with thrift_client_factory.get_post_client() as post_client:
         try:
             post = post_client.retrieve_expanded_post(
                 request_metadata=request_metadata, post_id=post_id)
         except TPostNotFoundException:
             return ({}, 404)
-    return {
+    return response_cache.store(cache_key, versions, {
       "object": "post",
       "mode": "expanded",
       "id": post.id,
@@ -397,14 +1147,14 @@ def retrieve_post(post_id):
         "last_name": post.author.last_name
       },
       "n_likes": post.n_likes
-    }
+    }, [("account", post.author_id)])
 
 
 @app.route("/post/<int:post_id>", methods=["DELETE"])
 @auth.login_required
 def delete_post(post_id):
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
     with thrift_client_factory.get_post_client() as post_client:
         try:
@@ -414,6 +1164,9 @@ def delete_post(post_id):
             return ({}, 403)
         except TPostNotFoundException:
             return ({}, 404)
+    # Only the author can delete a post.
+    response_cache.invalidate(("post", post_id),
+        ("account", request_metadata.requester_id))
     return {}
 
 
@@ -421,23 +1174,131 @@ def delete_post(post_id):
 @auth.login_required
 def list_posts():
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
+        requester_id=auth.current_user().id)
+    etag = None
+    if "ids" in flask.request.args:
+        # Retrieve the posts of a list of ids.
+        try:
+            post_ids = [int(post_id)
+                for post_id in flask.request.args["ids"].split(",")]
+        except ValueError:
+            return ({}, 400)
+        with thrift_client_factory.get_post_client() as post_client:
+            try:
+                posts = post_client.retrieve_posts(
+                    request_metadata=request_metadata, post_ids=post_ids,
+                    expanded=True)
+            except TPostInvalidAttributesException:
+                return ({}, 400)
+    else:
+        params = flask.request.get_json()
+        try:
+            limit = params["limit"]
+            offset = params["offset"]
+        except KeyError:
+            return ({}, 400)
+        author_id = int(flask.request.args["author_id"]) \
+            if "author_id" in flask.request.args else None
+        query = TPostQuery(author_id=author_id)
+        with thrift_client_factory.get_post_client() as post_client:
+            if author_id is not None:
+                # Read the version before the posts, so that posts created or
+                # deleted in the meantime change the ETag of the next request.
+                version = post_client.get_version_of_posts_by_author(
+                    request_metadata=request_metadata, author_id=author_id)
+                etag = list_etag(version, limit, offset)
+                if flask.request.if_none_match.contains_weak(etag):
+                    return not_modified(etag)
+            try:
+                posts = post_client.list_posts(
+                    request_metadata=request_metadata, query=query,
+                    limit=limit, offset=offset)
+            except TAccountNotFoundException:
+                return ({}, 400)
+    response = flask.jsonify([{
+      "object": "post",
+      "mode": "expanded",
+      "id": post.id,
+      "created_at": post.created_at,
+      "active": post.active,
+      "text": post.text,
+      "author_id": post.author_id,
+      "author": {
+        "object": "account",
+        "mode": "standard",
+        "id": post.author.id,
+        "created_at": post.author.created_at,
+        "active": post.author.active,
+        "username": post.author.username,
+        "first_name": post.author.first_name,
+        "last_name": post.author.last_name
+      },
+      "n_likes": post.n_likes
+    } for post in posts])
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+@app.route("/post/search", methods=["GET"])
+@auth.login_required
+def search_posts():
+    """ TODO : Method description """
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
-    params = flask.request.get_json()
     try:
-        limit = params["limit"]
-        offset = params["offset"]
-    except KeyError:
+        query = flask.request.args["q"]
+        limit = int(flask.request.args.get("limit", 10))
+    except (KeyError, ValueError):
         return ({}, 400)
-    author_id = int(flask.request.args["author_id"]) \
-        if "author_id" in flask.request.args else None
-    query = TPostQuery(author_id=author_id)
+    cursor = flask.request.args.get("cursor", "")
     with thrift_client_factory.get_post_client() as post_client:
         try:
-            posts = post_client.list_posts(request_metadata=request_metadata,
-                query=query, limit=limit, offset=offset)
-        except TAccountNotFoundException:
+            page = post_client.search_posts(request_metadata=request_metadata,
+                query=query, cursor=cursor, limit=limit)
+        except TPostInvalidAttributesException:
             return ({}, 400)
+    response = {
+      "posts": [{
+        "object": "post",
+        "mode": "expanded",
+        "id": post.id,
+        "created_at": post.created_at,
+        "active": post.active,
+        "text": post.text,
+        "author_id": post.author_id,
+        "author": {
+          "object": "account",
+          "mode": "standard",
+          "id": post.author.id,
+          "created_at": post.author.created_at,
+          "active": post.author.active,
+          "username": post.author.username,
+          "first_name": post.author.first_name,
+          "last_name": post.author.last_name
+        },
+        "n_likes": post.n_likes
+      } for post in page.posts]
+    }
+    if page.next_cursor is not None:
+        response["next_cursor"] = page.next_cursor
+    return response
+
+
+@app.route("/post/trending", methods=["GET"])
+@auth.login_required
+def list_trending_posts():
+    """ TODO : Method description """
+    request_metadata = new_request_metadata(
+        requester_id=auth.current_user().id)
+    try:
+        limit = int(flask.request.args.get("limit", 10))
+    except ValueError:
+        return ({}, 400)
+    with thrift_client_factory.get_like_client() as like_client:
+        posts = like_client.list_trending_posts(
+            request_metadata=request_metadata, limit=limit)
     return flask.jsonify([{
       "object": "post",
       "mode": "expanded",
@@ -464,7 +1325,7 @@ def list_posts():
 @auth.login_required
 def like_post():
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
     params = flask.request.get_json()
     try:
@@ -477,7 +1338,9 @@ def like_post():
                 post_id=post_id)
         except TLikeAlreadyExistsException:
             return ({}, 400)
-    return {
+    response_cache.invalidate(("account", request_metadata.requester_id),
+        ("post", post_id))
+    like = {
       "object": "like",
       "mode": "standard",
       "id": like.id,
@@ -485,14 +1348,21 @@ def like_post():
       "account_id": like.account_id,
       "post_id": like.post_id
     }
+    if event_publisher.enabled:
+        # Likes are pushed to the author of the post.
+        with thrift_client_factory.get_post_client() as post_client:
+            post = post_client.retrieve_standard_post(
+                request_metadata=request_metadata, post_id=post_id)
+        event_publisher.publish("like", like, account_ids=[post.author_id])
+    return like
 
 
 @app.route("/like/<int:like_id>", methods=["GET"])
 @auth.login_required
 def retrieve_like(like_id):
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
-        request_metadata=request_metadata)
+    request_metadata = new_request_metadata(
+        requester_id=auth.current_user().id)
     with thrift_client_factory.get_like_client() as like_client:
         try:
             like = like_client.retrieve_like(request_metadata=request_metadata,
@@ -543,16 +1413,21 @@ def retrieve_like(like_id):
 @auth.login_required
 def delete_like(like_id):
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
     with thrift_client_factory.get_like_client() as like_client:
         try:
+            # Retrieve the like first, to invalidate its account and post.
+            like = like_client.retrieve_standard_like(
+                request_metadata=request_metadata, like_id=like_id)
             like_client.delete_like(request_metadata=request_metadata,
                 like_id=like_id)
         except TLikeNotAuthorizedException:
             return ({}, 403)
         except TLikeNotFoundException:
             return ({}, 404)
+    response_cache.invalidate(("account", like.account_id),
+        ("post", like.post_id))
     return {}
 
 
@@ -560,7 +1435,7 @@ def delete_like(like_id):
 @auth.login_required
 def list_likes():
     """ TODO : Method description """
-    request_metadata = TRequestMetadata(id=flask.request.args["request_id"],
+    request_metadata = new_request_metadata(
         requester_id=auth.current_user().id)
     params = flask.request.get_json()
     try:
@@ -573,7 +1448,15 @@ def list_likes():
     post_id = int(flask.request.args["post_id"]) \
         if "post_id" in flask.request.args else None
     query = TLikeQuery(account_id=account_id, post_id=post_id)
+    etag = None
     with thrift_client_factory.get_like_client() as like_client:
+        if post_id is not None and account_id is None:
+            # Read the version before the likes (see 'list_posts').
+            version = like_client.get_version_of_likes_of_post(
+                request_metadata=request_metadata, post_id=post_id)
+            etag = list_etag(version, limit, offset)
+            if flask.request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
         try:
             likes = like_client.list_likes(request_metadata=request_metadata,
                 query=query, limit=limit, offset=offset)
@@ -581,7 +1464,7 @@ def list_likes():
             return ({}, 400)
         except TPostNotFoundException:
             return ({}, 400)
-    return flask.jsonify([{
+    response = flask.jsonify([{
       "object": "like",
       "mode": "expanded",
       "id": like.id,
@@ -619,3 +1502,36 @@ def list_likes():
         "n_likes": like.post.n_likes
       }
     } for like in likes])
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+@app.route("/query", methods=["POST"])
+@auth.login_required
+def run_query():
+    """ TODO : Method description """
+    request_metadata = new_request_metadata(
+        requester_id=auth.current_user().id)
+    query = flask.request.get_json()
+    try:
+        QueryResolver.validate(query)
+    except ValueError:
+        return ({}, 400)
+    return QueryResolver(request_metadata, thrift_client_factory).resolve(query)
+
+
+@app.route("/batch", methods=["POST"])
+@auth.login_required
+def run_batch():
+    """ TODO : Method description """
+    sub_requests = flask.request.get_json()
+    try:
+        batch_runner.validate(sub_requests)
+    except ValueError:
+        return ({}, 400)
+    # Sub-requests are authenticated with a new session of the requester,
+    # which is verified without calling the account service.
+    token, _ = session_manager.create_session(auth.current_user().id)
+    return flask.jsonify(batch_runner.run(flask.request.args["request_id"],
+        "Bearer " + token, sub_requests))
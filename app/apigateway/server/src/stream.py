@@ -0,0 +1,254 @@
+# Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+# Systems
+"""
+Stream server of the API Gateway, started by uWSGI next to its workers (see
+'attach-daemon' in uwsgi.ini). It serves GET /stream, which pushes the change
+events published by the API gateways (see 'EventPublisher' in apigateway.py)
+to the accounts they concern, as Server-Sent Events.
+"""
+
+import asyncio
+import collections
+import json
+import os
+import resource
+import time
+import urllib.parse
+
+import yaml
+
+from apigateway import SessionManager, session_manager, thrift_client_factory
+from buzzblog.gen.ttypes import *
+
+
+class EventProtocol(asyncio.DatagramProtocol):
+    """Receive change events, one JSON object per datagram."""
+
+    def __init__(self, stream_server):
+        self._stream_server = stream_server
+
+    def datagram_received(self, data, addr):
+        try:
+            self._stream_server.dispatch(json.loads(data))
+        except (ValueError, KeyError, TypeError):
+            # Ignore malformed events.
+            pass
+
+
+class StreamServer:
+    """Push change events to the clients of GET /stream.
+
+    Clients are authenticated with a session token, sent as
+    'Authorization: Bearer <token>' or as query parameter 'token' (browsers
+    cannot set headers on an EventSource). Each event is pushed to the
+    accounts listed in its 'account_ids', and to the connected accounts that
+    follow the account in its 'followers_of'. The accounts followed by a
+    connected account are loaded from the follow service when it connects,
+    and kept up to date from 'follow' and 'unfollow' events.
+
+    All streams are served by one asyncio event loop, so an idle stream only
+    costs its socket and an empty queue. Streams that fall more than
+    'stream_max_pending_events' events behind are disconnected, and idle
+    streams get a comment every 'stream_keepalive_interval_s' seconds, so that
+    proxies keep them open and closed connections are detected. A stream is
+    closed when its session expires, and within a keep-alive interval of its
+    session being revoked, since sessions are verified again at that
+    interval.
+    """
+    CONF_FILENAME = SessionManager.CONF_FILENAME
+    MAX_REQUEST_HEAD_SIZE = 8192
+    REQUEST_HEAD_TIMEOUT = 10.0
+    FOLLOWS_PAGE_SIZE = 100
+
+    def __init__(self):
+        with open(self.CONF_FILENAME, encoding="utf-8") as conf_file:
+            conf = yaml.safe_load(conf_file)
+        self._port = conf.get("stream_port", 82)
+        self._keepalive_interval = conf.get("stream_keepalive_interval_s", 30)
+        self._max_pending_events = conf.get("stream_max_pending_events", 100)
+        self._max_followees = conf.get("stream_max_followees", 1000)
+        # Queues of the streams of each connected account, with their writers.
+        self._streams = collections.defaultdict(dict)
+        # Accounts followed by each connected account, and the reverse.
+        self._followees = {}
+        self._followers = collections.defaultdict(set)
+
+    async def serve(self):
+        """Receive events and serve streams until cancelled."""
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: EventProtocol(self),
+            local_addr=("0.0.0.0", self._port))
+        server = await asyncio.start_server(self._handle_connection,
+            "0.0.0.0", self._port, limit=self.MAX_REQUEST_HEAD_SIZE,
+            backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    def dispatch(self, event):
+        """Push 'event' to the streams it concerns."""
+        name, data = event["event"], event["data"]
+        if name == "follow" and data["follower_id"] in self._followees:
+            self._add_followee(data["follower_id"], data["followee_id"])
+        elif name == "unfollow" and data["follower_id"] in self._followees:
+            self._remove_followee(data["follower_id"], data["followee_id"])
+        account_ids = set(event.get("account_ids", []))
+        if "followers_of" in event:
+            account_ids |= self._followers.get(event["followers_of"], set())
+        message = "event: {}\ndata: {}\n\n".format(name,
+            json.dumps(data)).encode("utf-8")
+        for account_id in account_ids:
+            for queue, writer in list(self._streams.get(account_id,
+                    {}).items()):
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    writer.transport.abort()
+
+    def _add_followee(self, account_id, followee_id):
+        self._followees[account_id].add(followee_id)
+        self._followers[followee_id].add(account_id)
+
+    def _remove_followee(self, account_id, followee_id):
+        self._followees[account_id].discard(followee_id)
+        self._followers[followee_id].discard(account_id)
+        if not self._followers[followee_id]:
+            del self._followers[followee_id]
+
+    def _list_followees(self, account_id):
+        """Return the ids of the accounts followed by 'account_id'.
+
+        Called in a worker thread, since the follow client is blocking.
+        """
+        request_metadata = TRequestMetadata(
+            id="stream:" + os.urandom(8).hex(), requester_id=account_id)
+        query = TFollowQuery(follower_id=account_id)
+        followee_ids = set()
+        with thrift_client_factory.get_follow_client() as follow_client:
+            while len(followee_ids) < self._max_followees:
+                follows = follow_client.list_follows(
+                    request_metadata=request_metadata, query=query,
+                    limit=self.FOLLOWS_PAGE_SIZE, offset=len(followee_ids))
+                followee_ids.update(follow.followee_id for follow in follows)
+                if len(follows) < self.FOLLOWS_PAGE_SIZE:
+                    break
+        return followee_ids
+
+    async def _subscribe(self, account_id, queue, writer):
+        self._streams[account_id][queue] = writer
+        if account_id in self._followees:
+            return
+        # Other streams of the account find its followees being loaded.
+        self._followees[account_id] = set()
+        try:
+            followee_ids = await asyncio.get_running_loop().run_in_executor(
+                None, self._list_followees, account_id)
+        except Exception:
+            self._unsubscribe(account_id, queue)
+            raise
+        if account_id in self._followees:
+            for followee_id in followee_ids:
+                self._add_followee(account_id, followee_id)
+
+    def _unsubscribe(self, account_id, queue):
+        del self._streams[account_id][queue]
+        if self._streams[account_id]:
+            return
+        del self._streams[account_id]
+        for followee_id in list(self._followees.pop(account_id, ())):
+            self._followers[followee_id].discard(account_id)
+            if not self._followers[followee_id]:
+                del self._followers[followee_id]
+
+    async def _verify_session(self, token):
+        """Return the account id of session 'token', or None if it is
+        invalid."""
+        # Sessions are verified in a worker thread, since revocations are
+        # polled from the account service.
+        return await asyncio.get_running_loop().run_in_executor(None,
+            session_manager.verify_session, token)
+
+    async def _authenticate(self, reader):
+        """Read a request and return the account id it is authenticated as,
+        and its session token.
+
+        Return None instead of the account id if the request is not an
+        authenticated GET /stream, along with the status of the response.
+        """
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"),
+                self.REQUEST_HEAD_TIMEOUT)
+            request_line, *header_lines = \
+                head.decode("latin-1").split("\r\n")[:-2]
+            method, target, _ = request_line.split(" ")
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, ValueError):
+            return None, None, "400 Bad Request"
+        url = urllib.parse.urlsplit(target)
+        if method != "GET" or url.path.rstrip("/") != "/stream":
+            return None, None, "404 Not Found"
+        headers = {}
+        for header_line in header_lines:
+            name, _, value = header_line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        token = urllib.parse.parse_qs(url.query).get("token", [""])[0]
+        scheme, _, credentials = headers.get("authorization", "").partition(
+            " ")
+        if scheme.lower() == "bearer":
+            token = credentials.strip()
+        if not token:
+            return None, None, "401 Unauthorized"
+        account_id = await self._verify_session(token)
+        if account_id is None:
+            return None, None, "401 Unauthorized"
+        return account_id, token, "200 OK"
+
+    async def _handle_connection(self, reader, writer):
+        account_id, token, status = await self._authenticate(reader)
+        queue = asyncio.Queue(self._max_pending_events)
+        if account_id is not None:
+            try:
+                await self._subscribe(account_id, queue, writer)
+            except Exception:
+                account_id, status = None, "503 Service Unavailable"
+        if account_id is None:
+            writer.write("HTTP/1.1 {}\r\nContent-Length: 0\r\n"
+                "Connection: close\r\n\r\n".format(status).encode("utf-8"))
+            writer.close()
+            return
+        try:
+            # The stream lasts until the connection is closed, so it has no
+            # length.
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/event-stream\r\n"
+                b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+            expires_at = session_manager.get_expiration_time(token)
+            verified_at = time.time()
+            while time.time() < expires_at:
+                try:
+                    message = await asyncio.wait_for(queue.get(),
+                        min(self._keepalive_interval,
+                            expires_at - time.time()))
+                except asyncio.TimeoutError:
+                    message = b": keepalive\n\n"
+                if time.time() - verified_at >= self._keepalive_interval:
+                    if await self._verify_session(token) is None:
+                        break
+                    verified_at = time.time()
+                writer.write(message)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._unsubscribe(account_id, queue)
+            writer.close()
+
+
+def raise_open_files_limit():
+    """Allow as many streams as the hard limit of open files does."""
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+
+
+if __name__ == "__main__":
+    raise_open_files_limit()
+    asyncio.run(StreamServer().serve())
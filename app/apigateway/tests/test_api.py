@@ -1,6 +1,7 @@
 # Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
 # Systems
 
+import json
 import time
 import unittest
 
@@ -10,7 +11,10 @@ from requests.auth import HTTPBasicAuth
 
 SERVER_HOSTNAME = "localhost"
 SERVER_PORT = 8080
+STREAM_PORT = 9080
 URL = "{hostname}:{port}".format(hostname=SERVER_HOSTNAME, port=SERVER_PORT)
+STREAM_URL = "{hostname}:{port}".format(hostname=SERVER_HOSTNAME,
+    port=STREAM_PORT)
 
 
 class TestService(unittest.TestCase):
@@ -35,6 +39,388 @@ class TestService(unittest.TestCase):
     self.assertEqual("John", response["first_name"])
     self.assertEqual("Doe", response["last_name"])
 
+  def test_session_token_200(self):
+    # Create an account and a session.
+    r = requests.post("http://{url}/account".format(url=URL),
+        params={"request_id": "1"},
+        json={
+          "username": "jane.doe",
+          "password": "strongpasswd",
+          "first_name": "Jane",
+          "last_name": "Doe"
+        }
+    )
+    self.assertEqual(200, r.status_code)
+    account_id = r.json()["id"]
+    r = requests.post("http://{url}/session".format(url=URL),
+        params={"request_id": "2"},
+        auth=HTTPBasicAuth("jane.doe", "strongpasswd"))
+    self.assertEqual(200, r.status_code)
+    response = r.json()
+    self.assertEqual("session", response["object"])
+    self.assertEqual(account_id, response["account_id"])
+    self.assertAlmostEqual(time.time(), response["expires_at"], delta=7200)
+    headers = {"Authorization": "Bearer " + response["token"]}
+    # Use the session, and a tampered copy of it.
+    r = requests.get("http://{url}/account/{id}".format(url=URL,
+        id=account_id), params={"request_id": "3"}, headers=headers)
+    self.assertEqual(200, r.status_code)
+    r = requests.get("http://{url}/account/{id}".format(url=URL,
+        id=account_id), params={"request_id": "4"},
+        headers={"Authorization": headers["Authorization"][:-4] + "AAAA"})
+    self.assertEqual(401, r.status_code)
+    # Updating the account revokes the session, but not Basic authentication.
+    r = requests.put("http://{url}/account/{id}".format(url=URL,
+        id=account_id), params={"request_id": "5"}, headers=headers,
+        json={
+          "password": "strongerpasswd",
+          "first_name": "Jane",
+          "last_name": "Doe"
+        }
+    )
+    self.assertEqual(200, r.status_code)
+    r = requests.get("http://{url}/account/{id}".format(url=URL,
+        id=account_id), params={"request_id": "6"}, headers=headers)
+    self.assertEqual(401, r.status_code)
+    r = requests.get("http://{url}/account/{id}".format(url=URL,
+        id=account_id), params={"request_id": "7"},
+        auth=HTTPBasicAuth("jane.doe", "strongerpasswd"))
+    self.assertEqual(200, r.status_code)
+
+  def test_query_200(self):
+    # Create an account with a post.
+    r = requests.post("http://{url}/account".format(url=URL),
+        params={"request_id": "1"},
+        json={
+          "username": "jim.doe",
+          "password": "strongpasswd",
+          "first_name": "Jim",
+          "last_name": "Doe"
+        }
+    )
+    self.assertEqual(200, r.status_code)
+    account_id = r.json()["id"]
+    auth = HTTPBasicAuth("jim.doe", "strongpasswd")
+    r = requests.post("http://{url}/post".format(url=URL),
+        params={"request_id": "2"}, auth=auth, json={"text": "Hello"})
+    self.assertEqual(200, r.status_code)
+    post_id = r.json()["id"]
+    # Query the account, its posts, and the author of each post.
+    r = requests.post("http://{url}/query".format(url=URL),
+        params={"request_id": "3"}, auth=auth,
+        json={
+          "profile": {"type": "account", "id": account_id, "expanded": True,
+              "posts": {"limit": 10, "offset": 0, "author": {}}},
+          "post": {"type": "post", "id": post_id},
+          "missing": {"type": "post", "id": -1}
+        }
+    )
+    self.assertEqual(200, r.status_code)
+    response = r.json()
+    self.assertEqual("expanded", response["profile"]["mode"])
+    self.assertEqual("jim.doe", response["profile"]["username"])
+    self.assertEqual([post_id],
+        [post["id"] for post in response["profile"]["posts"]])
+    self.assertEqual(account_id,
+        response["profile"]["posts"][0]["author"]["id"])
+    self.assertEqual("Hello", response["post"]["text"])
+    self.assertIsNone(response["missing"])
+    # Malformed queries are rejected.
+    r = requests.post("http://{url}/query".format(url=URL),
+        params={"request_id": "4"}, auth=auth,
+        json={"profile": {"type": "account", "id": account_id, "foo": {}}})
+    self.assertEqual(400, r.status_code)
+    # Queries that may return too many entities are rejected.
+    r = requests.post("http://{url}/query".format(url=URL),
+        params={"request_id": "5"}, auth=auth,
+        json={"profile": {"type": "account", "id": account_id,
+            "posts": {"limit": 101}}})
+    self.assertEqual(400, r.status_code)
+    r = requests.post("http://{url}/query".format(url=URL),
+        params={"request_id": "6"}, auth=auth,
+        json={"profile": {"type": "account", "id": account_id,
+            "followers": {"limit": 100, "follower": {
+                "posts": {"limit": 100}}}}})
+    self.assertEqual(400, r.status_code)
+    r = requests.post("http://{url}/query".format(url=URL),
+        params={"request_id": "7"}, auth=auth,
+        json={"post{}".format(i): {"type": "post", "id": post_id}
+            for i in range(21)})
+    self.assertEqual(400, r.status_code)
+
+  def test_batch_200(self):
+    # Create an account.
+    r = requests.post("http://{url}/account".format(url=URL),
+        params={"request_id": "1"},
+        json={
+          "username": "joe.doe",
+          "password": "strongpasswd",
+          "first_name": "Joe",
+          "last_name": "Doe"
+        }
+    )
+    self.assertEqual(200, r.status_code)
+    account_id = r.json()["id"]
+    auth = HTTPBasicAuth("joe.doe", "strongpasswd")
+    # Create posts and retrieve the account in one batch.
+    r = requests.post("http://{url}/batch".format(url=URL),
+        params={"request_id": "2"}, auth=auth,
+        json=[
+          {"method": "POST", "path": "/post", "body": {"text": "First"}},
+          {"method": "POST", "path": "/post", "body": {"text": "Second"}},
+          {"method": "GET", "path": "/account/{id}".format(id=account_id)},
+          {"method": "GET", "path": "/account/-1"}
+        ]
+    )
+    self.assertEqual(200, r.status_code)
+    response = r.json()
+    self.assertEqual([200, 200, 200, 404],
+        [item["status"] for item in response])
+    self.assertEqual(["First", "Second"],
+        [item["body"]["text"] for item in response[:2]])
+    self.assertEqual([account_id, account_id],
+        [item["body"]["author_id"] for item in response[:2]])
+    self.assertEqual("joe.doe", response[2]["body"]["username"])
+    # A sub-request that fails with an error does not fail the others (a list
+    # of posts requires a body).
+    r = requests.post("http://{url}/batch".format(url=URL),
+        params={"request_id": "3"}, auth=auth,
+        json=[
+          {"method": "GET", "path": "/post"},
+          {"method": "GET", "path": "/account/{id}".format(id=account_id)}
+        ]
+    )
+    self.assertEqual(200, r.status_code)
+    self.assertEqual([500, 200], [item["status"] for item in r.json()])
+    # Batches that are too large are rejected.
+    r = requests.post("http://{url}/batch".format(url=URL),
+        params={"request_id": "3"}, auth=auth,
+        json=[{"method": "GET", "path": "/account/-1"}] * 1000)
+    self.assertEqual(400, r.status_code)
+
+  def test_retrieve_account_etag(self):
+    # Create an account.
+    r = requests.post("http://{url}/account".format(url=URL),
+        params={"request_id": "1"},
+        json={
+          "username": "jill.doe",
+          "password": "strongpasswd",
+          "first_name": "Jill",
+          "last_name": "Doe"
+        }
+    )
+    self.assertEqual(200, r.status_code)
+    account_id = r.json()["id"]
+    auth = HTTPBasicAuth("jill.doe", "strongpasswd")
+    # Retrieve it twice, the second time with the ETag of the first.
+    r = requests.get("http://{url}/account/{id}".format(url=URL,
+        id=account_id), params={"request_id": "2"}, auth=auth)
+    self.assertEqual(200, r.status_code)
+    etag = r.headers["ETag"]
+    r = requests.get("http://{url}/account/{id}".format(url=URL,
+        id=account_id), params={"request_id": "3"}, auth=auth,
+        headers={"If-None-Match": etag})
+    self.assertEqual(304, r.status_code)
+    # Updating the account changes its ETag.
+    r = requests.put("http://{url}/account/{id}".format(url=URL,
+        id=account_id), params={"request_id": "4"}, auth=auth,
+        json={
+          "password": "strongpasswd",
+          "first_name": "Jillian",
+          "last_name": "Doe"
+        }
+    )
+    self.assertEqual(200, r.status_code)
+    r = requests.get("http://{url}/account/{id}".format(url=URL,
+        id=account_id), params={"request_id": "5"}, auth=auth,
+        headers={"If-None-Match": etag})
+    self.assertEqual(200, r.status_code)
+    self.assertNotEqual(etag, r.headers["ETag"])
+    self.assertEqual("Jillian", r.json()["first_name"])
+
+  def test_list_posts_etag(self):
+    # Create an account.
+    r = requests.post("http://{url}/account".format(url=URL),
+        params={"request_id": "1"},
+        json={
+          "username": "jack.doe",
+          "password": "strongpasswd",
+          "first_name": "Jack",
+          "last_name": "Doe"
+        }
+    )
+    self.assertEqual(200, r.status_code)
+    account_id = r.json()["id"]
+    auth = HTTPBasicAuth("jack.doe", "strongpasswd")
+    # List its posts twice, the second time with the ETag of the first.
+    r = requests.get("http://{url}/post".format(url=URL),
+        params={"request_id": "2", "author_id": account_id}, auth=auth,
+        json={"limit": 10, "offset": 0})
+    self.assertEqual(200, r.status_code)
+    self.assertEqual([], r.json())
+    etag = r.headers["ETag"]
+    r = requests.get("http://{url}/post".format(url=URL),
+        params={"request_id": "3", "author_id": account_id}, auth=auth,
+        json={"limit": 10, "offset": 0}, headers={"If-None-Match": etag})
+    self.assertEqual(304, r.status_code)
+    # Creating a post changes the ETag.
+    r = requests.post("http://{url}/post".format(url=URL),
+        params={"request_id": "4"}, auth=auth, json={"text": "Hello"})
+    self.assertEqual(200, r.status_code)
+    r = requests.get("http://{url}/post".format(url=URL),
+        params={"request_id": "5", "author_id": account_id}, auth=auth,
+        json={"limit": 10, "offset": 0}, headers={"If-None-Match": etag})
+    self.assertEqual(200, r.status_code)
+    self.assertNotEqual(etag, r.headers["ETag"])
+    self.assertEqual(["Hello"], [post["text"] for post in r.json()])
+
+  def test_search_posts_200(self):
+    # Create an account.
+    r = requests.post("http://{url}/account".format(url=URL),
+        params={"request_id": "1"},
+        json={
+          "username": "jane.roe",
+          "password": "strongpasswd",
+          "first_name": "Jane",
+          "last_name": "Roe"
+        }
+    )
+    self.assertEqual(200, r.status_code)
+    auth = HTTPBasicAuth("jane.roe", "strongpasswd")
+    # Create two posts sharing a word that no other post contains.
+    word = "apisearchword%d" % int(time.time())
+    for i in range(2):
+      r = requests.post("http://{url}/post".format(url=URL),
+          params={"request_id": "2"}, auth=auth,
+          json={"text": "Post {} with {}".format(i, word)})
+      self.assertEqual(200, r.status_code)
+    # Search them one at a time. The last page has no cursor.
+    r = requests.get("http://{url}/post/search".format(url=URL),
+        params={"request_id": "3", "q": word, "limit": 1}, auth=auth)
+    self.assertEqual(200, r.status_code)
+    self.assertEqual(1, len(r.json()["posts"]))
+    r = requests.get("http://{url}/post/search".format(url=URL),
+        params={"request_id": "4", "q": word, "limit": 1,
+            "cursor": r.json()["next_cursor"]}, auth=auth)
+    self.assertEqual(200, r.status_code)
+    self.assertEqual(1, len(r.json()["posts"]))
+    self.assertNotIn("next_cursor", r.json())
+    # Pages that are too large are rejected.
+    r = requests.get("http://{url}/post/search".format(url=URL),
+        params={"request_id": "5", "q": word, "limit": 1000}, auth=auth)
+    self.assertEqual(400, r.status_code)
+
+  def test_list_trending_posts_200(self):
+    # Create an account with two posts, and like both.
+    r = requests.post("http://{url}/account".format(url=URL),
+        params={"request_id": "1"},
+        json={
+          "username": "joe.roe",
+          "password": "strongpasswd",
+          "first_name": "Joe",
+          "last_name": "Roe"
+        }
+    )
+    self.assertEqual(200, r.status_code)
+    auth = HTTPBasicAuth("joe.roe", "strongpasswd")
+    for i in range(2):
+      r = requests.post("http://{url}/post".format(url=URL),
+          params={"request_id": "2"}, auth=auth, json={"text": "Trending"})
+      self.assertEqual(200, r.status_code)
+      r = requests.post("http://{url}/like".format(url=URL),
+          params={"request_id": "3"}, auth=auth,
+          json={"post_id": r.json()["id"]})
+      self.assertEqual(200, r.status_code)
+    # List trending posts, up to the limit.
+    r = requests.get("http://{url}/post/trending".format(url=URL),
+        params={"request_id": "4", "limit": 1}, auth=auth)
+    self.assertEqual(200, r.status_code)
+    self.assertEqual(1, len(r.json()))
+    self.assertEqual("expanded", r.json()[0]["mode"])
+
+  def test_reused_request_ids(self):
+    # Create three accounts.
+    account_ids = []
+    for username in ["ann.doe", "abe.doe", "amy.doe"]:
+      r = requests.post("http://{url}/account".format(url=URL),
+          params={"request_id": "1"},
+          json={
+            "username": username,
+            "password": "strongpasswd",
+            "first_name": "A",
+            "last_name": "Doe"
+          }
+      )
+      self.assertEqual(200, r.status_code)
+      account_ids.append(r.json()["id"])
+    ann_auth = HTTPBasicAuth("ann.doe", "strongpasswd")
+    abe_auth = HTTPBasicAuth("abe.doe", "strongpasswd")
+    # Requests that reuse an id do not share memoized reads, whether they are
+    # made by different requesters or follow a write.
+    r = requests.get("http://{url}/account/{id}".format(url=URL,
+        id=account_ids[2]), params={"request_id": "2"}, auth=ann_auth)
+    self.assertEqual(200, r.status_code)
+    self.assertFalse(r.json()["followed_by_you"])
+    r = requests.post("http://{url}/follow".format(url=URL),
+        params={"request_id": "2"}, auth=ann_auth,
+        json={"account_id": account_ids[2]})
+    self.assertEqual(200, r.status_code)
+    r = requests.get("http://{url}/account/{id}".format(url=URL,
+        id=account_ids[2]), params={"request_id": "2"}, auth=ann_auth)
+    self.assertEqual(200, r.status_code)
+    self.assertTrue(r.json()["followed_by_you"])
+    r = requests.get("http://{url}/account/{id}".format(url=URL,
+        id=account_ids[2]), params={"request_id": "2"}, auth=abe_auth)
+    self.assertEqual(200, r.status_code)
+    self.assertFalse(r.json()["followed_by_you"])
+
+  def test_stream_200(self):
+    # Create two accounts, the first following the second.
+    account_ids = []
+    for username in ["jay.doe", "jo.doe"]:
+      r = requests.post("http://{url}/account".format(url=URL),
+          params={"request_id": "1"},
+          json={
+            "username": username,
+            "password": "strongpasswd",
+            "first_name": "J",
+            "last_name": "Doe"
+          }
+      )
+      self.assertEqual(200, r.status_code)
+      account_ids.append(r.json()["id"])
+    r = requests.post("http://{url}/follow".format(url=URL),
+        params={"request_id": "2"},
+        auth=HTTPBasicAuth("jay.doe", "strongpasswd"),
+        json={"account_id": account_ids[1]})
+    self.assertEqual(200, r.status_code)
+    r = requests.post("http://{url}/session".format(url=URL),
+        params={"request_id": "3"},
+        auth=HTTPBasicAuth("jay.doe", "strongpasswd"))
+    self.assertEqual(200, r.status_code)
+    token = r.json()["token"]
+    # Streams require a valid session token.
+    r = requests.get("http://{url}/stream".format(url=STREAM_URL),
+        params={"token": token[:-4] + "AAAA"})
+    self.assertEqual(401, r.status_code)
+    # Open a stream of the first account, and create a post of the second.
+    r = requests.get("http://{url}/stream".format(url=STREAM_URL),
+        headers={"Authorization": "Bearer " + token}, stream=True,
+        timeout=60)
+    self.assertEqual(200, r.status_code)
+    self.assertEqual("text/event-stream", r.headers["Content-Type"])
+    time.sleep(1)
+    r_post = requests.post("http://{url}/post".format(url=URL),
+        params={"request_id": "4"},
+        auth=HTTPBasicAuth("jo.doe", "strongpasswd"), json={"text": "Hi"})
+    self.assertEqual(200, r_post.status_code)
+    # The post is pushed on the stream.
+    lines = (line for line in r.iter_lines(decode_unicode=True)
+        if line and not line.startswith(":"))
+    self.assertEqual("event: post", next(lines))
+    self.assertEqual(r_post.json(), json.loads(next(lines)[len("data: "):]))
+    r.close()
+
   # TODO: Test the other API methods.
 
 
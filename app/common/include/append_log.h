@@ -0,0 +1,136 @@
+// Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+// Systems
+
+#include <fcntl.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include <cstdio>
+#include <fstream>
+#include <mutex>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+
+// Durable append-only log of text records (one per line) with a single
+// consumer. Appended records are flushed to disk before 'append' returns. The
+// consumer reads records from its committed offset, which is also kept on
+// disk, so records are delivered at least once across crashes and in append
+// order. The log is truncated whenever the consumer catches up with it.
+class AppendLog {
+ public:
+  AppendLog(const std::string& dirpath, const std::string& name)
+  : _log_filepath(dirpath + "/" + name + ".log"),
+    _offset_filepath(dirpath + "/" + name + ".offset") {
+    _fd = open(_log_filepath.c_str(), O_RDWR | O_CREAT | O_APPEND, 0644);
+    if (_fd < 0)
+      throw std::runtime_error("Could not open " + _log_filepath);
+
+    // Drop the last record if it was only partially written.
+    auto size = lseek(_fd, 0, SEEK_END);
+    while (size > 0) {
+      char c;
+      if (pread(_fd, &c, 1, size - 1) != 1 || c == '\n')
+        break;
+      size--;
+    }
+    if (ftruncate(_fd, size) != 0)
+      throw std::runtime_error("Could not truncate " + _log_filepath);
+
+    // Load the committed offset. It can be past the end of the log if the
+    // server stopped while truncating it.
+    _offset = 0;
+    std::ifstream offset_file(_offset_filepath);
+    if (offset_file >> _offset && _offset > size)
+      _offset = 0;
+  }
+
+  ~AppendLog() {
+    close(_fd);
+  }
+
+  // Append 'record', which must not contain newlines, and flush it to disk.
+  void append(const std::string& record) {
+    append(std::vector<std::string>{record});
+  }
+
+  // Append 'records', which must not contain newlines, and flush them to disk
+  // at once.
+  void append(const std::vector<std::string>& records) {
+    std::string lines;
+    for (auto& record : records)
+      lines += record + "\n";
+    std::lock_guard<std::mutex> lock(_mutex);
+    if (write(_fd, lines.c_str(), lines.size()) !=
+        static_cast<ssize_t>(lines.size()) || fdatasync(_fd) != 0)
+      throw std::runtime_error("Could not append to " + _log_filepath);
+  }
+
+  // Read up to 'max_records' records after the committed offset. Set
+  // 'end_offset' to the offset to commit once they are processed.
+  std::vector<std::string> read(size_t max_records, off_t& end_offset) {
+    std::vector<std::string> records;
+    char buffer[65536];
+    std::lock_guard<std::mutex> lock(_mutex);
+    end_offset = _offset;
+    std::string partial;
+    while (records.size() < max_records) {
+      auto n = pread(_fd, buffer, sizeof(buffer),
+          end_offset + partial.size());
+      if (n <= 0)
+        break;
+      partial.append(buffer, n);
+      size_t start = 0, end;
+      while (records.size() < max_records &&
+          (end = partial.find('\n', start)) != std::string::npos) {
+        records.push_back(partial.substr(start, end - start));
+        start = end + 1;
+      }
+      end_offset += start;
+      partial.erase(0, start);
+    }
+    return records;
+  }
+
+  // Commit that all records before 'offset' were processed.
+  void commit(off_t offset) {
+    std::lock_guard<std::mutex> lock(_mutex);
+    // Truncate the log if all records were processed.
+    if (offset == lseek(_fd, 0, SEEK_END)) {
+      if (ftruncate(_fd, 0) != 0 || fdatasync(_fd) != 0)
+        throw std::runtime_error("Could not truncate " + _log_filepath);
+      offset = 0;
+    }
+    write_offset(offset);
+    _offset = offset;
+  }
+
+  // Return true if records are waiting to be processed.
+  bool has_pending_records() {
+    std::lock_guard<std::mutex> lock(_mutex);
+    return _offset < lseek(_fd, 0, SEEK_END);
+  }
+
+ private:
+  void write_offset(off_t offset) {
+    // Replace the offset file atomically.
+    auto tmp_filepath = _offset_filepath + ".tmp";
+    auto fd = open(tmp_filepath.c_str(), O_WRONLY | O_CREAT | O_TRUNC, 0644);
+    auto offset_str = std::to_string(offset) + "\n";
+    auto ok = fd >= 0 &&
+        write(fd, offset_str.c_str(), offset_str.size()) ==
+            static_cast<ssize_t>(offset_str.size()) &&
+        fsync(fd) == 0;
+    if (fd >= 0)
+      close(fd);
+    if (!ok || rename(tmp_filepath.c_str(), _offset_filepath.c_str()) != 0)
+      throw std::runtime_error("Could not write " + _offset_filepath);
+  }
+
+  std::string _log_filepath;
+  std::string _offset_filepath;
+  int _fd;
+  off_t _offset;
+  std::mutex _mutex;
+};
@@ -1,12 +1,31 @@
 // Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
 // Systems
 
+#include <sys/stat.h>
+
+#include <chrono>
+#include <deque>
 #include <iostream>
+#include <map>
 #include <memory>
+#include <mutex>
+#include <stdexcept>
 #include <string>
+#include <thread>
 #include <utility>
 #include <vector>
 
+#include <thrift/concurrency/ThreadFactory.h>
+#include <thrift/concurrency/ThreadManager.h>
+#include <thrift/protocol/TBinaryProtocol.h>
+#include <thrift/protocol/TCompactProtocol.h>
+#include <thrift/protocol/THeaderProtocol.h>
+#include <thrift/server/TNonblockingServer.h>
+#include <thrift/server/TThreadPoolServer.h>
+#include <thrift/server/TThreadedServer.h>
+#include <thrift/transport/TBufferTransports.h>
+#include <thrift/transport/TNonblockingServerSocket.h>
+#include <thrift/transport/TServerSocket.h>
 #include <yaml-cpp/yaml.h>
 
 #include <buzzblog/account_client.h>
@@ -17,163 +36,497 @@
 
 
 class BaseServer {
+ public:
+  // Return the transport factory that servers of 'service' must use, as set
+  // in the backend configuration file ("buffered", "framed", or "header").
+  static std::shared_ptr<apache::thrift::transport::TTransportFactory>
+  get_transport_factory(const std::string& backend_filepath,
+      const std::string& service) {
+    auto transport = get_transport(YAML::LoadFile(backend_filepath)[service]);
+    if (transport == "framed")
+      return std::make_shared<
+          apache::thrift::transport::TFramedTransportFactory>();
+    return std::make_shared<
+        apache::thrift::transport::TBufferedTransportFactory>();
+  }
+
+  // Return the protocol factory that servers of 'service' must use, as set
+  // in the backend configuration file ("binary" or "compact"). The header
+  // transport carries its own protocol identifier.
+  static std::shared_ptr<apache::thrift::protocol::TProtocolFactory>
+  get_protocol_factory(const std::string& backend_filepath,
+      const std::string& service) {
+    auto service_conf = YAML::LoadFile(backend_filepath)[service];
+    if (get_transport(service_conf) == "header")
+      return std::make_shared<
+          apache::thrift::protocol::THeaderProtocolFactory>();
+    if (get_protocol(service_conf) == "compact")
+      return std::make_shared<
+          apache::thrift::protocol::TCompactProtocolFactory>();
+    return std::make_shared<apache::thrift::protocol::TBinaryProtocolFactory>();
+  }
+
+  // Create a server of 'service' listening on 'host':'port'. Three server
+  // modes are supported:
+  // - "threaded": one thread per connection, with at most 'threads'
+  //   concurrent connections.
+  // - "threadpool": connections are served by a fixed pool of 'threads'
+  //   worker threads, with at most 'queue_depth' connections waiting for a
+  //   worker (0 means unbounded).
+  // - "nonblocking": 'io_threads' event loop threads multiplex all
+  //   connections and dispatch requests to a fixed pool of 'threads' worker
+  //   threads, with at most 'queue_depth' requests waiting for a worker (0
+  //   means unbounded). Idle connections cost no thread. This mode requires
+  //   the framed transport.
+  static std::shared_ptr<apache::thrift::server::TServer> create_server(
+      const std::shared_ptr<apache::thrift::TProcessor>& processor,
+      const std::string& backend_filepath, const std::string& service,
+      const std::string& host, int port, const std::string& server_mode,
+      int threads, int io_threads, int queue_depth) {
+    auto transport_factory = get_transport_factory(backend_filepath, service);
+    auto protocol_factory = get_protocol_factory(backend_filepath, service);
+    if (server_mode == "threaded") {
+      auto server = std::make_shared<apache::thrift::server::TThreadedServer>(
+          processor,
+          std::make_shared<apache::thrift::transport::TServerSocket>(host,
+              port),
+          transport_factory, protocol_factory);
+      server->setConcurrentClientLimit(threads);
+      return server;
+    }
+    auto thread_manager =
+        apache::thrift::concurrency::ThreadManager::newSimpleThreadManager(
+            threads, queue_depth);
+    thread_manager->threadFactory(
+        std::make_shared<apache::thrift::concurrency::ThreadFactory>());
+    thread_manager->start();
+    if (server_mode == "threadpool") {
+      return std::make_shared<apache::thrift::server::TThreadPoolServer>(
+          processor,
+          std::make_shared<apache::thrift::transport::TServerSocket>(host,
+              port),
+          transport_factory, protocol_factory, thread_manager);
+    }
+    if (server_mode == "nonblocking") {
+      if (get_transport(YAML::LoadFile(backend_filepath)[service]) !=
+          "framed")
+        throw std::invalid_argument(
+            "Nonblocking server requires the framed transport");
+      auto server =
+          std::make_shared<apache::thrift::server::TNonblockingServer>(
+              processor, protocol_factory,
+              std::make_shared<
+                  apache::thrift::transport::TNonblockingServerSocket>(host,
+                      port),
+              thread_manager);
+      server->setNumIOThreads(io_threads);
+      return server;
+    }
+    throw std::invalid_argument("Invalid server mode: " + server_mode);
+  }
+
+ private:
+  static std::string get_transport(const YAML::Node& service_conf) {
+    if (service_conf && service_conf["transport"])
+      return service_conf["transport"].as<std::string>();
+    return "buffered";
+  }
+
+  static std::string get_protocol(const YAML::Node& service_conf) {
+    if (service_conf && service_conf["protocol"])
+      return service_conf["protocol"].as<std::string>();
+    return "binary";
+  }
+
  protected:
   BaseServer(const std::string& backend_filepath,
       const std::string& postgres_user,
       const std::string& postgres_password,
-      const std::string& postgres_dbname) {
-    char conn_cstr[128];
-    const char *conn_fmt = "postgres://%s:%s@%s:%d/%s";
-
+      const std::string& postgres_dbname)
+  : _backend_filepath(backend_filepath), _postgres_user(postgres_user),
+    _postgres_password(postgres_password), _postgres_dbname(postgres_dbname) {
     // Parse configuration.
     std::cout << "Initializing BaseServer:" << std::endl;
-    auto backend = YAML::LoadFile(backend_filepath);
-    if (backend["account"]) {
-      // Load account service configuration.
-      auto account_service = backend["account"]["service"];
-      for (auto it = account_service.begin(); it != account_service.end();
-           it++) {
-        auto server = it->as<std::string>();
-        auto hostname = server.substr(0, server.find(":"));
-        auto port = std::stoi(server.substr(server.find(":") + 1));
-        this->account_service.push_back(std::make_pair(hostname, port));
-        std::cout << "\tAdded account service on " << \
-            hostname << ":" << port << std::endl;
+    _backend_mtime = get_backend_mtime();
+    load_backend();
+
+    // Watch the configuration file, so that servers and databases can be
+    // added or removed without restarting this server.
+    std::thread(&BaseServer::watch_backend, this).detach();
+  }
+
+  std::unique_ptr<account_service::Client> get_account_client() {
+    auto server = select_server("account");
+    return std::move(std::make_unique<account_service::Client>(
+        server.host, server.port, 10000, server.transport, server.protocol));
+  }
+
+  std::unique_ptr<follow_service::Client> get_follow_client() {
+    auto server = select_server("follow");
+    return std::move(std::make_unique<follow_service::Client>(
+        server.host, server.port, 10000, server.transport, server.protocol));
+  }
+
+  std::unique_ptr<like_service::Client> get_like_client() {
+    auto server = select_server("like");
+    return std::move(std::make_unique<like_service::Client>(
+        server.host, server.port, 10000, server.transport, server.protocol));
+  }
+
+  // Return the address ("host:port") of each server of 'service'.
+  std::vector<std::string> list_server_addresses(const std::string& service) {
+    std::vector<std::string> addresses;
+    std::lock_guard<std::mutex> lock(_backend_mutex);
+    for (auto& server : _servers.at(service))
+      addresses.push_back(server.host + ":" + std::to_string(server.port));
+    return addresses;
+  }
+
+  // Return a client of the like server on 'address' ("host:port"). Throw
+  // std::out_of_range if no like server is configured on it.
+  std::unique_ptr<like_service::Client> get_like_client(
+      const std::string& address) {
+    Server server;
+    {
+      std::lock_guard<std::mutex> lock(_backend_mutex);
+      auto& servers = _servers.at("like");
+      auto it = servers.begin();
+      while (it != servers.end() &&
+          it->host + ":" + std::to_string(it->port) != address)
+        it++;
+      if (it == servers.end())
+        throw std::out_of_range("No like server on " + address);
+      server = *it;
+    }
+    return std::make_unique<like_service::Client>(server.host, server.port,
+        10000, server.transport, server.protocol);
+  }
+
+  std::unique_ptr<post_service::Client> get_post_client() {
+    auto server = select_server("post");
+    return std::move(std::make_unique<post_service::Client>(
+        server.host, server.port, 10000, server.transport, server.protocol));
+  }
+
+  std::unique_ptr<uniquepair_service::Client> get_uniquepair_client() {
+    auto server = select_server("uniquepair");
+    return std::move(std::make_unique<uniquepair_service::Client>(
+        server.host, server.port, 10000, server.transport, server.protocol));
+  }
+
+  // Return the connection string of the primary database of 'shard' of
+  // 'service'. All writes must go to the primary.
+  std::string get_db_conn_str(const std::string& service, int shard = 0) {
+    std::lock_guard<std::mutex> lock(_backend_mutex);
+    return _databases.at(service).at(shard).primary;
+  }
+
+  // Return the connection strings of the primary databases of all shards of
+  // 'service'.
+  std::vector<std::string> list_db_conn_strs(const std::string& service) {
+    std::lock_guard<std::mutex> lock(_backend_mutex);
+    std::vector<std::string> conn_strs;
+    for (auto& database : _databases.at(service))
+      conn_strs.push_back(database.primary);
+    return conn_strs;
+  }
+
+  // Return the number of database shards of 'service'.
+  int count_db_shards(const std::string& service) {
+    std::lock_guard<std::mutex> lock(_backend_mutex);
+    return static_cast<int>(_databases.at(service).size());
+  }
+
+  // Open a connection to a database of 'shard' of 'service' that can serve
+  // read-only queries on behalf of 'requester_id'. Replicas are used in
+  // round-robin order. A replica that cannot be reached is skipped for
+  // REPLICA_COOLDOWN, and the primary is used when no replica is available or
+  // when the requester has written within the read-your-writes window.
+  template <typename Connection>
+  std::unique_ptr<Connection> connect_db_replica(const std::string& service,
+      int32_t requester_id, int shard = 0) {
+    for (auto& conn_str : select_db_replicas(service, requester_id, shard)) {
+      try {
+        return std::make_unique<Connection>(conn_str);
+      }
+      catch (const std::exception& e) {
+        mark_db_replica_down(conn_str);
       }
-      // Build account database connection string.
-      auto account_db = backend["account"]["database"].as<std::string>();
-      auto account_db_host = account_db.substr(0, account_db.find(":"));
-      auto account_db_port = std::stoi(
-          account_db.substr(account_db.find(":") + 1));
-      snprintf(conn_cstr, sizeof(conn_cstr), conn_fmt, postgres_user.c_str(),
-          postgres_password.c_str(), account_db_host.c_str(), account_db_port,
-          postgres_dbname.c_str());
-      account_db_conn_str = std::string(conn_cstr);
-      std::cout << "\tAdded account database on: " << \
-          account_db_host << ":" << account_db_port << std::endl;
     }
-    if (backend["follow"]) {
-      // Load follow service configuration.
-      auto follow_service = backend["follow"]["service"];
-      for (auto it = follow_service.begin(); it != follow_service.end(); it++) {
-        auto server = it->as<std::string>();
-        auto hostname = server.substr(0, server.find(":"));
-        auto port = std::stoi(server.substr(server.find(":") + 1));
-        this->follow_service.push_back(std::make_pair(hostname, port));
-        std::cout << "\tAdded follow service on " << \
-            hostname << ":" << port << std::endl;
+    return std::make_unique<Connection>(get_db_conn_str(service, shard));
+  }
+
+  // Record that 'requester_id' wrote to the primary database of 'service', so
+  // that its subsequent reads observe the write.
+  // NOTE: Writes are only known to this server, so reads that other servers of
+  // the service serve may still go to a lagging replica.
+  void mark_db_write(const std::string& service, int32_t requester_id) {
+    std::lock_guard<std::mutex> lock(_backend_mutex);
+    auto& db = _databases.at(service).front();
+    if (db.read_your_writes_ms <= 0)
+      return;
+    auto now = std::chrono::steady_clock::now();
+    // Forget writes older than the window to keep the table small.
+    if (_db_writes.size() >= MAX_TRACKED_WRITES) {
+      for (auto it = _db_writes.begin(); it != _db_writes.end();) {
+        if (it->second < now)
+          it = _db_writes.erase(it);
+        else
+          it++;
       }
     }
-    if (backend["like"]) {
-      // Load like service configuration.
-      auto like_service = backend["like"]["service"];
-      for (auto it = like_service.begin(); it != like_service.end(); it++) {
+    _db_writes[std::make_pair(service, requester_id)] = now +
+        std::chrono::milliseconds(db.read_your_writes_ms);
+  }
+
+  // Return the result of 'call', a downstream read identified by 'call_key'
+  // (e.g., "account:retrieve_standard_account:42"). Results are memoized per
+  // request, so repeated reads within the request of 'request_metadata' are
+  // served locally. Requests are told apart by their scope id, which the API
+  // gateway mints for each request (request ids are chosen by clients, and
+  // may be reused), and by their requester. Reads of requests without a scope
+  // id are not memoized. Results are kept for REQUEST_CACHE_TTL, which bounds
+  // the duration of a request. Use it only for reads that are not preceded by
+  // a write to the same data within the request.
+  template <typename T, typename Call>
+  T memoize(const gen::TRequestMetadata& request_metadata,
+      const std::string& call_key, Call call) {
+    if (!request_metadata.__isset.scope_id)
+      return call();
+    auto key = request_metadata.scope_id + "|" +
+        std::to_string(request_metadata.requester_id) + "|" + call_key;
+    {
+      std::lock_guard<std::mutex> lock(_request_cache_mutex);
+      expire_request_cache();
+      auto it = _request_cache.find(key);
+      if (it != _request_cache.end())
+        return *std::static_pointer_cast<T>(it->second);
+    }
+    auto value = std::make_shared<T>(call());
+    std::lock_guard<std::mutex> lock(_request_cache_mutex);
+    if (_request_cache.emplace(key, value).second)
+      _request_cache_expiry.push_back(std::make_pair(
+          std::chrono::steady_clock::now() + REQUEST_CACHE_TTL, key));
+    return *value;
+  }
+
+ private:
+  struct Server {
+    std::string host;
+    int port;
+    std::string transport;
+    std::string protocol;
+  };
+
+  struct Database {
+    std::string primary;
+    std::vector<std::string> replicas;
+    int read_your_writes_ms;
+  };
+
+  // Time a failed replica is skipped before it is tried again.
+  const std::chrono::milliseconds REPLICA_COOLDOWN{5000};
+  // Number of (service, requester) writes tracked before expired ones are
+  // forgotten.
+  const size_t MAX_TRACKED_WRITES = 65536;
+  // Time downstream reads are memoized for the request that made them.
+  const std::chrono::milliseconds REQUEST_CACHE_TTL{1000};
+
+  // Forget memoized reads older than REQUEST_CACHE_TTL. Entries expire in
+  // insertion order.
+  void expire_request_cache() {
+    auto now = std::chrono::steady_clock::now();
+    while (!_request_cache_expiry.empty() &&
+        _request_cache_expiry.front().first <= now) {
+      _request_cache.erase(_request_cache_expiry.front().second);
+      _request_cache_expiry.pop_front();
+    }
+  }
+
+  std::string build_db_conn_str(const std::string& db) {
+    char conn_cstr[128];
+    const char *conn_fmt = "postgres://%s:%s@%s:%d/%s";
+    auto db_host = db.substr(0, db.find(":"));
+    auto db_port = std::stoi(db.substr(db.find(":") + 1));
+    snprintf(conn_cstr, sizeof(conn_cstr), conn_fmt, _postgres_user.c_str(),
+        _postgres_password.c_str(), db_host.c_str(), db_port,
+        _postgres_dbname.c_str());
+    return std::string(conn_cstr);
+  }
+
+  Database load_database(const std::string& service,
+      const YAML::Node& database_conf, int read_your_writes_ms) {
+    Database database;
+    auto db = database_conf["database"].as<std::string>();
+    database.primary = build_db_conn_str(db);
+    std::cout << "\tAdded " << service << " database on: " << db << std::endl;
+    auto replicas_conf = database_conf["replicas"];
+    for (auto it = replicas_conf.begin(); it != replicas_conf.end(); it++) {
+      auto replica = it->as<std::string>();
+      database.replicas.push_back(build_db_conn_str(replica));
+      std::cout << "\tAdded " << service << " database replica on: " << \
+          replica << std::endl;
+    }
+    database.read_your_writes_ms = read_your_writes_ms;
+    return database;
+  }
+
+  void load_backend() {
+    std::map<std::string, std::vector<Server>> servers;
+    std::map<std::string, std::vector<Database>> databases;
+
+    auto backend = YAML::LoadFile(_backend_filepath);
+    for (auto service : {"account", "follow", "like", "post", "uniquepair"}) {
+      if (!backend[service])
+        continue;
+      // Load service configuration.
+      auto transport = get_transport(backend[service]);
+      auto protocol = get_protocol(backend[service]);
+      auto service_conf = backend[service]["service"];
+      for (auto it = service_conf.begin(); it != service_conf.end(); it++) {
         auto server = it->as<std::string>();
         auto hostname = server.substr(0, server.find(":"));
         auto port = std::stoi(server.substr(server.find(":") + 1));
-        this->like_service.push_back(std::make_pair(hostname, port));
-        std::cout << "\tAdded like service on " << \
-            hostname << ":" << port << std::endl;
+        servers[service].push_back({hostname, port, transport, protocol});
+        std::cout << "\tAdded " << service << " service on " << \
+            hostname << ":" << port << " (" << transport << " transport, " << \
+            protocol << " protocol)" << std::endl;
+      }
+      // A service without servers could not be called, so the configuration
+      // is rejected (and the current one kept when reloading).
+      if (servers[service].empty())
+        throw std::invalid_argument(std::string("No servers of service ") +
+            service);
+      // Build database connection strings. A service either has a single
+      // 'database' or a list of 'shards', each with its own database.
+      auto read_your_writes_ms = 0;
+      if (backend[service]["read_your_writes_ms"])
+        read_your_writes_ms = backend[service]["read_your_writes_ms"].as<int>();
+      if (backend[service]["database"]) {
+        databases[service].push_back(load_database(service, backend[service],
+            read_your_writes_ms));
+      }
+      auto shards_conf = backend[service]["shards"];
+      for (auto it = shards_conf.begin(); it != shards_conf.end(); it++) {
+        databases[service].push_back(load_database(service, *it,
+            read_your_writes_ms));
       }
     }
-    if (backend["post"]) {
-      // Load post service configuration.
-      auto post_service = backend["post"]["service"];
-      for (auto it = post_service.begin(); it != post_service.end(); it++) {
-        auto server = it->as<std::string>();
-        auto hostname = server.substr(0, server.find(":"));
-        auto port = std::stoi(server.substr(server.find(":") + 1));
-        this->post_service.push_back(std::make_pair(hostname, port));
-        std::cout << "\tAdded post service on " << \
-            hostname << ":" << port << std::endl;
+
+    // Replace the current configuration. Clients and database connections
+    // already open keep working until they are closed, so in-flight calls to
+    // removed servers drain gracefully.
+    std::lock_guard<std::mutex> lock(_backend_mutex);
+    // Rows are placed by the number of shards of their service, and ids encode
+    // it, so it cannot change once the server runs (write queues are also
+    // sized by it).
+    if (!_servers.empty()) {
+      for (auto service : {"account", "follow", "like", "post", "uniquepair"}) {
+        auto current = _databases.find(service);
+        auto next = databases.find(service);
+        if ((current == _databases.end() ? 0 : current->second.size()) !=
+            (next == databases.end() ? 0 : next->second.size()))
+          throw std::invalid_argument(
+              std::string("The number of shards of ") + service +
+              " cannot change while the server runs");
       }
-      // Build post database connection string.
-      auto post_db = backend["post"]["database"].as<std::string>();
-      auto post_db_host = post_db.substr(0, post_db.find(":"));
-      auto post_db_port = std::stoi(post_db.substr(post_db.find(":") + 1));
-      snprintf(conn_cstr, sizeof(conn_cstr), conn_fmt, postgres_user.c_str(),
-          postgres_password.c_str(), post_db_host.c_str(), post_db_port,
-          postgres_dbname.c_str());
-      post_db_conn_str = std::string(conn_cstr);
-      std::cout << "\tAdded post database on: " << \
-          post_db_host << ":" << post_db_port << std::endl;
     }
-    if (backend["uniquepair"]) {
-      // Load uniquepair service configuration.
-      auto uniquepair_service = backend["uniquepair"]["service"];
-      for (auto it = uniquepair_service.begin(); it != uniquepair_service.end();
-          it++) {
-        auto server = it->as<std::string>();
-        auto hostname = server.substr(0, server.find(":"));
-        auto port = std::stoi(server.substr(server.find(":") + 1));
-        this->uniquepair_service.push_back(std::make_pair(hostname, port));
-        std::cout << "\tAdded uniquepair service on " << \
-            hostname << ":" << port << std::endl;
+    _servers = std::move(servers);
+    _databases = std::move(databases);
+  }
+
+  void watch_backend() {
+    while (true) {
+      std::this_thread::sleep_for(std::chrono::seconds(1));
+      auto mtime = get_backend_mtime();
+      if (mtime == _backend_mtime)
+        continue;
+      _backend_mtime = mtime;
+      std::cout << "Reloading BaseServer:" << std::endl;
+      try {
+        load_backend();
+      }
+      catch (const std::exception& e) {
+        // Keep the current configuration until the file is fixed.
+        std::cout << "\tFailed to reload configuration: " << e.what() << \
+            std::endl;
       }
-      // Build uniquepair database connection string.
-      auto uniquepair_db = backend["uniquepair"]["database"].as<std::string>();
-      auto uniquepair_db_host = uniquepair_db.substr(0,
-                                uniquepair_db.find(":"));
-      auto uniquepair_db_port = std::stoi(
-          uniquepair_db.substr(uniquepair_db.find(":") + 1));
-      snprintf(conn_cstr, sizeof(conn_cstr), conn_fmt, postgres_user.c_str(),
-          postgres_password.c_str(), uniquepair_db_host.c_str(),
-          uniquepair_db_port, postgres_dbname.c_str());
-      uniquepair_db_conn_str = std::string(conn_cstr);
-      std::cout << "\tAdded uniquepair database on: " << \
-          uniquepair_db_host << ":" << uniquepair_db_port << std::endl;
     }
   }
 
-  std::unique_ptr<account_service::Client> get_account_client() {
-    // Randomly select a server.
-    std::pair<std::string, int> server =
-        account_service[rand() % static_cast<int>(account_service.size())];
-    return std::move(std::make_unique<account_service::Client>(
-        server.first, server.second, 10000));
+  std::pair<time_t, long> get_backend_mtime() {
+    struct stat backend_stat;
+    if (stat(_backend_filepath.c_str(), &backend_stat) != 0)
+      return std::make_pair(0, 0);
+    return std::make_pair(backend_stat.st_mtim.tv_sec,
+        backend_stat.st_mtim.tv_nsec);
   }
 
-  std::unique_ptr<follow_service::Client> get_follow_client() {
+  Server select_server(const std::string& service) {
+    std::lock_guard<std::mutex> lock(_backend_mutex);
+    auto& servers = _servers.at(service);
     // Randomly select a server.
-    std::pair<std::string, int> server =
-        follow_service[rand() % static_cast<int>(follow_service.size())];
-    return std::move(std::make_unique<follow_service::Client>(
-        server.first, server.second, 10000));
+    return servers[rand() % static_cast<int>(servers.size())];
   }
 
-  std::unique_ptr<like_service::Client> get_like_client() {
-    // Randomly select a server.
-    std::pair<std::string, int> server =
-        like_service[rand() % static_cast<int>(like_service.size())];
-    return std::move(std::make_unique<like_service::Client>(
-        server.first, server.second, 10000));
+  std::vector<std::string> select_db_replicas(const std::string& service,
+      int32_t requester_id, int shard) {
+    std::vector<std::string> replicas;
+    std::lock_guard<std::mutex> lock(_backend_mutex);
+    auto& db = _databases.at(service).at(shard);
+    if (db.replicas.empty())
+      return replicas;
+    auto now = std::chrono::steady_clock::now();
+    // Read your own writes from the primary.
+    auto write = _db_writes.find(std::make_pair(service, requester_id));
+    if (write != _db_writes.end()) {
+      if (now < write->second)
+        return replicas;
+      _db_writes.erase(write);
+    }
+    // Start from the next replica and skip those marked down.
+    auto first = _next_db_replica[service]++;
+    for (size_t i = 0; i < db.replicas.size(); i++) {
+      auto& conn_str = db.replicas[(first + i) % db.replicas.size()];
+      auto down = _down_db_replicas.find(conn_str);
+      if (down != _down_db_replicas.end()) {
+        if (now < down->second)
+          continue;
+        _down_db_replicas.erase(down);
+      }
+      replicas.push_back(conn_str);
+    }
+    return replicas;
   }
 
-  std::unique_ptr<post_service::Client> get_post_client() {
-    // Randomly select a server.
-    std::pair<std::string, int> server =
-        post_service[rand() % static_cast<int>(post_service.size())];
-    return std::move(std::make_unique<post_service::Client>(
-        server.first, server.second, 10000));
+  void mark_db_replica_down(const std::string& conn_str) {
+    std::lock_guard<std::mutex> lock(_backend_mutex);
+    _down_db_replicas[conn_str] = std::chrono::steady_clock::now() +
+        REPLICA_COOLDOWN;
   }
 
-  std::unique_ptr<uniquepair_service::Client> get_uniquepair_client() {
-    // Randomly select a server.
-    std::pair<std::string, int> server =
-        uniquepair_service[rand() % static_cast<int>(
-                           uniquepair_service.size())];
-    return std::move(std::make_unique<uniquepair_service::Client>(
-        server.first, server.second, 10000));
-  }
-
-  // Pairs of server hosts and ports.
-  std::vector<std::pair<std::string, int>> account_service;
-  std::vector<std::pair<std::string, int>> follow_service;
-  std::vector<std::pair<std::string, int>> like_service;
-  std::vector<std::pair<std::string, int>> post_service;
-  std::vector<std::pair<std::string, int>> uniquepair_service;
-  // Database connection strings.
-  std::string account_db_conn_str;
-  std::string post_db_conn_str;
-  std::string uniquepair_db_conn_str;
+  std::string _backend_filepath;
+  std::string _postgres_user;
+  std::string _postgres_password;
+  std::string _postgres_dbname;
+  std::pair<time_t, long> _backend_mtime;
+  std::mutex _backend_mutex;
+  // Servers of each service.
+  std::map<std::string, std::vector<Server>> _servers;
+  // Database shards of each service.
+  std::map<std::string, std::vector<Database>> _databases;
+  // Round-robin position in the replica list of each service.
+  std::map<std::string, size_t> _next_db_replica;
+  // Replicas that recently failed, with the time they can be retried.
+  std::map<std::string, std::chrono::steady_clock::time_point>
+      _down_db_replicas;
+  // End of the read-your-writes window of each (service, requester).
+  std::map<std::pair<std::string, int32_t>,
+      std::chrono::steady_clock::time_point> _db_writes;
+  std::mutex _request_cache_mutex;
+  // Memoized downstream reads, by request id and call.
+  std::map<std::string, std::shared_ptr<void>> _request_cache;
+  // Expiration time of each memoized read, in insertion order.
+  std::deque<std::pair<std::chrono::steady_clock::time_point, std::string>>
+      _request_cache_expiry;
 };
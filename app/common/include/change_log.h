@@ -0,0 +1,288 @@
+// Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+// Systems
+
+#include <dirent.h>
+#include <fcntl.h>
+#include <unistd.h>
+
+#include <algorithm>
+#include <chrono>
+#include <condition_variable>
+#include <cstdint>
+#include <cstdio>
+#include <fstream>
+#include <functional>
+#include <iostream>
+#include <map>
+#include <mutex>
+#include <sstream>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#include <vector>
+
+#include <pqxx/pqxx>
+
+#include <buzzblog/append_log.h>
+
+
+// A change of an entity (e.g., "post" 42): the operation ("created",
+// "updated", or "deleted"), the sequence number of the change among those of
+// the entity, and attributes of the entity that identify related entities
+// (e.g., "author_id").
+struct Change {
+  std::string entity;
+  int32_t id;
+  int64_t seq;
+  std::string op;
+  std::map<std::string, int64_t> attributes;
+
+  // Format the change as a record: "<entity> <id> <seq> <op>" followed by
+  // "<name>=<value>" for each attribute.
+  std::string to_record() const {
+    std::ostringstream record;
+    record << entity << " " << id << " " << seq << " " << op;
+    for (auto& it : attributes)
+      record << " " << it.first << "=" << it.second;
+    return record.str();
+  }
+
+  // Parse a record formatted by 'to_record'. Return false if it is invalid.
+  bool from_record(const std::string& record) {
+    std::istringstream record_stream(record);
+    if (!(record_stream >> entity >> id >> seq >> op))
+      return false;
+    attributes.clear();
+    std::string attribute;
+    while (record_stream >> attribute) {
+      auto pos = attribute.find('=');
+      if (pos == std::string::npos)
+        return false;
+      try {
+        attributes[attribute.substr(0, pos)] =
+            std::stoll(attribute.substr(pos + 1));
+      }
+      catch (const std::exception& e) {
+        return false;
+      }
+    }
+    return true;
+  }
+};
+
+
+// Publisher of the changes made by a server of 'service' to a change log
+// directory, shared with its subscribers (see ChangeLogSubscriber). Each
+// server appends to its own log, '<service>-<hostname>.log'. Logs are never
+// truncated.
+// A change is queued in the outbox of the database it is made in (table
+// 'ChangeOutbox'), by the transaction that makes it, so it is published if and
+// only if that transaction commits. A relay thread moves the changes queued in
+// the databases listed by 'list_databases' to the log, and only removes them
+// from the outbox once they are flushed to disk, so a change is published
+// again if the server stops in between.
+class ChangeLog {
+ public:
+  ChangeLog(const std::string& dirpath, const std::string& service,
+      std::function<std::vector<std::string>()> list_databases)
+  : _log(dirpath, service + "-" + get_hostname()),
+    _list_databases(list_databases), _notified(false) {
+    std::thread(&ChangeLog::relay, this).detach();
+  }
+
+  // Queue 'change' in transaction 'txn'.
+  void queue(pqxx::transaction_base& txn, const Change& change) {
+    txn.exec("INSERT INTO ChangeOutbox (record) "
+        "VALUES (" + txn.quote(change.to_record()) + ")");
+  }
+
+  // Wake up the relay once a transaction that queued changes committed, so
+  // that they are published without waiting for RELAY_INTERVAL.
+  void notify() {
+    {
+      std::lock_guard<std::mutex> lock(_mutex);
+      _notified = true;
+    }
+    _cv.notify_one();
+  }
+
+ private:
+  // Max number of changes moved at once from an outbox to the log.
+  const size_t RELAY_BATCH_SIZE = 100;
+  // Time after which outboxes are relayed without notification (e.g., changes
+  // queued before a restart).
+  const std::chrono::milliseconds RELAY_INTERVAL{1000};
+
+  void relay() {
+    while (true) {
+      {
+        std::unique_lock<std::mutex> lock(_mutex);
+        _cv.wait_for(lock, RELAY_INTERVAL, [this] { return _notified; });
+        _notified = false;
+      }
+      try {
+        for (auto& conn_str : _list_databases())
+          while (relay_outbox(conn_str) == RELAY_BATCH_SIZE);
+      }
+      catch (const std::exception& e) {
+        // Retry at the next relay.
+        std::cout << "Failed to relay changes: " << e.what() << std::endl;
+      }
+    }
+  }
+
+  // Move up to RELAY_BATCH_SIZE changes from the outbox of database
+  // 'conn_str' to the log, in queue order. Return the number of changes moved.
+  size_t relay_outbox(const std::string& conn_str) {
+    pqxx::connection conn(conn_str);
+    pqxx::work txn(conn);
+    // Changes being relayed by other servers of the service are skipped.
+    pqxx::result db_res(txn.exec("SELECT id, record "
+        "FROM ChangeOutbox "
+        "ORDER BY id "
+        "LIMIT " + std::to_string(RELAY_BATCH_SIZE) + " "
+        "FOR UPDATE SKIP LOCKED"));
+    std::vector<std::string> records;
+    std::ostringstream ids;
+    for (auto row : db_res) {
+      records.push_back(row["record"].as<std::string>());
+      ids << (ids.tellp() > 0 ? "," : "") << row["id"].as<int64_t>();
+    }
+    if (!records.empty()) {
+      _log.append(records);
+      txn.exec("DELETE FROM ChangeOutbox "
+          "WHERE id = ANY('{" + ids.str() + "}'::bigint[])");
+    }
+    txn.commit();
+    conn.disconnect();
+    return records.size();
+  }
+
+  static std::string get_hostname() {
+    char hostname[256];
+    if (gethostname(hostname, sizeof(hostname)) != 0)
+      throw std::runtime_error("Could not get hostname");
+    hostname[sizeof(hostname) - 1] = '\0';
+    return std::string(hostname);
+  }
+
+  AppendLog _log;
+  std::function<std::vector<std::string>()> _list_databases;
+  bool _notified;
+  std::mutex _mutex;
+  std::condition_variable _cv;
+};
+
+
+// Subscriber of the changes published to a change log directory. Changes are
+// read from every log of the directory, in the order of each log, and are
+// delivered at least once: the offset of the subscriber in each log is kept
+// on disk ('<name>.offsets') and only moves forward when the changes read
+// before are committed. Changes in different logs are not ordered, and a
+// change may be delivered again after a crash, so subscribers must use the
+// sequence numbers of an entity to order its changes and drop duplicates.
+// Not thread-safe.
+class ChangeLogSubscriber {
+ public:
+  ChangeLogSubscriber(const std::string& dirpath, const std::string& name)
+  : _dirpath(dirpath), _offsets_filepath(dirpath + "/" + name + ".offsets"),
+    _next_log(0) {
+    // Load the committed offsets.
+    std::ifstream offsets_file(_offsets_filepath);
+    std::string log_filename;
+    off_t offset;
+    while (offsets_file >> log_filename >> offset)
+      _offsets[log_filename] = offset;
+  }
+
+  // Read up to 'max_changes' changes after the committed offsets. Logs are
+  // read in turns, so that a busy log does not delay the others.
+  std::vector<Change> read(size_t max_changes) {
+    std::vector<Change> changes;
+    _read_offsets = _offsets;
+    auto log_filenames = list_logs();
+    for (size_t i = 0; i < log_filenames.size(); i++) {
+      if (changes.size() >= max_changes)
+        break;
+      read_log(log_filenames[(_next_log + i) % log_filenames.size()],
+          max_changes, changes);
+    }
+    _next_log++;
+    return changes;
+  }
+
+  // Commit that the changes returned by the last 'read' were processed.
+  void commit() {
+    // Replace the offsets file atomically.
+    auto tmp_filepath = _offsets_filepath + ".tmp";
+    std::ostringstream offsets;
+    for (auto& it : _read_offsets)
+      offsets << it.first << " " << it.second << "\n";
+    auto offsets_str = offsets.str();
+    auto fd = open(tmp_filepath.c_str(), O_WRONLY | O_CREAT | O_TRUNC, 0644);
+    auto ok = fd >= 0 &&
+        write(fd, offsets_str.c_str(), offsets_str.size()) ==
+            static_cast<ssize_t>(offsets_str.size()) &&
+        fsync(fd) == 0;
+    if (fd >= 0)
+      close(fd);
+    if (!ok || rename(tmp_filepath.c_str(), _offsets_filepath.c_str()) != 0)
+      throw std::runtime_error("Could not write " + _offsets_filepath);
+    _offsets = _read_offsets;
+  }
+
+ private:
+  std::vector<std::string> list_logs() {
+    std::vector<std::string> log_filenames;
+    auto dir = opendir(_dirpath.c_str());
+    if (dir == nullptr)
+      return log_filenames;
+    while (auto entry = readdir(dir)) {
+      std::string filename(entry->d_name);
+      if (filename.size() > 4 &&
+          filename.compare(filename.size() - 4, 4, ".log") == 0)
+        log_filenames.push_back(filename);
+    }
+    closedir(dir);
+    std::sort(log_filenames.begin(), log_filenames.end());
+    return log_filenames;
+  }
+
+  // Append the complete records of log 'log_filename' after its read offset
+  // to 'changes', up to 'max_changes' changes, and move its read offset past
+  // them. Invalid records are skipped.
+  void read_log(const std::string& log_filename, size_t max_changes,
+      std::vector<Change>& changes) {
+    auto fd = open((_dirpath + "/" + log_filename).c_str(), O_RDONLY);
+    if (fd < 0)
+      return;
+    auto& offset = _read_offsets[log_filename];
+    char buffer[65536];
+    std::string partial;
+    while (changes.size() < max_changes) {
+      auto n = pread(fd, buffer, sizeof(buffer), offset + partial.size());
+      if (n <= 0)
+        break;
+      partial.append(buffer, n);
+      size_t start = 0, end;
+      while (changes.size() < max_changes &&
+          (end = partial.find('\n', start)) != std::string::npos) {
+        Change change;
+        if (change.from_record(partial.substr(start, end - start)))
+          changes.push_back(change);
+        start = end + 1;
+      }
+      offset += start;
+      partial.erase(0, start);
+    }
+    close(fd);
+  }
+
+  std::string _dirpath;
+  std::string _offsets_filepath;
+  // Offset of each log up to which changes were committed, and up to which
+  // they were read.
+  std::map<std::string, off_t> _offsets;
+  std::map<std::string, off_t> _read_offsets;
+  size_t _next_log;
+};
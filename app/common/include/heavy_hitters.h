@@ -0,0 +1,156 @@
+// Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+// Systems
+
+#include <algorithm>
+#include <chrono>
+#include <cstdint>
+#include <mutex>
+#include <set>
+#include <stdexcept>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+
+
+// Approximate top-K of the most frequent items over a sliding time window, in
+// constant memory. The window is split into buckets, each with a count-min
+// sketch of the occurrences recorded in it. The sum of the bucket sketches
+// estimates the occurrences of any item in the window (never below the true
+// count, and above it by at most a small fraction of the total), and a bounded
+// set of the K items with the highest estimates is kept alongside it. When the
+// oldest bucket expires, its sketch is subtracted and the estimates of the
+// top-K items are refreshed.
+class HeavyHitters {
+ public:
+  // Throw std::invalid_argument unless the window lasts at least 1ms per
+  // bucket and the sketches have at least one counter.
+  HeavyHitters(size_t k, int window_s, int n_buckets, size_t width = 2048,
+      size_t depth = 4)
+  : _k(k),
+    _bucket_duration(get_bucket_duration_ms(window_s, n_buckets)),
+    _width(width), _depth(depth),
+    _buckets(n_buckets, std::vector<int32_t>(width * depth)),
+    _window(width * depth), _current_bucket(now_bucket()) {
+    if (width == 0 || depth == 0)
+      throw std::invalid_argument("Sketch width and depth must be positive");
+  }
+
+  // Record 'count' occurrences of 'item' at 'timestamp' (seconds since epoch).
+  // A negative count cancels occurrences recorded before. Timestamps that
+  // fell out of the window are ignored.
+  void add(int32_t item, int32_t count, int64_t timestamp) {
+    std::lock_guard<std::mutex> lock(_mutex);
+    expire_buckets();
+    auto bucket_id = timestamp * 1000 / _bucket_duration.count();
+    if (bucket_id > _current_bucket ||
+        bucket_id <= _current_bucket - static_cast<int64_t>(_buckets.size()))
+      return;
+    auto& bucket = _buckets[bucket_id % _buckets.size()];
+    for (size_t row = 0; row < _depth; row++) {
+      auto cell = row * _width + hash(item, row);
+      bucket[cell] += count;
+      _window[cell] += count;
+    }
+    update_top(item, estimate(item));
+  }
+
+  // Return up to 'limit' of the top-K items with their estimated number of
+  // occurrences in the window, from most to least frequent.
+  std::vector<std::pair<int32_t, int32_t>> top(size_t limit) {
+    std::lock_guard<std::mutex> lock(_mutex);
+    expire_buckets();
+    std::vector<std::pair<int32_t, int32_t>> items;
+    for (auto it = _top.rbegin(); it != _top.rend() && items.size() < limit;
+        it++)
+      items.push_back(std::make_pair(it->second, it->first));
+    return items;
+  }
+
+ private:
+  static int64_t get_bucket_duration_ms(int window_s, int n_buckets) {
+    if (window_s <= 0 || n_buckets <= 0 ||
+        static_cast<int64_t>(window_s) * 1000 < n_buckets)
+      throw std::invalid_argument("Window must be positive and last at least "
+          "1ms per bucket");
+    return static_cast<int64_t>(window_s) * 1000 / n_buckets;
+  }
+
+  int64_t now_bucket() {
+    return std::chrono::duration_cast<std::chrono::milliseconds>(
+        std::chrono::system_clock::now().time_since_epoch()).count() /
+        _bucket_duration.count();
+  }
+
+  size_t hash(int32_t item, size_t row) {
+    // Mix the item with a different seed per row (splitmix64 finalizer).
+    uint64_t x = static_cast<uint32_t>(item) +
+        (row + 1) * 0x9E3779B97F4A7C15ULL;
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EBULL;
+    return (x ^ (x >> 31)) % _width;
+  }
+
+  int32_t estimate(int32_t item) {
+    int32_t count = INT32_MAX;
+    for (size_t row = 0; row < _depth; row++)
+      count = std::min(count, _window[row * _width + hash(item, row)]);
+    return std::max(count, 0);
+  }
+
+  // Move the window to the current bucket, clearing expired buckets.
+  void expire_buckets() {
+    auto bucket_id = now_bucket();
+    if (bucket_id == _current_bucket)
+      return;
+    auto n_expired = std::min<int64_t>(bucket_id - _current_bucket,
+        _buckets.size());
+    for (int64_t i = 1; i <= n_expired; i++) {
+      auto& bucket = _buckets[(_current_bucket + i) % _buckets.size()];
+      for (size_t cell = 0; cell < bucket.size(); cell++)
+        _window[cell] -= bucket[cell];
+      std::fill(bucket.begin(), bucket.end(), 0);
+    }
+    _current_bucket = bucket_id;
+
+    // Refresh the estimates of the top-K items.
+    std::vector<int32_t> items;
+    for (auto& entry : _top_counts)
+      items.push_back(entry.first);
+    for (auto item : items)
+      update_top(item, estimate(item));
+  }
+
+  // Set the estimate of 'item', adding it to the top-K if it is higher than
+  // the lowest estimate there.
+  void update_top(int32_t item, int32_t count) {
+    auto it = _top_counts.find(item);
+    if (it != _top_counts.end()) {
+      _top.erase(std::make_pair(it->second, item));
+      _top_counts.erase(it);
+    }
+    if (count == 0)
+      return;
+    if (_top_counts.size() >= _k) {
+      if (_k == 0 || count <= _top.begin()->first)
+        return;
+      _top_counts.erase(_top.begin()->second);
+      _top.erase(_top.begin());
+    }
+    _top.insert(std::make_pair(count, item));
+    _top_counts[item] = count;
+  }
+
+  size_t _k;
+  std::chrono::milliseconds _bucket_duration;
+  size_t _width;
+  size_t _depth;
+  // Count-min sketches (depth rows of width counters) of each bucket, and
+  // their sum.
+  std::vector<std::vector<int32_t>> _buckets;
+  std::vector<int32_t> _window;
+  int64_t _current_bucket;
+  // Top-K items ordered by (estimate, item).
+  std::set<std::pair<int32_t, int32_t>> _top;
+  std::unordered_map<int32_t, int32_t> _top_counts;
+  std::mutex _mutex;
+};
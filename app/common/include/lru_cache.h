@@ -0,0 +1,170 @@
+// Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+// Systems
+
+#include <atomic>
+#include <chrono>
+#include <functional>
+#include <list>
+#include <mutex>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+
+
+// Thread-safe LRU cache whose entries expire after a time-to-live. Keys are
+// spread over independent shards, each with its own lock, so that concurrent
+// lookups of different keys rarely contend. Each shard has a generation,
+// bumped whenever one of its keys is erased, so that a value read after a
+// miss is not cached if its key may have been invalidated in the meantime.
+template <typename Key, typename Value>
+class LRUCache {
+ public:
+  // A 'capacity' of 0 disables the cache. A 'ttl_ms' of 0 disables expiration.
+  LRUCache(size_t capacity, int ttl_ms, size_t n_shards = 16)
+  : _ttl(ttl_ms), _shards(capacity > 0 ? n_shards : 0), _hits(0),
+    _misses(0) {
+    for (auto& shard : _shards)
+      shard.capacity = (capacity + n_shards - 1) / n_shards;
+  }
+
+  bool enabled() const {
+    return !_shards.empty();
+  }
+
+  // Look up 'key'. Return true and set 'value' if a fresh entry is cached.
+  bool get(const Key& key, Value& value) {
+    uint64_t generation;
+    return get(key, value, generation);
+  }
+
+  // Look up 'key'. Return true and set 'value' if a fresh entry is cached.
+  // Otherwise, set 'generation' to the generation of its shard, to be passed
+  // to 'put' with the value read from the source.
+  bool get(const Key& key, Value& value, uint64_t& generation) {
+    if (_shards.empty())
+      return false;
+    auto& shard = get_shard(key);
+    std::lock_guard<std::mutex> lock(shard.mutex);
+    generation = shard.generation;
+    auto it = shard.entries.find(key);
+    if (it == shard.entries.end() || is_expired(it->second->expires_at)) {
+      if (it != shard.entries.end()) {
+        shard.lru.erase(it->second);
+        shard.entries.erase(it);
+      }
+      _misses++;
+      return false;
+    }
+    // Move the entry to the front of the LRU list.
+    shard.lru.splice(shard.lru.begin(), shard.lru, it->second);
+    value = it->second->value;
+    _hits++;
+    return true;
+  }
+
+  // Cache 'value' under 'key', evicting the least recently used entry of the
+  // shard if it is full.
+  void put(const Key& key, const Value& value) {
+    if (_shards.empty())
+      return;
+    auto& shard = get_shard(key);
+    std::lock_guard<std::mutex> lock(shard.mutex);
+    insert(shard, key, value);
+  }
+
+  // Cache 'value' under 'key' unless a key of its shard was erased since
+  // 'generation' was returned by 'get'.
+  void put(const Key& key, const Value& value, uint64_t generation) {
+    if (_shards.empty())
+      return;
+    auto& shard = get_shard(key);
+    std::lock_guard<std::mutex> lock(shard.mutex);
+    if (shard.generation == generation)
+      insert(shard, key, value);
+  }
+
+  // Remove 'key' from the cache.
+  void erase(const Key& key) {
+    if (_shards.empty())
+      return;
+    auto& shard = get_shard(key);
+    std::lock_guard<std::mutex> lock(shard.mutex);
+    shard.generation++;
+    auto it = shard.entries.find(key);
+    if (it != shard.entries.end()) {
+      shard.lru.erase(it->second);
+      shard.entries.erase(it);
+    }
+  }
+
+  size_t size() {
+    size_t total = 0;
+    for (auto& shard : _shards) {
+      std::lock_guard<std::mutex> lock(shard.mutex);
+      total += shard.entries.size();
+    }
+    return total;
+  }
+
+  uint64_t hits() const {
+    return _hits;
+  }
+
+  uint64_t misses() const {
+    return _misses;
+  }
+
+  double hit_ratio() const {
+    uint64_t hits = _hits, misses = _misses;
+    return hits + misses > 0 ? static_cast<double>(hits) / (hits + misses) : 0;
+  }
+
+ private:
+  struct Entry {
+    Key key;
+    Value value;
+    std::chrono::steady_clock::time_point expires_at;
+  };
+
+  struct Shard {
+    std::mutex mutex;
+    size_t capacity;
+    // Bumped whenever a key of the shard is erased.
+    uint64_t generation = 0;
+    // Entries from most to least recently used.
+    std::list<Entry> lru;
+    std::unordered_map<Key, typename std::list<Entry>::iterator> entries;
+  };
+
+  // Cache 'value' under 'key' in 'shard', whose lock must be held, evicting
+  // the least recently used entry if it is full.
+  void insert(Shard& shard, const Key& key, const Value& value) {
+    auto expires_at = std::chrono::steady_clock::now() + _ttl;
+    auto it = shard.entries.find(key);
+    if (it != shard.entries.end()) {
+      it->second->value = value;
+      it->second->expires_at = expires_at;
+      shard.lru.splice(shard.lru.begin(), shard.lru, it->second);
+      return;
+    }
+    if (shard.entries.size() >= shard.capacity) {
+      shard.entries.erase(shard.lru.back().key);
+      shard.lru.pop_back();
+    }
+    shard.lru.push_front({key, value, expires_at});
+    shard.entries[key] = shard.lru.begin();
+  }
+
+  Shard& get_shard(const Key& key) {
+    return _shards[std::hash<Key>()(key) % _shards.size()];
+  }
+
+  bool is_expired(const std::chrono::steady_clock::time_point& expires_at) {
+    return _ttl.count() > 0 && std::chrono::steady_clock::now() >= expires_at;
+  }
+
+  std::chrono::milliseconds _ttl;
+  std::vector<Shard> _shards;
+  std::atomic<uint64_t> _hits;
+  std::atomic<uint64_t> _misses;
+};
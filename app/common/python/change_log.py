@@ -0,0 +1,110 @@
+# Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+# Systems
+"""
+Subscriber of the change log of BuzzBlog services (see change_log.h, whose
+record format and offsets file it shares).
+"""
+
+import collections
+import os
+
+
+Change = collections.namedtuple("Change",
+    ["entity", "id", "seq", "op", "attributes"])
+
+
+def parse_change(record):
+    """Return the change of 'record', or None if it is invalid.
+
+    A record is "<entity> <id> <seq> <op>" followed by "<name>=<value>" for
+    each attribute.
+    """
+    fields = record.split()
+    if len(fields) < 4:
+        return None
+    try:
+        attributes = {}
+        for field in fields[4:]:
+            name, value = field.split("=")
+            attributes[name] = int(value)
+        return Change(fields[0], int(fields[1]), int(fields[2]), fields[3],
+            attributes)
+    except ValueError:
+        return None
+
+
+class ChangeLogSubscriber:
+    """Read the changes published to a change log directory.
+
+    Changes are read from every log of the directory ('*.log'), in the order
+    of each log, and are delivered at least once: the offset of the
+    subscriber in each log is kept on disk ('<name>.offsets') and only moves
+    forward when the changes read before are committed. Changes in different
+    logs are not ordered, and a change may be delivered again after a crash,
+    so subscribers must use the sequence numbers of an entity to order its
+    changes and drop duplicates. Not thread-safe.
+    """
+
+    def __init__(self, dirpath, name):
+        self._dirpath = dirpath
+        self._offsets_filepath = os.path.join(dirpath, name + ".offsets")
+        self._offsets = {}
+        self._read_offsets = {}
+        self._next_log = 0
+        try:
+            with open(self._offsets_filepath, encoding="utf-8") as \
+                    offsets_file:
+                for line in offsets_file:
+                    log_filename, offset = line.split()
+                    self._offsets[log_filename] = int(offset)
+        except FileNotFoundError:
+            pass
+
+    def read(self, max_changes):
+        """Return up to 'max_changes' changes after the committed offsets.
+
+        Logs are read in turns, so that a busy log does not delay the others.
+        """
+        changes = []
+        self._read_offsets = dict(self._offsets)
+        log_filenames = sorted(filename
+            for filename in os.listdir(self._dirpath)
+            if filename.endswith(".log"))
+        for i in range(len(log_filenames)):
+            if len(changes) >= max_changes:
+                break
+            self._read_log(log_filenames[(self._next_log + i) %
+                len(log_filenames)], max_changes, changes)
+        self._next_log += 1
+        return changes
+
+    def commit(self):
+        """Commit that the changes of the last 'read' were processed."""
+        # Replace the offsets file atomically.
+        tmp_filepath = self._offsets_filepath + ".tmp"
+        with open(tmp_filepath, "w", encoding="utf-8") as offsets_file:
+            for log_filename, offset in sorted(self._read_offsets.items()):
+                offsets_file.write("{} {}\n".format(log_filename, offset))
+            offsets_file.flush()
+            os.fsync(offsets_file.fileno())
+        os.replace(tmp_filepath, self._offsets_filepath)
+        self._offsets = dict(self._read_offsets)
+
+    def _read_log(self, log_filename, max_changes, changes):
+        offset = self._read_offsets.get(log_filename, 0)
+        try:
+            log_file = open(os.path.join(self._dirpath, log_filename), "rb")
+        except FileNotFoundError:
+            return
+        with log_file:
+            log_file.seek(offset)
+            while len(changes) < max_changes:
+                record = log_file.readline()
+                # Stop before a record that is still being written.
+                if not record.endswith(b"\n"):
+                    break
+                offset += len(record)
+                change = parse_change(record.decode("utf-8"))
+                if change is not None:
+                    changes.append(change)
+        self._read_offsets[log_filename] = offset
@@ -0,0 +1,106 @@
+// Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+// Systems
+
+// Unit tests of AppendLog, built and run by utils/run_unit_test.sh.
+
+#include <stdlib.h>
+
+#include <cstdint>
+#include <fstream>
+#include <iostream>
+#include <iterator>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+#include <append_log.h>
+
+
+int n_failures = 0;
+
+void check(bool condition, const std::string& description) {
+  if (!condition) {
+    std::cout << "FAILED: " << description << std::endl;
+    n_failures++;
+  }
+}
+
+// Create an empty directory for the log of a test.
+std::string make_dirpath() {
+  char dirpath[] = "/tmp/test_append_log.XXXXXX";
+  if (mkdtemp(dirpath) == nullptr)
+    throw std::runtime_error("Could not create a temporary directory");
+  return dirpath;
+}
+
+void write_file(const std::string& filepath, const std::string& contents) {
+  std::ofstream file(filepath, std::ios::app);
+  file << contents;
+}
+
+std::string read_file(const std::string& filepath) {
+  std::ifstream file(filepath);
+  return std::string(std::istreambuf_iterator<char>(file),
+      std::istreambuf_iterator<char>());
+}
+
+void test_torn_tail_is_truncated() {
+  // A server stopped while appending the last record.
+  auto dirpath = make_dirpath();
+  write_file(dirpath + "/test.log", "a\nb\npart");
+  AppendLog log(dirpath, "test");
+  check(read_file(dirpath + "/test.log") == "a\nb\n",
+      "torn tail: the partial record is dropped");
+  // Records appended afterwards are not glued to it.
+  log.append("c");
+  off_t end_offset;
+  check(log.read(SIZE_MAX, end_offset) ==
+      std::vector<std::string>({"a", "b", "c"}),
+      "torn tail: complete records are read");
+}
+
+void test_replay_from_committed_offset() {
+  auto dirpath = make_dirpath();
+  off_t end_offset;
+  {
+    AppendLog log(dirpath, "test");
+    log.append(std::vector<std::string>{"a", "b", "c"});
+    check(log.read(2, end_offset) == std::vector<std::string>({"a", "b"}),
+        "replay: records are read in append order");
+    log.commit(end_offset);
+    // Records read but not committed are delivered again.
+    check(log.read(SIZE_MAX, end_offset) == std::vector<std::string>({"c"}),
+        "replay: reading starts at the committed offset");
+    check(log.has_pending_records(), "replay: uncommitted records are pending");
+  }
+  // The committed offset is kept across restarts.
+  AppendLog log(dirpath, "test");
+  check(log.read(SIZE_MAX, end_offset) == std::vector<std::string>({"c"}),
+      "replay: the committed offset is recovered");
+  // Committing every record truncates the log.
+  log.commit(end_offset);
+  check(!log.has_pending_records(), "replay: no record is pending");
+  check(read_file(dirpath + "/test.log").empty(),
+      "replay: the log is truncated once every record is committed");
+}
+
+void test_offset_past_end_is_reset() {
+  // A server stopped after truncating the log but before writing the offset.
+  auto dirpath = make_dirpath();
+  write_file(dirpath + "/test.log", "a\n");
+  write_file(dirpath + "/test.offset", "100\n");
+  AppendLog log(dirpath, "test");
+  off_t end_offset;
+  check(log.read(SIZE_MAX, end_offset) == std::vector<std::string>({"a"}),
+      "offset past end: reading starts at the beginning of the log");
+}
+
+int main() {
+  test_torn_tail_is_truncated();
+  test_replay_from_committed_offset();
+  test_offset_past_end_is_reset();
+  if (n_failures > 0)
+    return 1;
+  std::cout << "OK" << std::endl;
+  return 0;
+}
@@ -0,0 +1,67 @@
+# Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+# Systems
+
+import os
+import tempfile
+import unittest
+
+from buzzblog.change_log import Change, ChangeLogSubscriber, parse_change
+
+
+class TestChangeLog(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.dirpath = self.dir.name
+
+  def tearDown(self):
+    self.dir.cleanup()
+
+  def append(self, log_name, records):
+    with open(os.path.join(self.dirpath, log_name + ".log"), "a") as log_file:
+      log_file.write(records)
+
+  def test_parse_change(self):
+    self.assertEqual(Change("post", 42, 1, "created", {"author_id": 7}),
+        parse_change("post 42 1 created author_id=7"))
+    self.assertEqual(Change("account", 7, 3, "updated", {}),
+        parse_change("account 7 3 updated"))
+    self.assertIsNone(parse_change("post 42 created"))
+    self.assertIsNone(parse_change("post 42 1 created author_id"))
+
+  def test_read_and_commit(self):
+    # Publish changes in the logs of two servers, the last record of one of
+    # them being still written.
+    self.append("post-a", "post 1 1 created author_id=7\n"
+        "post 2 1 created author_id=7\n")
+    self.append("post-b", "post 1 2 deleted author_id=7\npost 3 1 crea")
+    subscriber = ChangeLogSubscriber(self.dirpath, "test")
+    changes = subscriber.read(100)
+    self.assertEqual({(1, 1), (2, 1), (1, 2)},
+        {(change.id, change.seq) for change in changes})
+    # Changes are delivered again until they are committed, in the order of
+    # each log.
+    self.assertCountEqual(changes, subscriber.read(100))
+    subscriber.commit()
+    self.assertEqual([], subscriber.read(100))
+    # Committed offsets are kept across restarts, and a record is read once
+    # it is complete.
+    self.append("post-b", "ted author_id=8\n")
+    subscriber = ChangeLogSubscriber(self.dirpath, "test")
+    self.assertEqual([Change("post", 3, 1, "created", {"author_id": 8})],
+        subscriber.read(100))
+    # Other subscribers read the logs from their start.
+    self.assertEqual(4, len(ChangeLogSubscriber(self.dirpath,
+        "other").read(100)))
+
+  def test_read_in_turns(self):
+    self.append("a", "".join("post %d 1 created\n" % i for i in range(10)))
+    self.append("b", "like 1 1 created\n")
+    subscriber = ChangeLogSubscriber(self.dirpath, "test")
+    self.assertEqual(["post", "post"],
+        [change.entity for change in subscriber.read(2)])
+    self.assertEqual(["like", "post"],
+        [change.entity for change in subscriber.read(2)])
+
+
+if __name__ == "__main__":
+  unittest.main()
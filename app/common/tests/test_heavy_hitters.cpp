@@ -0,0 +1,94 @@
+// Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+// Systems
+
+// Unit tests of HeavyHitters, built and run by utils/run_unit_test.sh.
+
+#include <chrono>
+#include <cstdint>
+#include <ctime>
+#include <iostream>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#include <utility>
+#include <vector>
+
+#include <heavy_hitters.h>
+
+
+using Items = std::vector<std::pair<int32_t, int32_t>>;
+
+int n_failures = 0;
+
+void check(bool condition, const std::string& description) {
+  if (!condition) {
+    std::cout << "FAILED: " << description << std::endl;
+    n_failures++;
+  }
+}
+
+bool throws_invalid_argument(int window_s, int n_buckets, size_t width = 2048,
+    size_t depth = 4) {
+  try {
+    HeavyHitters heavy_hitters(10, window_s, n_buckets, width, depth);
+  }
+  catch (const std::invalid_argument& e) {
+    return true;
+  }
+  return false;
+}
+
+void test_top_items() {
+  HeavyHitters heavy_hitters(2, 3600, 12);
+  auto now = time(nullptr);
+  heavy_hitters.add(1, 1, now);
+  heavy_hitters.add(2, 3, now);
+  heavy_hitters.add(3, 2, now);
+  check(heavy_hitters.top(10) == Items({{2, 3}, {3, 2}}),
+      "top: the K most frequent items are kept, from most to least frequent");
+  check(heavy_hitters.top(1) == Items({{2, 3}}),
+      "top: at most 'limit' items are returned");
+  // Negative counts cancel occurrences.
+  heavy_hitters.add(2, -3, now);
+  check(heavy_hitters.top(10) == Items({{3, 2}}),
+      "top: items without occurrences are dropped");
+}
+
+void test_timestamps_out_of_window() {
+  HeavyHitters heavy_hitters(10, 3600, 12);
+  auto now = time(nullptr);
+  heavy_hitters.add(1, 1, now - 7200);
+  heavy_hitters.add(2, 1, now + 7200);
+  check(heavy_hitters.top(10).empty(),
+      "window: occurrences outside the window are ignored");
+}
+
+void test_expiry() {
+  HeavyHitters heavy_hitters(10, 1, 1);
+  heavy_hitters.add(1, 1, time(nullptr));
+  check(heavy_hitters.top(10) == Items({{1, 1}}),
+      "expiry: occurrences in the window are counted");
+  std::this_thread::sleep_for(std::chrono::milliseconds(2100));
+  check(heavy_hitters.top(10).empty(),
+      "expiry: occurrences are forgotten once their bucket expires");
+}
+
+void test_invalid_parameters() {
+  check(throws_invalid_argument(0, 12), "parameters: empty window");
+  check(throws_invalid_argument(3600, 0), "parameters: no bucket");
+  check(throws_invalid_argument(1, 2000), "parameters: buckets under 1ms");
+  check(throws_invalid_argument(3600, 12, 0), "parameters: no column");
+  check(throws_invalid_argument(3600, 12, 2048, 0), "parameters: no row");
+  check(!throws_invalid_argument(1, 1000), "parameters: 1ms buckets");
+}
+
+int main() {
+  test_top_items();
+  test_timestamps_out_of_window();
+  test_expiry();
+  test_invalid_parameters();
+  if (n_failures > 0)
+    return 1;
+  std::cout << "OK" << std::endl;
+  return 0;
+}
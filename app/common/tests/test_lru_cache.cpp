@@ -0,0 +1,65 @@
+// Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+// Systems
+
+// Unit tests of LRUCache, built and run by utils/run_unit_test.sh.
+
+#include <cstdint>
+#include <iostream>
+#include <string>
+
+#include <lru_cache.h>
+
+
+int n_failures = 0;
+
+void check(bool condition, const std::string& description) {
+  if (!condition) {
+    std::cout << "FAILED: " << description << std::endl;
+    n_failures++;
+  }
+}
+
+void test_put_after_miss() {
+  LRUCache<int32_t, std::string> cache(10, 0);
+  std::string value;
+  uint64_t generation;
+  check(!cache.get(1, value, generation), "put after miss: key is missing");
+  cache.put(1, "a", generation);
+  check(cache.get(1, value) && value == "a",
+      "put after miss: value is cached");
+}
+
+void test_put_after_erase_is_skipped() {
+  // A value read before an update is put after the update erased its key.
+  LRUCache<int32_t, std::string> cache(10, 0);
+  std::string value;
+  uint64_t generation;
+  check(!cache.get(1, value, generation), "put after erase: key is missing");
+  cache.erase(1);
+  cache.put(1, "stale", generation);
+  check(!cache.get(1, value), "put after erase: stale value is not cached");
+  // Later misses cache values again.
+  check(!cache.get(1, value, generation), "put after erase: key is missing");
+  cache.put(1, "fresh", generation);
+  check(cache.get(1, value) && value == "fresh",
+      "put after erase: fresh value is cached");
+}
+
+void test_disabled_cache() {
+  LRUCache<int32_t, std::string> cache(0, 0);
+  std::string value;
+  uint64_t generation;
+  check(!cache.enabled(), "disabled: cache is disabled");
+  cache.put(1, "a");
+  check(!cache.get(1, value, generation), "disabled: nothing is cached");
+}
+
+int main() {
+  test_put_after_miss();
+  test_put_after_erase_is_skipped();
+  test_disabled_cache();
+  if (n_failures > 0)
+    return 1;
+  std::cout << "OK" << std::endl;
+  return 0;
+}
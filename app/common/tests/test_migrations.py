@@ -0,0 +1,158 @@
+# Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+# Systems
+
+import subprocess
+import unittest
+
+
+HOST = "localhost"
+PORTS = {"account": 5433, "post": 5434, "uniquepair": 5435}
+
+# Schemas of databases created before migrations, from the former
+# 'app/<service>/database/<service>_schema.sql' files.
+BASELINE_SCHEMAS = {
+  "account": """
+      CREATE TABLE Accounts(
+        id SERIAL PRIMARY KEY,
+        created_at INTEGER NOT NULL,
+        active BOOLEAN DEFAULT true,
+        username VARCHAR(64) UNIQUE NOT NULL,
+        password VARCHAR(64) NOT NULL,
+        first_name VARCHAR(64) NOT NULL,
+        last_name VARCHAR(64) NOT NULL
+      );
+      CREATE INDEX idx_created_at ON Accounts(created_at);
+      CREATE INDEX idx_username ON Accounts(username);
+  """,
+  "post": """
+      CREATE TABLE Posts(
+        id SERIAL PRIMARY KEY,
+        created_at INTEGER NOT NULL,
+        active BOOLEAN DEFAULT true,
+        text VARCHAR(256) NOT NULL,
+        author_id INTEGER NOT NULL
+      );
+      CREATE INDEX idx_created_at ON Posts(created_at);
+      CREATE INDEX idx_author_id ON Posts(author_id);
+  """,
+  "uniquepair": """
+      CREATE TABLE Uniquepairs(
+        id SERIAL PRIMARY KEY,
+        created_at INTEGER NOT NULL,
+        domain VARCHAR(32) NOT NULL,
+        first_elem INTEGER NOT NULL,
+        second_elem INTEGER NOT NULL,
+        UNIQUE(domain, first_elem, second_elem)
+      );
+      CREATE INDEX idx_created_at ON Uniquepairs(created_at);
+      CREATE INDEX idx_first_elem ON Uniquepairs(domain, first_elem);
+      CREATE INDEX idx_second_elem ON Uniquepairs(domain, second_elem);
+      CREATE INDEX idx_first_and_second_elem
+          ON Uniquepairs(domain, first_elem, second_elem);
+  """,
+}
+
+# Rows written before migrating a baseline database.
+SEEDS = {
+  "account": """
+      INSERT INTO Accounts (created_at, username, password, first_name,
+          last_name)
+      VALUES (1, 'migration_user', 'password', 'First', 'Last');
+  """,
+  "post": """
+      INSERT INTO Posts (created_at, active, text, author_id)
+      VALUES (1, true, 'First post', 1), (2, true, 'Second post', 1),
+          (3, false, 'Deleted post', 1), (4, true, 'Other post', 2);
+  """,
+  "uniquepair": """
+      INSERT INTO Uniquepairs (created_at, domain, first_elem, second_elem)
+      VALUES (1, 'follow', 1, 2), (2, 'follow', 1, 3), (3, 'follow', 2, 3),
+          (4, 'like', 1, 7);
+  """,
+}
+
+# Counters expected in a migrated baseline database, as psql rows.
+COUNTERS = {
+  "post": ("SELECT author_id, count FROM PostCounts ORDER BY author_id",
+      ["1|2", "2|1"]),
+  "uniquepair": ("""
+      SELECT domain, field, elem, count
+      FROM UniquepairCounts
+      ORDER BY domain, field, elem""",
+      ["follow|first_elem|1|2", "follow|first_elem|2|1",
+       "follow|second_elem|2|1", "follow|second_elem|3|2",
+       "like|first_elem|1|1", "like|second_elem|7|1"]),
+}
+
+
+def psql(service, dbname, script):
+  """Run 'script' in database 'dbname' of 'service' and return its rows."""
+  output = subprocess.run(["psql", "-U", "postgres", "-h", HOST, "-p",
+      str(PORTS[service]), "-d", dbname, "-v", "ON_ERROR_STOP=1", "--quiet",
+      "--tuples-only", "--no-align"], input=script, check=True,
+      stdout=subprocess.PIPE, universal_newlines=True).stdout
+  return output.splitlines()
+
+
+def migrate(service, dbname, mode="apply"):
+  """Run 'utils/migrate.sh' on database 'dbname' of 'service'."""
+  return subprocess.run(["utils/migrate.sh", "--service", service, "--port",
+      str(PORTS[service]), "--dbname", dbname, "--mode", mode], check=True,
+      stdout=subprocess.PIPE, universal_newlines=True).stdout.splitlines()
+
+
+def dump_schema(service, dbname):
+  """Return the schema of database 'dbname' of 'service'."""
+  return subprocess.run(["pg_dump", "-U", "postgres", "-h", HOST, "-p",
+      str(PORTS[service]), "--schema-only", dbname], check=True,
+      stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+
+class TestMigrations(unittest.TestCase):
+  def setUp(self):
+    self.databases = []
+
+  def tearDown(self):
+    for service, dbname in self.databases:
+      psql(service, "postgres", "DROP DATABASE IF EXISTS %s;" % dbname)
+
+  def create_database(self, service, dbname):
+    psql(service, "postgres", "DROP DATABASE IF EXISTS %s;" % dbname)
+    psql(service, "postgres", "CREATE DATABASE %s;" % dbname)
+    self.databases.append((service, dbname))
+
+  def check_migrations(self, service):
+    # Migrate an empty database.
+    self.create_database(service, "migrations_empty")
+    migrate(service, "migrations_empty")
+    # Migrate a database created from the baseline schema, with rows.
+    self.create_database(service, "migrations_baseline")
+    psql(service, "migrations_baseline", BASELINE_SCHEMAS[service])
+    psql(service, "migrations_baseline", SEEDS[service])
+    migrate(service, "migrations_baseline")
+    # Both end with every migration applied and the same schema.
+    for dbname in ["migrations_empty", "migrations_baseline"]:
+      self.assertEqual([], [line
+          for line in migrate(service, dbname, mode="status")
+          if not line.endswith(" applied")])
+    self.assertEqual(dump_schema(service, "migrations_empty"),
+        dump_schema(service, "migrations_baseline"))
+    # Counters are filled from the rows of the baseline database.
+    if service in COUNTERS:
+      query, rows = COUNTERS[service]
+      self.assertEqual(rows, psql(service, "migrations_baseline", query))
+    # Migrating again applies nothing.
+    self.assertEqual([], migrate(service, "migrations_baseline"))
+
+  def test_account_migrations(self):
+    self.check_migrations("account")
+
+  def test_post_migrations(self):
+    self.check_migrations("post")
+
+  def test_uniquepair_migrations(self):
+    self.check_migrations("uniquepair")
+
+
+if __name__ == "__main__":
+  unittest.main()
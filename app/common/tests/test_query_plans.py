@@ -0,0 +1,332 @@
+# Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+# Systems
+
+import json
+import subprocess
+import unittest
+
+
+HOST = "localhost"
+PORTS = {"account": 5433, "post": 5434, "uniquepair": 5435}
+
+# Sample rows added before planning queries, so that the planner has realistic
+# statistics. They are rolled back afterwards.
+SEEDS = {
+  "account": """
+      INSERT INTO Accounts (created_at, username, password, first_name,
+          last_name)
+      SELECT i, 'plan_user_' || i, 'password', 'First', 'Last'
+      FROM generate_series(1, 10000) AS i;
+  """,
+  "post": """
+      INSERT INTO Posts (created_at, active, text, author_id)
+      SELECT i, i % 10 <> 0, 'Post number ' || i || ' about topic ' || i % 50,
+          i % 100
+      FROM generate_series(1, 10000) AS i;
+      INSERT INTO ExpandedPosts (id, created_at, active, text, author_id,
+          author_created_at, author_active, author_username,
+          author_first_name, author_last_name, n_likes)
+      SELECT id, created_at, active, text, author_id, 1, true,
+          'plan_user_' || author_id, 'First', 'Last', id % 7
+      FROM Posts;
+  """,
+  "uniquepair": """
+      INSERT INTO Uniquepairs (created_at, domain, first_elem, second_elem)
+      SELECT i, (ARRAY['follow', 'like'])[i % 2 + 1], i % 100, i / 100
+      FROM generate_series(1, 10000) AS i
+      ON CONFLICT DO NOTHING;
+  """,
+}
+
+# Queries run by the service handlers, with sample values. Each one is listed
+# with the plan nodes it is allowed to have among those checked.
+QUERIES = {
+  "account": [
+    ("authenticate_user", set(), """
+        SELECT id, created_at, active, password, first_name, last_name
+        FROM Accounts
+        WHERE username = 'plan_user_1'"""),
+    ("create_account", set(), """
+        INSERT INTO Accounts (created_at, username, password, first_name,
+            last_name)
+        VALUES (extract(epoch from now()), 'plan_user', 'password', 'First',
+            'Last')
+        RETURNING id, created_at, change_seq"""),
+    ("retrieve_standard_account", set(), """
+        SELECT created_at, active, username, first_name, last_name
+        FROM Accounts
+        WHERE id = 1"""),
+    ("update_account", set(), """
+        UPDATE Accounts
+        SET password = 'password', first_name = 'First', last_name = 'Last',
+            sessions_revoked_at = (extract(epoch from now()) * 1000)::bigint,
+            change_seq = change_seq + 1
+        WHERE id = 1
+        RETURNING created_at, active, username, change_seq"""),
+    ("delete_account", set(), """
+        UPDATE Accounts
+        SET active = FALSE,
+            sessions_revoked_at = (extract(epoch from now()) * 1000)::bigint,
+            change_seq = change_seq + 1
+        WHERE id = 1
+        RETURNING id, change_seq"""),
+    ("list_session_revocations", set(), """
+        SELECT id, sessions_revoked_at
+        FROM Accounts
+        WHERE sessions_revoked_at > 1600000000000"""),
+  ],
+  "post": [
+    ("create_post", set(), """
+        INSERT INTO Posts (id, text, author_id, created_at)
+        VALUES (nextval('posts_id_seq') * 1 + 0, 'Post', 1,
+            extract(epoch from now()))
+        RETURNING id, created_at"""),
+    ("update_count", set(), """
+        INSERT INTO PostCounts (author_id, count, version)
+        VALUES (1, 1, 1)
+        ON CONFLICT (author_id)
+        DO UPDATE SET count = PostCounts.count + EXCLUDED.count,
+            version = PostCounts.version + 1"""),
+    ("retrieve_standard_post", set(), """
+        SELECT created_at, active, text, author_id
+        FROM Posts
+        WHERE id = 1"""),
+    ("delete_post", set(), """
+        UPDATE Posts
+        SET active = FALSE
+        WHERE id = 1 AND active = TRUE
+        RETURNING author_id"""),
+    ("list_posts", set(), """
+        SELECT id, created_at, active, text, author_id
+        FROM Posts
+        WHERE active = true
+        ORDER BY created_at DESC
+        LIMIT 10
+        OFFSET 10"""),
+    ("list_posts (author)", set(), """
+        SELECT id, created_at, active, text, author_id
+        FROM Posts
+        WHERE active = true AND author_id = 1
+        ORDER BY created_at DESC
+        LIMIT 10
+        OFFSET 10"""),
+    ("count_posts_by_author", set(), """
+        SELECT COALESCE(SUM(count), 0)
+        FROM PostCounts
+        WHERE author_id = 1"""),
+    ("get_version_of_posts_by_author", set(), """
+        SELECT COALESCE(SUM(version), 0)
+        FROM PostCounts
+        WHERE author_id = 1"""),
+    ("retrieve_expanded_post (read model)", set(), """
+        SELECT id, created_at, active, text, author_id, author_created_at,
+            author_active, author_username, author_first_name,
+            author_last_name, n_likes
+        FROM ExpandedPosts
+        WHERE id = 1"""),
+    ("list_posts (read model)", set(), """
+        SELECT id, created_at, active, text, author_id, author_created_at,
+            author_active, author_username, author_first_name,
+            author_last_name, n_likes
+        FROM ExpandedPosts
+        WHERE active = true
+        ORDER BY created_at DESC
+        LIMIT 10
+        OFFSET 10"""),
+    ("list_posts (read model, author)", set(), """
+        SELECT id, created_at, active, text, author_id, author_created_at,
+            author_active, author_username, author_first_name,
+            author_last_name, n_likes
+        FROM ExpandedPosts
+        WHERE active = true AND author_id = 1
+        ORDER BY created_at DESC
+        LIMIT 10
+        OFFSET 10"""),
+    ("project_post", set(), """
+        INSERT INTO ExpandedPosts (id, created_at, active, text, author_id,
+            author_created_at, author_active, author_username,
+            author_first_name, author_last_name, n_likes)
+        VALUES (1, 1, TRUE, 'Post', 1, 1, TRUE, 'user', 'First', 'Last', 0)
+        ON CONFLICT (id)
+        DO UPDATE SET active = EXCLUDED.active,
+            author_created_at = EXCLUDED.author_created_at,
+            author_active = EXCLUDED.author_active,
+            author_username = EXCLUDED.author_username,
+            author_first_name = EXCLUDED.author_first_name,
+            author_last_name = EXCLUDED.author_last_name,
+            n_likes = EXCLUDED.n_likes"""),
+    ("project_author", set(), """
+        UPDATE ExpandedPosts
+        SET author_created_at = 1, author_active = TRUE,
+            author_username = 'user', author_first_name = 'First',
+            author_last_name = 'Last'
+        WHERE author_id = 1"""),
+    ("project_likes", set(), """
+        UPDATE ExpandedPosts
+        SET n_likes = 1
+        WHERE id = 1
+        RETURNING author_id"""),
+    ("update_read_model_version", set(), """
+        INSERT INTO ExpandedPostVersions (author_id, version)
+        VALUES (1, 1)
+        ON CONFLICT (author_id)
+        DO UPDATE SET version = ExpandedPostVersions.version + 1"""),
+    ("get_version_of_posts_by_author (read model)", set(), """
+        SELECT COALESCE(SUM(version), 0)
+        FROM ExpandedPostVersions
+        WHERE author_id = 1"""),
+    # Matches are sorted by relevance, which is only known once they are found.
+    ("search_posts", {"Sort"}, """
+        SELECT id, created_at, active, text, author_id, rank
+        FROM (
+            SELECT id, created_at, active, text, author_id,
+                ts_rank(text_tsv, query) AS rank
+            FROM Posts, plainto_tsquery('english', 'topic') AS query
+            WHERE active = true AND text_tsv @@ query
+        ) AS matches
+        WHERE (rank, id) < (0.1::real, 100)
+        ORDER BY rank DESC, id DESC
+        LIMIT 11"""),
+  ],
+  "uniquepair": [
+    ("get", set(), """
+        SELECT created_at, domain, first_elem, second_elem
+        FROM Uniquepairs
+        WHERE id = 1"""),
+    ("add", set(), """
+        INSERT INTO Uniquepairs (id, domain, first_elem, second_elem,
+            created_at)
+        VALUES (nextval('uniquepairs_id_seq') * 1 + 0, 'follow', 1, 2,
+            extract(epoch from now()))
+        RETURNING id, created_at"""),
+    ("add (batch)", set(), """
+        INSERT INTO Uniquepairs (id, domain, first_elem, second_elem,
+            created_at)
+        VALUES (nextval('uniquepairs_id_seq') * 1 + 0, 'follow', 1, 2,
+            extract(epoch from now()))
+        ON CONFLICT DO NOTHING
+        RETURNING id, created_at, domain, first_elem, second_elem"""),
+    ("remove", set(), """
+        DELETE FROM Uniquepairs
+        WHERE id = 1
+        RETURNING domain, first_elem, second_elem"""),
+    ("remove (batch)", set(), """
+        DELETE FROM Uniquepairs
+        WHERE id IN (1, 2, 3)
+        RETURNING id, domain, first_elem, second_elem"""),
+    ("update_counts", set(), """
+        INSERT INTO UniquepairCounts (domain, field, elem, count, version)
+        VALUES ('follow', 'first_elem', 1, 1, 1),
+            ('follow', 'second_elem', 2, 1, 1)
+        ON CONFLICT (domain, field, elem)
+        DO UPDATE SET count = UniquepairCounts.count + EXCLUDED.count,
+            version = UniquepairCounts.version + 1"""),
+    ("find", set(), """
+        SELECT id, created_at
+        FROM Uniquepairs
+        WHERE domain = 'follow' AND first_elem = 1 AND second_elem = 2"""),
+  ] + [
+    ("fetch (%s)" % where_clause, set(), """
+        SELECT id, created_at, first_elem, second_elem
+        FROM Uniquepairs
+        WHERE %s
+        ORDER BY created_at DESC
+        LIMIT 10
+        OFFSET 10""" % where_clause)
+    for where_clause in [
+      "domain = 'follow'",
+      "domain = 'follow' AND first_elem = 1",
+      "domain = 'follow' AND second_elem = 2",
+      "domain = 'follow' AND first_elem = 1 AND second_elem = 2",
+    ]
+  ] + [
+    ("count (%s)" % where_clause, set(), """
+        SELECT COUNT(*)
+        FROM Uniquepairs
+        WHERE %s""" % where_clause)
+    for where_clause in [
+      "domain = 'follow'",
+      "domain = 'follow' AND first_elem = 1 AND second_elem = 2",
+    ]
+  ] + [
+    ("count (counters)", set(), """
+        SELECT COALESCE(SUM(count), 0)
+        FROM UniquepairCounts
+        WHERE domain = 'follow' AND field = 'first_elem' AND elem = 1"""),
+    ("count_by_second_elems", set(), """
+        SELECT elem, count
+        FROM UniquepairCounts
+        WHERE domain = 'like' AND field = 'second_elem' AND elem IN (1, 2, 3)"""),
+    ("get_version", set(), """
+        SELECT COALESCE(SUM(version), 0)
+        FROM UniquepairCounts
+        WHERE domain = 'like' AND field = 'second_elem' AND elem = 1"""),
+  ],
+}
+
+# Queries run by the change log relay of every service.
+for service_queries in QUERIES.values():
+  service_queries += [
+    ("relay_outbox", set(), """
+        SELECT id, record
+        FROM ChangeOutbox
+        ORDER BY id
+        LIMIT 100
+        FOR UPDATE SKIP LOCKED"""),
+    ("relay_outbox (delete)", set(), """
+        DELETE FROM ChangeOutbox
+        WHERE id = ANY('{1,2,3}'::bigint[])"""),
+  ]
+
+# Plan nodes that read a whole table or sort rows.
+CHECKED_NODE_TYPES = {"Seq Scan", "Sort"}
+
+
+def explain_queries(service):
+  """Return the plans of the queries of 'service', in order.
+
+  Sequential scans and sorts are disabled, so the planner only chooses them
+  when no index can serve a query.
+  """
+  script = ["BEGIN;", SEEDS[service], "ANALYZE;",
+      "SET LOCAL enable_seqscan = off;", "SET LOCAL enable_sort = off;"]
+  for _, _, query in QUERIES[service]:
+    script.append("EXPLAIN (FORMAT JSON) %s;" % query)
+    script.append("\\echo ====")
+  script.append("ROLLBACK;")
+  output = subprocess.run(["psql", "-U", "postgres", "-h", HOST, "-p",
+      str(PORTS[service]), "-v", "ON_ERROR_STOP=1", "--quiet",
+      "--tuples-only", "--no-align"], input="\n".join(script), check=True,
+      stdout=subprocess.PIPE, universal_newlines=True).stdout
+  return [json.loads(plan)[0]["Plan"]
+      for plan in output.split("====")[:-1]]
+
+
+def find_nodes(plan, node_types):
+  """Return the types of the nodes of 'plan' that are in 'node_types'."""
+  nodes = [plan["Node Type"]] if plan["Node Type"] in node_types else []
+  for subplan in plan.get("Plans", []):
+    nodes += find_nodes(subplan, node_types)
+  return nodes
+
+
+class TestQueryPlans(unittest.TestCase):
+  def check_queries(self, service):
+    plans = explain_queries(service)
+    for (name, allowed_node_types, _), plan in zip(QUERIES[service], plans):
+      with self.subTest(query=name):
+        self.assertEqual([], find_nodes(plan,
+            CHECKED_NODE_TYPES - allowed_node_types))
+
+  def test_account_queries(self):
+    self.check_queries("account")
+
+  def test_post_queries(self):
+    self.check_queries("post")
+
+  def test_uniquepair_queries(self):
+    self.check_queries("uniquepair")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -15,6 +15,8 @@ namespace py gen
 struct TRequestMetadata {
   1: required string id;          // unique request id.
   2: optional i32 requester_id;   // id of the account making the request.
+  3: optional string scope_id;    // id minted by the API gateway for the
+                                  // request, which scopes memoized reads.
 }
 
 struct TAccount {
@@ -69,6 +71,12 @@ struct TPostQuery {
   1: optional i32 author_id;
 }
 
+struct TPostSearchPage {
+  1: required list<TPost> posts;
+  // Cursor of the next page (unset if this is the last page).
+  2: optional string next_cursor;
+}
+
 struct TLike {
   // Standard
   1: required i32 id;
@@ -238,6 +246,18 @@ service TAccountService {
   void delete_account (1:TRequestMetadata request_metadata, 2:i32 account_id)
       throws (1:TAccountNotAuthorizedException e1,
               2:TAccountNotFoundException e2);
+
+  /* Params:
+   *   1. request_metadata: request metadata.
+   *   2. since: time (milliseconds since epoch) after which revocations are
+   *      listed.
+   * Returns:
+   *   A map from the ids of accounts whose sessions were revoked (because the
+   *   account was updated or deleted) after the provided time to the time of
+   *   their last revocation. Sessions created up to that time are invalid.
+   */
+  map<i32, i64> list_session_revocations (
+      1:TRequestMetadata request_metadata, 2:i64 since);
 }
 
 service TFollowService {
@@ -316,6 +336,19 @@ service TFollowService {
    *   The number of followees of the provided account.
    */
   i32 count_followees (1:TRequestMetadata request_metadata, 2:i32 account_id);
+
+  /* Params:
+   *   1. request_metadata: request metadata.
+   *   2. account_id: id of the account to whom accounts are suggested.
+   *   3. limit: max number of results to be fetched.
+   * Returns:
+   *   A list of active accounts (standard mode) followed by the followees of
+   *   the provided account but not by the account itself, in decreasing order
+   *   of the number of its followees that follow them. The list is empty
+   *   until they are first computed, shortly after the first call.
+   */
+  list<TAccount> list_suggested_accounts (1:TRequestMetadata request_metadata,
+      2:i32 account_id, 3:i32 limit);
 }
 
 service TLikeService {
@@ -387,6 +420,44 @@ service TLikeService {
    *   The number of likes of the provided post.
    */
   i32 count_likes_of_post (1:TRequestMetadata request_metadata, 2:i32 post_id);
+
+  /* Params:
+   *   1. request_metadata: request metadata.
+   *   2. post_ids: ids of the posts whose likes are counted.
+   * Returns:
+   *   The number of likes of each provided post, by post id.
+   */
+  map<i32, i32> count_likes_of_posts (1:TRequestMetadata request_metadata,
+      2:list<i32> post_ids);
+
+  /* Params:
+   *   1. request_metadata: request metadata.
+   *   2. post_id: id of the post whose likes are versioned.
+   * Returns:
+   *   A version number of the likes of the provided post, which increases
+   *   whenever one of them is added or deleted.
+   */
+  i64 get_version_of_likes_of_post (1:TRequestMetadata request_metadata,
+      2:i32 post_id);
+
+  /* Params:
+   *   1. request_metadata: request metadata.
+   *   2. limit: max number of results to be fetched.
+   * Returns:
+   *   A list of active posts (expanded mode) in decreasing order of their
+   *   estimated number of recent likes.
+   */
+  list<TPost> list_trending_posts (1:TRequestMetadata request_metadata,
+      2:i32 limit);
+
+  /* Params:
+   *   1. request_metadata: request metadata.
+   * Returns:
+   *   The estimated number of recent likes of the most liked posts, by post
+   *   id, counting only the likes and unlikes served by this server.
+   */
+  map<i32, i32> count_local_trending_likes (
+      1:TRequestMetadata request_metadata);
 }
 
 service TPostService {
@@ -420,6 +491,19 @@ service TPostService {
       throws (1:TPostNotFoundException e1,
               2:TAccountNotFoundException e2);
 
+  /* Params:
+   *   1. request_metadata: request metadata.
+   *   2. post_ids: ids of the posts to be retrieved.
+   *   3. expanded: whether posts are retrieved in expanded mode.
+   * Returns:
+   *   The posts (standard or expanded mode) matching the provided ids, in the
+   *   order of the ids. Ids that match no post are skipped.
+   */
+  list<TPost> retrieve_posts (1:TRequestMetadata request_metadata,
+      2:list<i32> post_ids, 3:bool expanded)
+      throws (1:TPostInvalidAttributesException e1,
+              2:TAccountNotFoundException e2);
+
   /* Params:
    *   1. request_metadata: request metadata.
    *   2. post_id: id of the post to be deleted.
@@ -448,6 +532,30 @@ service TPostService {
    */
   i32 count_posts_by_author (1:TRequestMetadata request_metadata,
       2:i32 author_id);
+
+  /* Params:
+   *   1. request_metadata: request metadata.
+   *   2. author_id: id of the author account whose posts are versioned.
+   * Returns:
+   *   A version number of the posts of the provided author account, which
+   *   increases whenever one of them is created or deleted (with the read
+   *   model, whenever the read model of one of them is rewritten).
+   */
+  i64 get_version_of_posts_by_author (1:TRequestMetadata request_metadata,
+      2:i32 author_id);
+
+  /* Params:
+   *   1. request_metadata: request metadata.
+   *   2. query: words to be searched for in the text of posts.
+   *   3. cursor: cursor of the page to be fetched (empty for the first page).
+   *   4. limit: max number of results to be fetched (at most 100).
+   * Returns:
+   *   A page of active posts (expanded mode) matching the query, from most to
+   *   least relevant.
+   */
+  TPostSearchPage search_posts (1:TRequestMetadata request_metadata,
+      2:string query, 3:string cursor, 4:i32 limit)
+      throws (1:TPostInvalidAttributesException e);
 }
 
 service TUniquepairService {
@@ -509,4 +617,26 @@ service TUniquepairService {
    *   The number of unique pairs.
    */
   i32 count (1:TRequestMetadata request_metadata, 2:TUniquepairQuery query);
+
+  /* Params:
+   *   1. request_metadata: request metadata.
+   *   2. domain: domain of the unique pairs to be counted.
+   *   3. second_elems: second elements of the unique pairs to be counted.
+   * Returns:
+   *   The number of unique pairs of each provided second element, by second
+   *   element.
+   */
+  map<i32, i32> count_by_second_elems (1:TRequestMetadata request_metadata,
+      2:string domain, 3:list<i32> second_elems);
+
+  /* Params:
+   *   1. request_metadata: request metadata.
+   *   2. query: query parameters, with exactly one element set.
+   * Returns:
+   *   A version number of the unique pairs matching the query, which
+   *   increases whenever one of them is added or removed (0 if the query does
+   *   not set exactly one element).
+   */
+  i64 get_version (1:TRequestMetadata request_metadata,
+      2:TUniquepairQuery query);
 }
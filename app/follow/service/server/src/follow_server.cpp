@@ -1,17 +1,24 @@
 // Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
 // Systems
 
+#include <algorithm>
+#include <chrono>
+#include <iostream>
+#include <mutex>
+#include <set>
 #include <string>
+#include <thread>
+#include <unordered_map>
+#include <unordered_set>
+#include <utility>
+#include <vector>
 
 #include <cxxopts.hpp>
 #include <spdlog/sinks/basic_file_sink.h>
-#include <thrift/protocol/TBinaryProtocol.h>
-#include <thrift/server/TThreadedServer.h>
-#include <thrift/transport/TBufferTransports.h>
-#include <thrift/transport/TServerSocket.h>
 
 #include <buzzblog/gen/TFollowService.h>
 #include <buzzblog/base_server.h>
+#include <buzzblog/lru_cache.h>
 
 
 using apache::thrift;
@@ -23,12 +30,178 @@ using gen;
 
 
 class TFollowServiceHandler : public BaseServer, public TFollowServiceIf {
+ private:
+  struct Suggestions {
+    // Candidate accounts, from most to least recommended.
+    std::vector<int32_t> account_ids;
+    std::chrono::steady_clock::time_point computed_at;
+  };
+
+  // Max number of candidates kept per account.
+  const size_t MAX_SUGGESTIONS = 100;
+  // Max number of followees (or followers) of an account that are considered.
+  const int32_t MAX_FOLLOWS = 1000;
+  const std::chrono::milliseconds REFRESH_INTERVAL{1000};
+
+  // Precomputed suggestions of each account.
+  LRUCache<int32_t, Suggestions> _suggestions;
+  std::chrono::seconds _suggestions_ttl;
+  size_t _suggestions_batch_size;
+  // Accounts that followed or unfollowed someone since the last refresh.
+  std::set<int32_t> _changed_accounts;
+  // Accounts whose suggestions must be recomputed.
+  std::set<int32_t> _stale_accounts;
+  // Accounts whose suggestions were requested but are not cached.
+  std::set<int32_t> _missing_accounts;
+  std::mutex _refresh_mutex;
+
+  // Retrieve an account (standard mode), once per request.
+  TAccount retrieve_account(account_service::Client& account_client,
+      const TRequestMetadata& request_metadata, const int32_t account_id) {
+    return memoize<TAccount>(request_metadata,
+        "account:retrieve_standard_account:" + std::to_string(account_id),
+        [&] {
+          return account_client.retrieve_standard_account(request_metadata,
+              account_id);
+        });
+  }
+
+  // Fetch the followees of 'account_id' (or its followers if 'followers' is
+  // true).
+  std::vector<int32_t> fetch_follows(
+      uniquepair_service::Client& uniquepair_client,
+      const TRequestMetadata& request_metadata, const int32_t account_id,
+      bool followers) {
+    // Build query struct.
+    TUniquepairQuery query;
+    query.__set_domain("follow");
+    if (followers)
+      query.__set_second_elem(account_id);
+    else
+      query.__set_first_elem(account_id);
+
+    // Fetch unique pairs.
+    std::vector<int32_t> account_ids;
+    for (auto& it : uniquepair_client.fetch(request_metadata, query,
+        MAX_FOLLOWS, 0))
+      account_ids.push_back(followers ? it.first_elem : it.second_elem);
+    return account_ids;
+  }
+
+  // Rank the accounts followed by the followees of 'account_id' by how many
+  // of them follow each one, excluding accounts it already follows.
+  Suggestions compute_suggestions(const int32_t account_id) {
+    TRequestMetadata request_metadata;
+    request_metadata.id = "suggestions";
+    request_metadata.requester_id = account_id;
+    auto uniquepair_client = get_uniquepair_client();
+    auto followees = fetch_follows(*uniquepair_client, request_metadata,
+        account_id, false);
+    std::unordered_set<int32_t> excluded(followees.begin(), followees.end());
+    excluded.insert(account_id);
+    std::unordered_map<int32_t, int> n_mutual_follows;
+    for (auto followee : followees)
+      for (auto candidate : fetch_follows(*uniquepair_client,
+          request_metadata, followee, false))
+        if (excluded.find(candidate) == excluded.end())
+          n_mutual_follows[candidate]++;
+    uniquepair_client->close();
+
+    // Keep the top candidates, breaking ties by account id.
+    std::vector<std::pair<int, int32_t>> candidates;
+    for (auto& it : n_mutual_follows)
+      candidates.push_back(std::make_pair(-it.second, it.first));
+    auto n_candidates = std::min(candidates.size(), MAX_SUGGESTIONS);
+    std::partial_sort(candidates.begin(), candidates.begin() + n_candidates,
+        candidates.end());
+    Suggestions suggestions;
+    for (size_t i = 0; i < n_candidates; i++)
+      suggestions.account_ids.push_back(candidates[i].second);
+    suggestions.computed_at = std::chrono::steady_clock::now();
+    return suggestions;
+  }
+
+  // Record that 'account_id' followed or unfollowed someone, which changes
+  // its suggestions and those of its followers.
+  void mark_follows_changed(const int32_t account_id) {
+    std::lock_guard<std::mutex> lock(_refresh_mutex);
+    _changed_accounts.insert(account_id);
+  }
+
+  // Periodically compute, in batches, the suggestions that were requested but
+  // are not cached, then recompute the cached suggestions that are stale.
+  void refresh_suggestions() {
+    while (true) {
+      std::this_thread::sleep_for(REFRESH_INTERVAL);
+      try {
+        std::set<int32_t> changed_accounts;
+        {
+          std::lock_guard<std::mutex> lock(_refresh_mutex);
+          std::swap(changed_accounts, _changed_accounts);
+        }
+        if (!changed_accounts.empty()) {
+          // Mark the changed accounts and their followers stale.
+          TRequestMetadata request_metadata;
+          request_metadata.id = "suggestions";
+          auto uniquepair_client = get_uniquepair_client();
+          std::set<int32_t> stale_accounts;
+          for (auto account_id : changed_accounts) {
+            request_metadata.requester_id = account_id;
+            stale_accounts.insert(account_id);
+            for (auto follower_id : fetch_follows(*uniquepair_client,
+                request_metadata, account_id, true))
+              stale_accounts.insert(follower_id);
+          }
+          uniquepair_client->close();
+          std::lock_guard<std::mutex> lock(_refresh_mutex);
+          _stale_accounts.insert(stale_accounts.begin(), stale_accounts.end());
+        }
+
+        // Take the next batch of missing accounts, then of stale accounts.
+        std::vector<int32_t> missing_batch, stale_batch;
+        {
+          std::lock_guard<std::mutex> lock(_refresh_mutex);
+          while (!_missing_accounts.empty() &&
+              missing_batch.size() < _suggestions_batch_size) {
+            missing_batch.push_back(*_missing_accounts.begin());
+            _missing_accounts.erase(_missing_accounts.begin());
+          }
+          while (!_stale_accounts.empty() &&
+              missing_batch.size() + stale_batch.size() <
+                  _suggestions_batch_size) {
+            stale_batch.push_back(*_stale_accounts.begin());
+            _stale_accounts.erase(_stale_accounts.begin());
+          }
+        }
+
+        // Compute missing suggestions, and recompute suggestions that are
+        // cached. The others are computed once they are requested.
+        for (auto account_id : missing_batch)
+          _suggestions.put(account_id, compute_suggestions(account_id));
+        for (auto account_id : stale_batch) {
+          Suggestions suggestions;
+          if (_suggestions.get(account_id, suggestions))
+            _suggestions.put(account_id, compute_suggestions(account_id));
+        }
+      }
+      catch (const std::exception& e) {
+        std::cout << "Failed to refresh suggestions: " << e.what() <<
+            std::endl;
+      }
+    }
+  }
+
  public:
   TFollowServiceHandler(const std::string& backend_filepath,
       const std::string& postgres_user, const std::string& postgres_password,
-      const std::string& postgres_dbname)
+      const std::string& postgres_dbname, int suggestions_capacity,
+      int suggestions_ttl_s, int suggestions_batch_size)
   : BaseServer(backend_filepath, postgres_user, postgres_password,
-      postgres_dbname) {
+      postgres_dbname),
+    _suggestions(suggestions_capacity, 0),
+    _suggestions_ttl(suggestions_ttl_s),
+    _suggestions_batch_size(suggestions_batch_size) {
+    std::thread(&TFollowServiceHandler::refresh_suggestions, this).detach();
   }
 
   void follow_account(TFollow& _return,
@@ -44,6 +217,7 @@ class TFollowServiceHandler : public BaseServer, public TFollowServiceIf {
       throw TFollowAlreadyExistsException();
     }
     uniquepair_client->close();
+    mark_follows_changed(request_metadata.requester_id);
 
     // Build follow (standard mode).
     _return.id = uniquepair.id;
@@ -79,9 +253,9 @@ class TFollowServiceHandler : public BaseServer, public TFollowServiceIf {
 
     // Retrieve accounts.
     auto account_client = get_account_client();
-    auto follower = account_client->retrieve_standard_account(request_metadata,
+    auto follower = retrieve_account(*account_client, request_metadata,
         _return.follower_id);
-    auto followee = account_client->retrieve_standard_account(request_metadata,
+    auto followee = retrieve_account(*account_client, request_metadata,
         _return.followee_id);
     account_client->close();
 
@@ -118,6 +292,7 @@ class TFollowServiceHandler : public BaseServer, public TFollowServiceIf {
       throw TFollowNotFoundException();
     }
     uniquepair_client->close();
+    mark_follows_changed(request_metadata.requester_id);
   }
 
   void list_follows(std::vector<TFollow>& _return,
@@ -141,10 +316,10 @@ class TFollowServiceHandler : public BaseServer, public TFollowServiceIf {
     auto account_client = get_account_client();
     for (auto it : uniquepairs) {
       // Retrieve accounts.
-      auto follower = account_client->retrieve_standard_account(
-          request_metadata, it.first_elem);
-      auto followee = account_client->retrieve_standard_account(
-          request_metadata, it.second_elem);
+      auto follower = retrieve_account(*account_client, request_metadata,
+          it.first_elem);
+      auto followee = retrieve_account(*account_client, request_metadata,
+          it.second_elem);
 
       // Build follow (expanded mode).
       TFollow follow;
@@ -202,6 +377,42 @@ class TFollowServiceHandler : public BaseServer, public TFollowServiceIf {
     uniquepair_client->close();
     return count;
   }
+
+  void list_suggested_accounts(std::vector<TAccount>& _return,
+      const TRequestMetadata& request_metadata, const int32_t account_id,
+      const int32_t limit) {
+    // Get precomputed suggestions. On a cache miss, they are computed in the
+    // background and none is returned until then, since computing them takes
+    // up to one call per followee. Expired suggestions are returned and
+    // recomputed in the background.
+    Suggestions suggestions;
+    if (!_suggestions.get(account_id, suggestions)) {
+      std::lock_guard<std::mutex> lock(_refresh_mutex);
+      _missing_accounts.insert(account_id);
+      return;
+    }
+    else if (std::chrono::steady_clock::now() - suggestions.computed_at >
+        _suggestions_ttl) {
+      std::lock_guard<std::mutex> lock(_refresh_mutex);
+      _stale_accounts.insert(account_id);
+    }
+
+    // Build accounts, skipping deleted ones.
+    auto account_client = get_account_client();
+    for (auto candidate_id : suggestions.account_ids) {
+      if (static_cast<int32_t>(_return.size()) >= limit)
+        break;
+      try {
+        auto account = account_client->retrieve_standard_account(
+            request_metadata, candidate_id);
+        if (account.active)
+          _return.push_back(account);
+      }
+      catch (TAccountNotFoundException e) {
+      }
+    }
+    account_client->close();
+  }
 };
 
 
@@ -212,6 +423,10 @@ int main(int argc, char** argv) {
       ("host", "", cxxopts::value<std::string>()->default_value("0.0.0.0"))
       ("port", "", cxxopts::value<int>())
       ("threads", "", cxxopts::value<int>())
+      ("server_mode", "", cxxopts::value<std::string>()->default_value(
+          "threaded"))
+      ("io_threads", "", cxxopts::value<int>()->default_value("1"))
+      ("queue_depth", "", cxxopts::value<int>()->default_value("0"))
       ("backend_filepath", "", cxxopts::value<std::string>()->default_value(
           "/etc/opt/BuzzBlogApp/backend.yml"))
       ("postgres_user", "", cxxopts::value<std::string>()->default_value(
@@ -219,34 +434,45 @@ int main(int argc, char** argv) {
       ("postgres_password", "", cxxopts::value<std::string>()->default_value(
           "postgres"))
       ("postgres_dbname", "", cxxopts::value<std::string>()->default_value(
-          "postgres"));
+          "postgres"))
+      ("suggestions_capacity", "", cxxopts::value<int>()->default_value(
+          "100000"))
+      ("suggestions_ttl_s", "", cxxopts::value<int>()->default_value("600"))
+      ("suggestions_batch_size", "", cxxopts::value<int>()->default_value(
+          "100"));
 
   // Parse command-line arguments.
   auto result = options.parse(argc, argv);
   std::string host = result["host"].as<std::string>();
   int port = result["port"].as<int>();
   int threads = result["threads"].as<int>();
+  std::string server_mode = result["server_mode"].as<std::string>();
+  int io_threads = result["io_threads"].as<int>();
+  int queue_depth = result["queue_depth"].as<int>();
   std::string backend_filepath = result["backend_filepath"].as<std::string>();
   std::string postgres_user = result["postgres_user"].as<std::string>();
   std::string postgres_password = result["postgres_password"].as<std::string>();
   std::string postgres_dbname = result["postgres_dbname"].as<std::string>();
+  int suggestions_capacity = result["suggestions_capacity"].as<int>();
+  int suggestions_ttl_s = result["suggestions_ttl_s"].as<int>();
+  int suggestions_batch_size = result["suggestions_batch_size"].as<int>();
 
   // Initialize logger.
   auto logger = spdlog::basic_logger_mt("logger", "/tmp/calls.log");
   logger->set_pattern("[%H:%M:%S.%F] pid=%P tid=%t %v");
 
   // Create server.
-  TThreadedServer server(
+  auto server = BaseServer::create_server(
       std::make_shared<TFollowServiceProcessor>(
           std::make_shared<TFollowServiceHandler>(backend_filepath,
-              postgres_user, postgres_password, postgres_dbname)),
-      std::make_shared<TServerSocket>(host, port),
-      std::make_shared<TBufferedTransportFactory>(),
-      std::make_shared<TBinaryProtocolFactory>());
-  server.setConcurrentClientLimit(threads);
+              postgres_user, postgres_password, postgres_dbname,
+              suggestions_capacity, suggestions_ttl_s,
+              suggestions_batch_size)),
+      backend_filepath, "follow", host, port, server_mode, threads, io_threads,
+      queue_depth);
 
   // Serve requests.
-  server.serve();
+  server->serve();
 
   return 0;
 }
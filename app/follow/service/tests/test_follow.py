@@ -205,6 +205,43 @@ class TestService(unittest.TestCase):
               TRequestMetadata(id="8", requester_id=accounts[0].id),
               accounts[0].id))
 
+  def test_list_suggested_accounts(self):
+    with AccountClient(IP_ADDRESS, ACCOUNT_PORT) as client:
+      # Create test accounts.
+      accounts = [client.create_account(TRequestMetadata(id=str(i)),
+          random_id(), "passwd", "George", "Burdell") for i in range(5)]
+    with FollowClient(IP_ADDRESS, FOLLOW_PORT) as client:
+      # The first account follows the second and the third, which follow the
+      # fourth, and the second also follows the fifth.
+      for follower, followee in [(0, 1), (0, 2), (1, 3), (2, 3), (1, 4)]:
+        client.follow_account(
+            TRequestMetadata(id="5", requester_id=accounts[follower].id),
+            accounts[followee].id)
+      def list_suggested_accounts():
+        return [account.id for account in client.list_suggested_accounts(
+            TRequestMetadata(id="6", requester_id=accounts[0].id),
+            accounts[0].id, 10)]
+      # Suggestions are computed in the background after the first request,
+      # which gets none.
+      self.assertEqual([], list_suggested_accounts())
+      for _ in range(10):
+        suggested_account_ids = list_suggested_accounts()
+        if suggested_account_ids:
+          break
+        time.sleep(1)
+      self.assertEqual([accounts[3].id, accounts[4].id], suggested_account_ids)
+      # Following a suggested account removes it from the suggestions once
+      # they are recomputed.
+      client.follow_account(
+          TRequestMetadata(id="7", requester_id=accounts[0].id),
+          accounts[3].id)
+      for _ in range(10):
+        suggested_account_ids = list_suggested_accounts()
+        if len(suggested_account_ids) == 1:
+          break
+        time.sleep(1)
+      self.assertEqual([accounts[4].id], suggested_account_ids)
+
 
 if __name__ == "__main__":
   unittest.main()
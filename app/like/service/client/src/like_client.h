@@ -2,6 +2,7 @@
 // Systems
 
 #include <chrono>
+#include <map>
 #include <memory>
 #include <string>
 #include <vector>
@@ -9,6 +10,8 @@
 #include <spdlog/spdlog.h>
 #include <spdlog/sinks/basic_file_sink.h>
 #include <thrift/protocol/TBinaryProtocol.h>
+#include <thrift/protocol/TCompactProtocol.h>
+#include <thrift/protocol/THeaderProtocol.h>
 #include <thrift/transport/TSocket.h>
 #include <thrift/transport/TTransportUtils.h>
 
@@ -32,13 +35,23 @@ namespace like_service {
     std::shared_ptr<TProtocol> _protocol;
     std::shared_ptr<TLikeServiceClient> _client;
    public:
-    Client(const std::string& ip_address, int port, int conn_timeout_ms) {
+    Client(const std::string& ip_address, int port, int conn_timeout_ms,
+        const std::string& transport = "buffered",
+        const std::string& protocol = "binary") {
       _ip_address = ip_address;
       _port = port;
       _socket = std::make_shared<TSocket>(ip_address, port);
       _socket->setConnTimeout(conn_timeout_ms);
-      _transport = std::make_shared<TBufferedTransport>(_socket);
-      _protocol = std::make_shared<TBinaryProtocol>(_transport);
+      if (transport == "framed")
+        _transport = std::make_shared<TFramedTransport>(_socket);
+      else
+        _transport = std::make_shared<TBufferedTransport>(_socket);
+      if (transport == "header")
+        _protocol = std::make_shared<THeaderProtocol>(_transport);
+      else if (protocol == "compact")
+        _protocol = std::make_shared<TCompactProtocol>(_transport);
+      else
+        _protocol = std::make_shared<TBinaryProtocol>(_transport);
       _client = std::make_shared<TLikeServiceClient>(_protocol);
       _transport->open();
     }
@@ -145,5 +158,62 @@ namespace like_service {
           _ip_address, _port, latency.count());
       return ret;
     }
+
+    std::map<int32_t, int32_t> count_likes_of_posts(
+        const TRequestMetadata& request_metadata,
+        const std::vector<int32_t>& post_ids) {
+      std::map<int32_t, int32_t> _return;
+      auto logger = spdlog::get("logger");
+      auto start_time = std::chrono::steady_clock::now();
+      _client->count_likes_of_posts(_return, request_metadata, post_ids);
+      std::chrono::duration<double> latency = \
+          std::chrono::steady_clock::now() - start_time;
+      logger->info("request_id={} server={}:{} "
+          "function=like:count_likes_of_posts latency={}",
+          request_metadata.id, _ip_address, _port, latency.count());
+      return _return;
+    }
+
+    int64_t get_version_of_likes_of_post(
+        const TRequestMetadata& request_metadata, const int32_t post_id) {
+      auto logger = spdlog::get("logger");
+      auto start_time = std::chrono::steady_clock::now();
+      auto ret = _client->get_version_of_likes_of_post(request_metadata,
+          post_id);
+      std::chrono::duration<double> latency = \
+          std::chrono::steady_clock::now() - start_time;
+      logger->info("request_id={} server={}:{} "
+          "function=like:get_version_of_likes_of_post latency={}",
+          request_metadata.id, _ip_address, _port, latency.count());
+      return ret;
+    }
+
+    std::vector<TPost> list_trending_posts(
+        const TRequestMetadata& request_metadata, const int32_t limit) {
+      std::vector<TPost> _return;
+      auto logger = spdlog::get("logger");
+      auto start_time = std::chrono::steady_clock::now();
+      _client->list_trending_posts(_return, request_metadata, limit);
+      std::chrono::duration<double> latency = \
+          std::chrono::steady_clock::now() - start_time;
+      logger->info("request_id={} server={}:{} "
+          "function=like:list_trending_posts latency={}", request_metadata.id,
+          _ip_address, _port, latency.count());
+      return _return;
+    }
+
+    std::map<int32_t, int32_t> count_local_trending_likes(
+        const TRequestMetadata& request_metadata) {
+      std::map<int32_t, int32_t> _return;
+      auto logger = spdlog::get("logger");
+      auto start_time = std::chrono::steady_clock::now();
+      _client->count_local_trending_likes(_return, request_metadata);
+      std::chrono::duration<double> latency = \
+          std::chrono::steady_clock::now() - start_time;
+      logger->info("request_id={} server={}:{} "
+          "function=like:count_local_trending_likes latency={}",
+          request_metadata.id, _ip_address, _port, latency.count());
+      return _return;
+    }
   };
 }
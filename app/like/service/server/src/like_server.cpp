@@ -1,17 +1,29 @@
 // Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
 // Systems
 
+#include <algorithm>
+#include <chrono>
+#include <cstdint>
+#include <ctime>
+#include <future>
+#include <iostream>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <set>
+#include <sstream>
 #include <string>
+#include <thread>
+#include <utility>
+#include <vector>
 
 #include <cxxopts.hpp>
 #include <spdlog/sinks/basic_file_sink.h>
-#include <thrift/protocol/TBinaryProtocol.h>
-#include <thrift/server/TThreadedServer.h>
-#include <thrift/transport/TBufferTransports.h>
-#include <thrift/transport/TServerSocket.h>
 
 #include <buzzblog/gen/TLikeService.h>
+#include <buzzblog/append_log.h>
 #include <buzzblog/base_server.h>
+#include <buzzblog/heavy_hitters.h>
 
 
 using namespace apache::thrift;
@@ -23,16 +35,162 @@ using namespace gen;
 
 
 class TLikeServiceHandler : public BaseServer, public TLikeServiceIf {
+private:
+  // Log of likes not yet added as unique pairs (null if likes are added
+  // synchronously).
+  std::unique_ptr<AppendLog> _like_log;
+  // Likes (account, post) in the log.
+  std::set<std::pair<int32_t, int32_t>> _pending_likes;
+  std::mutex _pending_likes_mutex;
+  // Most liked posts in the trending window, among the likes served by this
+  // server.
+  HeavyHitters _trending_posts;
+  // Address of this server in the list of like servers of the backend.
+  std::string _address;
+  // Max number of posts retrieved by a call to 'retrieve_posts'.
+  const size_t MAX_RETRIEVED_POSTS = 1000;
+  // Trending posts retrieved beyond the limit, in case some were deleted.
+  const size_t DELETED_POSTS_MARGIN = 10;
+
+  static bool parse_like(const std::string& record, int32_t& account_id,
+      int32_t& post_id) {
+    std::istringstream record_stream(record);
+    return static_cast<bool>(record_stream >> account_id >> post_id);
+  }
+
+  // Add the likes of the log as unique pairs, in log order.
+  void drain_like_log() {
+    while (true) {
+      off_t end_offset;
+      auto records = _like_log->read(100, end_offset);
+      if (records.empty()) {
+        std::this_thread::sleep_for(std::chrono::milliseconds(100));
+        continue;
+      }
+      try {
+        auto uniquepair_client = get_uniquepair_client();
+        for (auto& record : records) {
+          int32_t account_id, post_id;
+          if (!parse_like(record, account_id, post_id))
+            continue;
+          TRequestMetadata request_metadata;
+          request_metadata.id = "like_log";
+          request_metadata.requester_id = account_id;
+          try {
+            uniquepair_client->add(request_metadata, "like", account_id,
+                post_id);
+          }
+          catch (TUniquepairAlreadyExistsException e) {
+            // Already added before a crash.
+          }
+        }
+        uniquepair_client->close();
+        // Committing may fail on a disk error, in which case the records are
+        // added again (as duplicates, which are ignored).
+        _like_log->commit(end_offset);
+      }
+      catch (const std::exception& e) {
+        // Retry the same records later.
+        std::cout << "Failed to drain like log: " << e.what() << std::endl;
+        std::this_thread::sleep_for(std::chrono::seconds(1));
+        continue;
+      }
+
+      std::lock_guard<std::mutex> lock(_pending_likes_mutex);
+      for (auto& record : records) {
+        int32_t account_id, post_id;
+        if (parse_like(record, account_id, post_id))
+          _pending_likes.erase(std::make_pair(account_id, post_id));
+      }
+    }
+  }
+
+  // Retrieve an account (standard mode), once per request.
+  TAccount retrieve_account(account_service::Client& account_client,
+      const TRequestMetadata& request_metadata, const int32_t account_id) {
+    return memoize<TAccount>(request_metadata,
+        "account:retrieve_standard_account:" + std::to_string(account_id),
+        [&] {
+          return account_client.retrieve_standard_account(request_metadata,
+              account_id);
+        });
+  }
+
+  // Retrieve a post (expanded mode), once per request.
+  TPost retrieve_post(post_service::Client& post_client,
+      const TRequestMetadata& request_metadata, const int32_t post_id) {
+    return memoize<TPost>(request_metadata,
+        "post:retrieve_expanded_post:" + std::to_string(post_id),
+        [&] {
+          return post_client.retrieve_expanded_post(request_metadata, post_id);
+        });
+  }
+
 public:
   TLikeServiceHandler(const std::string& backend_filepath,
       const std::string& postgres_user, const std::string& postgres_password,
-      const std::string& postgres_dbname)
+      const std::string& postgres_dbname, bool async_likes,
+      const std::string& like_log_dirpath, int trending_k,
+      int trending_window_s, int trending_buckets, const std::string& address)
   : BaseServer(backend_filepath, postgres_user, postgres_password,
-      postgres_dbname) {
+      postgres_dbname),
+    _trending_posts(trending_k, trending_window_s, trending_buckets),
+    _address(address) {
+    if (async_likes) {
+      // Recover likes logged before a restart.
+      _like_log = std::make_unique<AppendLog>(like_log_dirpath, "likes");
+      off_t end_offset;
+      for (auto& record : _like_log->read(SIZE_MAX, end_offset)) {
+        int32_t account_id, post_id;
+        if (parse_like(record, account_id, post_id))
+          _pending_likes.insert(std::make_pair(account_id, post_id));
+      }
+      std::thread(&TLikeServiceHandler::drain_like_log, this).detach();
+    }
   }
 
   void like_post(TLike& _return, const TRequestMetadata& request_metadata,
       const int32_t post_id) {
+    if (_like_log) {
+      // Check if like is pending, and reserve it.
+      auto like = std::make_pair(request_metadata.requester_id, post_id);
+      {
+        std::lock_guard<std::mutex> lock(_pending_likes_mutex);
+        if (!_pending_likes.insert(like).second)
+          throw TLikeAlreadyExistsException();
+      }
+      try {
+        // Check if like exists.
+        auto uniquepair_client = get_uniquepair_client();
+        try {
+          uniquepair_client->find(request_metadata, "like",
+              request_metadata.requester_id, post_id);
+          throw TLikeAlreadyExistsException();
+        }
+        catch (TUniquepairNotFoundException e) {
+        }
+        uniquepair_client->close();
+
+        // Log like. It is added as a unique pair in the background.
+        _like_log->append(std::to_string(request_metadata.requester_id) + " " +
+            std::to_string(post_id));
+      }
+      catch (...) {
+        std::lock_guard<std::mutex> lock(_pending_likes_mutex);
+        _pending_likes.erase(like);
+        throw;
+      }
+
+      // Build like (standard mode).
+      // NOTE: The id of a pending like is unknown (-1).
+      _return.id = -1;
+      _return.created_at = static_cast<int32_t>(time(nullptr));
+      _return.account_id = request_metadata.requester_id;
+      _return.post_id = post_id;
+      _trending_posts.add(post_id, 1, _return.created_at);
+      return;
+    }
+
     // Add unique pair (account, post).
     auto uniquepair_client = get_uniquepair_client();
     TUniquepair uniquepair;
@@ -50,6 +208,7 @@ public:
     _return.created_at = uniquepair.created_at;
     _return.account_id = request_metadata.requester_id;
     _return.post_id = post_id;
+    _trending_posts.add(post_id, 1, _return.created_at);
   }
 
   void retrieve_standard_like(TLike& _return,
@@ -79,14 +238,13 @@ public:
 
     // Retrieve account.
     auto account_client = get_account_client();
-    auto account = account_client->retrieve_standard_account(request_metadata,
+    auto account = retrieve_account(*account_client, request_metadata,
         _return.account_id);
     account_client->close();
 
     // Retrieve post.
     auto post_client = get_post_client();
-    auto post = post_client->retrieve_expanded_post(request_metadata,
-        _return.post_id);
+    auto post = retrieve_post(*post_client, request_metadata, _return.post_id);
     post_client->close();
 
     // Build like (expanded mode).
@@ -96,10 +254,10 @@ public:
 
   void delete_like(const TRequestMetadata& request_metadata,
       const int32_t like_id) {
+    TUniquepair uniquepair;
     {
       // Get unique pair.
       auto uniquepair_client = get_uniquepair_client();
-      TUniquepair uniquepair;
       try {
         uniquepair = uniquepair_client->get(request_metadata, like_id);
       }
@@ -122,6 +280,7 @@ public:
       throw TLikeNotFoundException();
     }
     uniquepair_client->close();
+    _trending_posts.add(uniquepair.second_elem, -1, uniquepair.created_at);
   }
 
   void list_likes(std::vector<TLike>& _return,
@@ -141,17 +300,30 @@ public:
         request_metadata, uniquepair_query, limit, offset);
     uniquepair_client->close();
 
+    // Retrieve posts (expanded mode) with a single call.
+    std::map<int32_t, TPost> posts;
+    if (!uniquepairs.empty()) {
+      std::vector<int32_t> post_ids;
+      for (auto& it : uniquepairs)
+        post_ids.push_back(it.second_elem);
+      auto post_client = get_post_client();
+      for (auto& post : post_client->retrieve_posts(request_metadata,
+          post_ids, true))
+        posts[post.id] = post;
+      post_client->close();
+    }
+
     // Build likes.
     auto account_client = get_account_client();
-    auto post_client = get_post_client();
     for (auto it : uniquepairs) {
       // Retrieve account.
-      auto account = account_client->retrieve_standard_account(request_metadata,
+      auto account = retrieve_account(*account_client, request_metadata,
           it.first_elem);
 
-      // Retrieve post.
-      auto post = post_client->retrieve_expanded_post(request_metadata,
-          it.second_elem);
+      // Check if post exists.
+      auto post = posts.find(it.second_elem);
+      if (post == posts.end())
+        throw TPostNotFoundException();
 
       // Build like (expanded mode).
       TLike like;
@@ -160,11 +332,10 @@ public:
       like.account_id = it.first_elem;
       like.post_id = it.second_elem;
       like.__set_account(account);
-      like.__set_post(post);
+      like.__set_post(post->second);
       _return.push_back(like);
     }
     account_client->close();
-    post_client->close();
   }
 
   int32_t count_likes_by_account(const TRequestMetadata& request_metadata,
@@ -194,6 +365,97 @@ public:
     uniquepair_client->close();
     return count;
   }
+
+  void count_likes_of_posts(std::map<int32_t, int32_t>& _return,
+      const TRequestMetadata& request_metadata,
+      const std::vector<int32_t>& post_ids) {
+    // Count unique pairs of every post with a single call.
+    auto uniquepair_client = get_uniquepair_client();
+    _return = uniquepair_client->count_by_second_elems(request_metadata,
+        "like", post_ids);
+    uniquepair_client->close();
+  }
+
+  int64_t get_version_of_likes_of_post(
+      const TRequestMetadata& request_metadata, const int32_t post_id) {
+    // Build query struct.
+    TUniquepairQuery query;
+    query.__set_domain("like");
+    query.__set_second_elem(post_id);
+
+    // Get version of unique pairs.
+    auto uniquepair_client = get_uniquepair_client();
+    auto version = uniquepair_client->get_version(request_metadata, query);
+    uniquepair_client->close();
+    return version;
+  }
+
+  void list_trending_posts(std::vector<TPost>& _return,
+      const TRequestMetadata& request_metadata, const int32_t limit) {
+    // Add up the recent likes counted by every like server in parallel, since
+    // each one only counts the likes it serves. The counts of this server are
+    // read directly, as calling it would hold one more of its workers. A
+    // server that cannot be reached only lowers the counts.
+    std::vector<std::future<std::map<int32_t, int32_t>>> server_results;
+    for (auto& address : list_server_addresses("like")) {
+      if (address == _address)
+        continue;
+      server_results.push_back(std::async(std::launch::async,
+          [this, &request_metadata, address] {
+            try {
+              auto like_client = get_like_client(address);
+              auto counts = like_client->count_local_trending_likes(
+                  request_metadata);
+              like_client->close();
+              return counts;
+            }
+            catch (const std::exception& e) {
+              return std::map<int32_t, int32_t>();
+            }
+          }));
+    }
+    std::map<int32_t, int64_t> n_likes;
+    for (auto& it : _trending_posts.top(SIZE_MAX))
+      n_likes[it.first] += it.second;
+    for (auto& server_result : server_results)
+      for (auto& it : server_result.get())
+        n_likes[it.first] += it.second;
+
+    // Rank posts by decreasing number of recent likes, breaking ties by id.
+    std::vector<std::pair<int64_t, int32_t>> ranked_posts;
+    for (auto& it : n_likes)
+      if (it.second > 0)
+        ranked_posts.push_back(std::make_pair(it.second, it.first));
+    std::sort(ranked_posts.rbegin(), ranked_posts.rend());
+
+    // Retrieve the posts still missing (plus a margin for deleted ones) in one
+    // call, and retrieve more only if too many of them were deleted.
+    auto post_client = get_post_client();
+    size_t next_post = 0;
+    while (static_cast<int32_t>(_return.size()) < limit &&
+        next_post < ranked_posts.size()) {
+      std::vector<int32_t> post_ids;
+      auto n_posts = std::min(static_cast<size_t>(limit) - _return.size() +
+          DELETED_POSTS_MARGIN, MAX_RETRIEVED_POSTS);
+      while (post_ids.size() < n_posts && next_post < ranked_posts.size())
+        post_ids.push_back(ranked_posts[next_post++].second);
+      auto posts = post_client->retrieve_posts(request_metadata, post_ids,
+          true);
+      for (auto& post : posts) {
+        if (static_cast<int32_t>(_return.size()) >= limit)
+          break;
+        if (post.active)
+          _return.push_back(post);
+      }
+    }
+    post_client->close();
+  }
+
+  void count_local_trending_likes(std::map<int32_t, int32_t>& _return,
+      const TRequestMetadata& request_metadata) {
+    for (auto& it : _trending_posts.top(SIZE_MAX))
+      _return[it.first] = it.second;
+  }
 };
 
 
@@ -204,6 +466,10 @@ int main(int argc, char** argv) {
       ("host", "", cxxopts::value<std::string>()->default_value("0.0.0.0"))
       ("port", "", cxxopts::value<int>())
       ("threads", "", cxxopts::value<int>())
+      ("server_mode", "", cxxopts::value<std::string>()->default_value(
+          "threaded"))
+      ("io_threads", "", cxxopts::value<int>()->default_value("1"))
+      ("queue_depth", "", cxxopts::value<int>()->default_value("0"))
       ("backend_filepath", "", cxxopts::value<std::string>()->default_value(
           "/etc/opt/BuzzBlogApp/backend.yml"))
       ("postgres_user", "", cxxopts::value<std::string>()->default_value(
@@ -211,34 +477,50 @@ int main(int argc, char** argv) {
       ("postgres_password", "", cxxopts::value<std::string>()->default_value(
           "postgres"))
       ("postgres_dbname", "", cxxopts::value<std::string>()->default_value(
-          "postgres"));
+          "postgres"))
+      ("async_likes", "", cxxopts::value<bool>()->default_value("false"))
+      ("like_log_dirpath", "", cxxopts::value<std::string>()->default_value(
+          "/var/opt/BuzzBlogApp"))
+      ("trending_k", "", cxxopts::value<int>()->default_value("100"))
+      ("trending_window_s", "", cxxopts::value<int>()->default_value("3600"))
+      ("trending_buckets", "", cxxopts::value<int>()->default_value("12"))
+      ("address", "", cxxopts::value<std::string>()->default_value(""));
 
   // Parse command-line arguments.
   auto result = options.parse(argc, argv);
   std::string host = result["host"].as<std::string>();
   int port = result["port"].as<int>();
   int threads = result["threads"].as<int>();
+  std::string server_mode = result["server_mode"].as<std::string>();
+  int io_threads = result["io_threads"].as<int>();
+  int queue_depth = result["queue_depth"].as<int>();
   std::string backend_filepath = result["backend_filepath"].as<std::string>();
   std::string postgres_user = result["postgres_user"].as<std::string>();
   std::string postgres_password = result["postgres_password"].as<std::string>();
   std::string postgres_dbname = result["postgres_dbname"].as<std::string>();
+  bool async_likes = result["async_likes"].as<bool>();
+  std::string like_log_dirpath = result["like_log_dirpath"].as<std::string>();
+  int trending_k = result["trending_k"].as<int>();
+  int trending_window_s = result["trending_window_s"].as<int>();
+  int trending_buckets = result["trending_buckets"].as<int>();
+  std::string address = result["address"].as<std::string>();
 
   // Initialize logger.
   auto logger = spdlog::basic_logger_mt("logger", "/tmp/calls.log");
   logger->set_pattern("[%H:%M:%S.%F] pid=%P tid=%t %v");
 
   // Create server.
-  TThreadedServer server(
+  auto server = BaseServer::create_server(
       std::make_shared<TLikeServiceProcessor>(
           std::make_shared<TLikeServiceHandler>(backend_filepath,
-              postgres_user, postgres_password, postgres_dbname)),
-      std::make_shared<TServerSocket>(host, port),
-      std::make_shared<TBufferedTransportFactory>(),
-      std::make_shared<TBinaryProtocolFactory>());
-  server.setConcurrentClientLimit(threads);
+              postgres_user, postgres_password, postgres_dbname, async_likes,
+              like_log_dirpath, trending_k, trending_window_s,
+              trending_buckets, address)),
+      backend_filepath, "like", host, port, server_mode, threads, io_threads,
+      queue_depth);
 
   // Serve requests.
-  server.serve();
+  server->serve();
 
   return 0;
 }
@@ -5,11 +5,17 @@ import time
 import unittest
 
 from buzzblog.gen.ttypes import *
+from buzzblog.account_client import Client as AccountClient
 from buzzblog.like_client import Client as LikeClient
+from buzzblog.post_client import Client as PostClient
 
 
 IP_ADDRESS = "localhost"
 PORT = 9092
+# Like server with asynchronous likes.
+ASYNC_PORT = 9096
+ACCOUNT_PORT = 9090
+POST_PORT = 9093
 
 
 class TestService(unittest.TestCase):
@@ -28,6 +34,68 @@ class TestService(unittest.TestCase):
       self.assertEqual(like.account_id, retrieved_like.account_id)
       self.assertEqual(like.post_id, retrieved_like.post_id)
 
+  def check_like_post_is_added_once(self, port, account_id, post_ids):
+    with LikeClient(IP_ADDRESS, port) as client:
+      # Like posts. With asynchronous likes, they are only logged here.
+      for i, post_id in enumerate(post_ids):
+        like = client.like_post(
+            TRequestMetadata(id=str(i), requester_id=account_id), post_id)
+        self.assertEqual(account_id, like.account_id)
+        self.assertEqual(post_id, like.post_id)
+        # Liking the same post again fails, even if the like is pending.
+        with self.assertRaises(TLikeAlreadyExistsException):
+          client.like_post(
+              TRequestMetadata(id=str(i), requester_id=account_id), post_id)
+      # Wait until all likes were added, and check that each was added once.
+      for _ in range(100):
+        n_likes = client.count_likes_by_account(
+            TRequestMetadata(id="4", requester_id=account_id), account_id)
+        if n_likes >= len(post_ids):
+          break
+        time.sleep(0.1)
+      self.assertEqual(len(post_ids), n_likes)
+      for post_id in post_ids:
+        self.assertEqual(1, client.count_likes_of_post(
+            TRequestMetadata(id="5", requester_id=account_id), post_id))
+      self.assertEqual({post_id: 1 for post_id in post_ids},
+          client.count_likes_of_posts(
+              TRequestMetadata(id="6", requester_id=account_id), post_ids))
+
+  def test_like_post_is_added_once(self):
+    self.check_like_post_is_added_once(PORT, 3, [1001, 1002, 1003])
+
+  def test_like_post_is_added_once_async(self):
+    self.check_like_post_is_added_once(ASYNC_PORT, 4, [2001, 2002, 2003])
+
+  def test_list_trending_posts(self):
+    # Create an account with two posts.
+    with AccountClient(IP_ADDRESS, ACCOUNT_PORT) as client:
+      author = client.create_account(TRequestMetadata(id="1"),
+          "trending%d" % int(time.time()), "passwd", "First", "Last")
+    with PostClient(IP_ADDRESS, POST_PORT) as client:
+      first_post, second_post = [client.create_post(
+          TRequestMetadata(id="2", requester_id=author.id), "Trending")
+          for _ in range(2)]
+    # Like the first post 3 times through the first like server, and the
+    # second one twice through the second like server.
+    with LikeClient(IP_ADDRESS, PORT) as client:
+      for account_id in range(3001, 3004):
+        client.like_post(TRequestMetadata(id="3", requester_id=account_id),
+            first_post.id)
+    with LikeClient(IP_ADDRESS, ASYNC_PORT) as client:
+      for account_id in range(3004, 3006):
+        client.like_post(TRequestMetadata(id="4", requester_id=account_id),
+            second_post.id)
+      # The second like server adds up the counts of both servers, so the
+      # first post ranks higher although it served none of its likes.
+      post_ids = [post.id for post in client.list_trending_posts(
+          TRequestMetadata(id="5", requester_id=author.id), 100)]
+      self.assertLess(post_ids.index(first_post.id),
+          post_ids.index(second_post.id))
+      # At most 'limit' posts are listed.
+      self.assertEqual(1, len(client.list_trending_posts(
+          TRequestMetadata(id="6", requester_id=author.id), 1)))
+
   def retrieve_expanded_like(self):
     # TODO
     pass
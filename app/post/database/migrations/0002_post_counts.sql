@@ -0,0 +1,17 @@
+-- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+-- Systems
+
+-- Number of active posts of each author ('count_posts_by_author'), updated in
+-- the transaction that creates or deletes a post. Counters are filled from the
+-- existing posts, which are locked against writes meanwhile.
+CREATE TABLE PostCounts(
+  author_id INTEGER PRIMARY KEY,
+  count INTEGER NOT NULL
+);
+
+LOCK TABLE Posts IN SHARE MODE;
+INSERT INTO PostCounts (author_id, count)
+SELECT author_id, COUNT(*)
+FROM Posts
+WHERE active = TRUE
+GROUP BY author_id;
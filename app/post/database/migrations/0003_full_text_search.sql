@@ -0,0 +1,9 @@
+-- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+-- Systems
+
+-- Posts are searched by their words ('search_posts') through a GIN index on
+-- their text, which Postgres keeps up to date as posts are created.
+ALTER TABLE Posts ADD COLUMN text_tsv TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('english', text)) STORED;
+
+CREATE INDEX idx_text_tsv ON Posts USING GIN(text_tsv);
@@ -0,0 +1,12 @@
+-- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+-- Systems
+
+-- Posts are listed from newest to oldest among the active posts of an author,
+-- or of all authors ('list_posts'). Both lists are read in index order.
+CREATE INDEX idx_active_author_id_created_at
+    ON Posts(author_id, created_at DESC) WHERE active = true;
+CREATE INDEX idx_active_created_at
+    ON Posts(created_at DESC) WHERE active = true;
+
+DROP INDEX IF EXISTS idx_created_at;
+DROP INDEX IF EXISTS idx_author_id;
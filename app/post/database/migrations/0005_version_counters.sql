@@ -0,0 +1,6 @@
+-- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+-- Systems
+
+-- Version of the posts of each author, incremented whenever one of them is
+-- created or deleted ('get_version_of_posts_by_author').
+ALTER TABLE PostCounts ADD COLUMN version BIGINT NOT NULL DEFAULT 0;
@@ -0,0 +1,26 @@
+-- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+-- Systems
+
+-- Read model of posts in expanded mode: each post with its author and number
+-- of likes, kept up to date from the change log by the read model projector of
+-- the post service ('retrieve_expanded_post' and 'list_posts' with
+-- 'read_model'). Posts are stored in the shard of the post. Lists are read in
+-- index order, and the posts of an author are updated when the author is.
+CREATE TABLE IF NOT EXISTS ExpandedPosts(
+  id INTEGER PRIMARY KEY,
+  created_at INTEGER NOT NULL,
+  active BOOLEAN NOT NULL,
+  text VARCHAR(256) NOT NULL,
+  author_id INTEGER NOT NULL,
+  author_created_at INTEGER NOT NULL,
+  author_active BOOLEAN NOT NULL,
+  author_username VARCHAR(64) NOT NULL,
+  author_first_name VARCHAR(64) NOT NULL,
+  author_last_name VARCHAR(64) NOT NULL,
+  n_likes INTEGER NOT NULL
+);
+
+CREATE INDEX idx_expanded_author_id_created_at
+    ON ExpandedPosts(author_id, created_at DESC);
+CREATE INDEX idx_expanded_active_created_at
+    ON ExpandedPosts(created_at DESC) WHERE active = true;
@@ -0,0 +1,11 @@
+-- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+-- Systems
+
+-- Version of the posts of each author in the read model, incremented by the
+-- read model projector in the transaction that rewrites any of them, so that
+-- it never changes before the posts it covers ('get_version_of_posts_by_author'
+-- with 'read_model').
+CREATE TABLE ExpandedPostVersions(
+  author_id INTEGER PRIMARY KEY,
+  version BIGINT NOT NULL
+);
@@ -4,10 +4,13 @@
 #include <chrono>
 #include <memory>
 #include <string>
+#include <vector>
 
 #include <spdlog/spdlog.h>
 #include <spdlog/sinks/basic_file_sink.h>
 #include <thrift/protocol/TBinaryProtocol.h>
+#include <thrift/protocol/TCompactProtocol.h>
+#include <thrift/protocol/THeaderProtocol.h>
 #include <thrift/transport/TSocket.h>
 #include <thrift/transport/TTransportUtils.h>
 
@@ -31,13 +34,23 @@ namespace post_service {
     std::shared_ptr<TProtocol> _protocol;
     std::shared_ptr<TPostServiceClient> _client;
    public:
-    Client(const std::string& ip_address, int port, int conn_timeout_ms) {
+    Client(const std::string& ip_address, int port, int conn_timeout_ms,
+        const std::string& transport = "buffered",
+        const std::string& protocol = "binary") {
       _ip_address = ip_address;
       _port = port;
       _socket = std::make_shared<TSocket>(ip_address, port);
       _socket->setConnTimeout(conn_timeout_ms);
-      _transport = std::make_shared<TBufferedTransport>(_socket);
-      _protocol = std::make_shared<TBinaryProtocol>(_transport);
+      if (transport == "framed")
+        _transport = std::make_shared<TFramedTransport>(_socket);
+      else
+        _transport = std::make_shared<TBufferedTransport>(_socket);
+      if (transport == "header")
+        _protocol = std::make_shared<THeaderProtocol>(_transport);
+      else if (protocol == "compact")
+        _protocol = std::make_shared<TCompactProtocol>(_transport);
+      else
+        _protocol = std::make_shared<TBinaryProtocol>(_transport);
       _client = std::make_shared<TPostServiceClient>(_protocol);
       _transport->open();
     }
@@ -93,6 +106,20 @@ namespace post_service {
       return _return;
     }
 
+    std::vector<TPost> retrieve_posts(const TRequestMetadata& request_metadata,
+        const std::vector<int32_t>& post_ids, const bool expanded) {
+      std::vector<TPost> _return;
+      auto logger = spdlog::get("logger");
+      auto start_time = std::chrono::steady_clock::now();
+      _client->retrieve_posts(_return, request_metadata, post_ids, expanded);
+      std::chrono::duration<double> latency = \
+          std::chrono::steady_clock::now() - start_time;
+      logger->info("request_id={} server={}:{} "
+          "function=post:retrieve_posts latency={}", request_metadata.id,
+          _ip_address, _port, latency.count());
+      return _return;
+    }
+
     void delete_post(const TRequestMetadata& request_metadata,
         const int32_t post_id) {
       auto logger = spdlog::get("logger");
@@ -131,5 +158,34 @@ namespace post_service {
           _ip_address, _port, latency.count());
       return ret;
     }
+
+    int64_t get_version_of_posts_by_author(
+        const TRequestMetadata& request_metadata, const int32_t author_id) {
+      auto logger = spdlog::get("logger");
+      auto start_time = std::chrono::steady_clock::now();
+      auto ret = _client->get_version_of_posts_by_author(request_metadata,
+          author_id);
+      std::chrono::duration<double> latency = \
+          std::chrono::steady_clock::now() - start_time;
+      logger->info("request_id={} server={}:{} "
+          "function=post:get_version_of_posts_by_author latency={}",
+          request_metadata.id, _ip_address, _port, latency.count());
+      return ret;
+    }
+
+    TPostSearchPage search_posts(const TRequestMetadata& request_metadata,
+        const std::string& query, const std::string& cursor,
+        const int32_t limit) {
+      TPostSearchPage _return;
+      auto logger = spdlog::get("logger");
+      auto start_time = std::chrono::steady_clock::now();
+      _client->search_posts(_return, request_metadata, query, cursor, limit);
+      std::chrono::duration<double> latency = \
+          std::chrono::steady_clock::now() - start_time;
+      logger->info("request_id={} server={}:{} "
+          "function=post:search_posts latency={}", request_metadata.id,
+          _ip_address, _port, latency.count());
+      return _return;
+    }
   };
 }
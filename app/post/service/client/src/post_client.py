@@ -1,12 +1,17 @@
 # Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
 # Systems
 
+import collections
+import threading
 import time
 
 import spdlog as spd
+from thrift.transport import THeaderTransport
 from thrift.transport import TSocket
 from thrift.transport import TTransport
 from thrift.protocol import TBinaryProtocol
+from thrift.protocol import TCompactProtocol
+from thrift.protocol import THeaderProtocol
 
 from buzzblog.gen import TPostService
 
@@ -27,14 +32,57 @@ def instrumented(func):
   return func_wrapper
 
 
+# Time (in seconds) reads are memoized for the request that made them.
+REQUEST_CACHE_TTL = 1.0
+_request_cache = collections.OrderedDict()
+_request_cache_lock = threading.Lock()
+
+
+def memoized(func):
+  # Repeated reads with the same arguments within a request are served
+  # locally. Reads are scoped by the 'scope_id' of the request, which the API
+  # gateway mints for each request, and by the requester; they are not
+  # memoized without a scope id. Results are kept for REQUEST_CACHE_TTL
+  # seconds, which bounds the duration of a request.
+  def func_wrapper(self, request_metadata, *args, **kwargs):
+    if request_metadata.scope_id is None:
+      return func(self, request_metadata, *args, **kwargs)
+    key = (request_metadata.scope_id, request_metadata.requester_id,
+        func.__name__, repr(args), repr(sorted(kwargs.items())))
+    now = time.monotonic()
+    with _request_cache_lock:
+      # Entries expire in insertion order.
+      while _request_cache and next(iter(_request_cache.values()))[0] <= now:
+        _request_cache.popitem(last=False)
+      if key in _request_cache:
+        return _request_cache[key][1]
+    ret = func(self, request_metadata, *args, **kwargs)
+    with _request_cache_lock:
+      _request_cache.setdefault(key, (now + REQUEST_CACHE_TTL, ret))
+    return ret
+  return func_wrapper
+
+
 class Client:
-  def __init__(self, ip_address, port, timeout=10000):
+  def __init__(self, ip_address, port, timeout=10000, transport="buffered",
+      protocol="binary"):
     self._ip_address = ip_address
     self._port = port
     self._socket = TSocket.TSocket(ip_address, port)
     self._socket.setTimeout(timeout)
-    self._transport = TTransport.TBufferedTransport(self._socket)
-    self._protocol = TBinaryProtocol.TBinaryProtocol(self._transport)
+    if transport == "framed":
+      self._transport = TTransport.TFramedTransport(self._socket)
+    else:
+      self._transport = TTransport.TBufferedTransport(self._socket)
+    if transport == "header":
+      self._protocol = THeaderProtocol.THeaderProtocol(self._transport,
+          [THeaderTransport.THeaderClientType.HEADERS])
+    elif protocol == "compact":
+      self._protocol = TCompactProtocol.TCompactProtocolAccelerated(
+          self._transport)
+    else:
+      self._protocol = TBinaryProtocol.TBinaryProtocolAccelerated(
+          self._transport)
     self._tclient = TPostService.Client(self._protocol)
     self._transport.open()
 
@@ -56,16 +104,24 @@ class Client:
     return self._tclient.create_post(request_metadata=request_metadata,
         text=text)
 
+  @memoized
   @instrumented
   def retrieve_standard_post(self, request_metadata, post_id):
     return self._tclient.retrieve_standard_post(
         request_metadata=request_metadata, post_id=post_id)
 
+  @memoized
   @instrumented
   def retrieve_expanded_post(self, request_metadata, post_id):
     return self._tclient.retrieve_expanded_post(
         request_metadata=request_metadata, post_id=post_id)
 
+  @memoized
+  @instrumented
+  def retrieve_posts(self, request_metadata, post_ids, expanded):
+    return self._tclient.retrieve_posts(request_metadata=request_metadata,
+        post_ids=post_ids, expanded=expanded)
+
   @instrumented
   def delete_post(self, request_metadata, post_id):
     return self._tclient.delete_post(request_metadata=request_metadata,
@@ -75,3 +131,13 @@ class Client:
   def list_posts(self, request_metadata, query, limit, offset):
     return self._tclient.list_posts(request_metadata=request_metadata,
         query=query, limit=limit, offset=offset)
+
+  @instrumented
+  def search_posts(self, request_metadata, query, cursor, limit):
+    return self._tclient.search_posts(request_metadata=request_metadata,
+        query=query, cursor=cursor, limit=limit)
+
+  @instrumented
+  def get_version_of_posts_by_author(self, request_metadata, author_id):
+    return self._tclient.get_version_of_posts_by_author(
+        request_metadata=request_metadata, author_id=author_id)
@@ -1,18 +1,28 @@
 // Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
 // Systems
 
+#include <algorithm>
+#include <chrono>
+#include <cstdio>
+#include <future>
+#include <iostream>
+#include <map>
+#include <memory>
+#include <queue>
+#include <set>
+#include <sstream>
 #include <string>
+#include <thread>
+#include <utility>
+#include <vector>
 
 #include <cxxopts.hpp>
 #include <pqxx/pqxx>
 #include <spdlog/sinks/basic_file_sink.h>
-#include <thrift/protocol/TBinaryProtocol.h>
-#include <thrift/server/TThreadedServer.h>
-#include <thrift/transport/TBufferTransports.h>
-#include <thrift/transport/TServerSocket.h>
 
 #include <buzzblog/gen/TPostService.h>
 #include <buzzblog/base_server.h>
+#include <buzzblog/change_log.h>
 
 
 using namespace apache::thrift;
@@ -25,6 +35,20 @@ using namespace gen;
 
 class TPostServiceHandler : public BaseServer, public TPostServiceIf {
 private:
+  // Max number of posts retrieved by a call to 'retrieve_posts'.
+  const size_t MAX_RETRIEVED_POSTS = 1000;
+  // Max number of posts in a page of 'search_posts'.
+  const int32_t MAX_SEARCHED_POSTS = 100;
+  // Max number of changes applied at once to the read model.
+  const size_t READ_MODEL_BATCH_SIZE = 100;
+  // Columns of the read model of expanded posts (table 'ExpandedPosts').
+  const std::string EXPANDED_POST_COLUMNS = "id, created_at, active, text, "
+      "author_id, author_created_at, author_active, author_username, "
+      "author_first_name, author_last_name, n_likes";
+
+  // Whether expanded posts are read from the read model.
+  bool _read_model;
+
   bool validate_attributes(const std::string& text) {
     return (text.size() > 0 && text.size() <= 200);
   }
@@ -37,12 +61,511 @@ private:
     return where_clause.str();
   }
 
+  // Return the shard that stores the posts of 'author_id'.
+  // NOTE: The number of post shards cannot change while the server runs, as
+  // 'load_backend' rejects such a reload.
+  int get_shard_of_author(const int32_t author_id) {
+    return author_id % count_db_shards("post");
+  }
+
+  // Return the shard that stores post 'post_id'.
+  // NOTE: Post ids are assigned as (sequence value * number of shards +
+  // shard), so the shard is encoded in the id.
+  int get_shard_of_post(const int32_t post_id) {
+    return post_id % count_db_shards("post");
+  }
+
+  // List posts of 'shard' in standard mode, or in expanded mode if they are
+  // read from the read model.
+  std::vector<TPost> list_posts_of_shard(
+      const TRequestMetadata& request_metadata, const TPostQuery& query,
+      const int32_t limit, const int32_t offset, const int shard) {
+    // Build query string.
+    char query_str[1024];
+    const char *query_fmt = \
+        "SELECT %s "
+        "FROM %s "
+        "WHERE %s "
+        "ORDER BY created_at DESC "
+        "LIMIT %d "
+        "OFFSET %d";
+    sprintf(query_str, query_fmt,
+        _read_model ? EXPANDED_POST_COLUMNS.c_str() :
+            "id, created_at, active, text, author_id",
+        _read_model ? "ExpandedPosts" : "Posts",
+        build_where_clause(query).c_str(), limit, offset);
+
+    // Execute query.
+    auto conn = connect_db_replica<pqxx::connection>("post",
+        request_metadata.requester_id, shard);
+    pqxx::work txn(*conn);
+    pqxx::result db_res(txn.exec(query_str));
+    txn.commit();
+    conn->disconnect();
+
+    // Build posts.
+    std::vector<TPost> posts;
+    for (auto row : db_res) {
+      if (_read_model) {
+        posts.push_back(build_expanded_post(row));
+        continue;
+      }
+      TPost post;
+      post.id = row["id"].as<int>();
+      post.created_at = row["created_at"].as<int>();
+      post.active = row["active"].as<bool>();
+      post.text = row["text"].as<std::string>();
+      post.author_id = row["author_id"].as<int>();
+      posts.push_back(post);
+    }
+    return posts;
+  }
+
+  // Build a post (expanded mode) from a row of the read model.
+  TPost build_expanded_post(const pqxx::row& row) {
+    TPost post;
+    post.id = row["id"].as<int>();
+    post.created_at = row["created_at"].as<int>();
+    post.active = row["active"].as<bool>();
+    post.text = row["text"].as<std::string>();
+    post.author_id = row["author_id"].as<int>();
+    TAccount author;
+    author.id = post.author_id;
+    author.created_at = row["author_created_at"].as<int>();
+    author.active = row["author_active"].as<bool>();
+    author.username = row["author_username"].as<std::string>();
+    author.first_name = row["author_first_name"].as<std::string>();
+    author.last_name = row["author_last_name"].as<std::string>();
+    post.__set_author(author);
+    post.__set_n_likes(row["n_likes"].as<int>());
+    return post;
+  }
+
+  // Retrieve the author of a post, once per request.
+  TAccount retrieve_author(account_service::Client& account_client,
+      const TRequestMetadata& request_metadata, const int32_t author_id) {
+    return memoize<TAccount>(request_metadata,
+        "account:retrieve_standard_account:" + std::to_string(author_id),
+        [&] {
+          return account_client.retrieve_standard_account(request_metadata,
+              author_id);
+        });
+  }
+
+  // Count the likes of a post, once per request.
+  int32_t count_likes(like_service::Client& like_client,
+      const TRequestMetadata& request_metadata, const int32_t post_id) {
+    return memoize<int32_t>(request_metadata,
+        "like:count_likes_of_post:" + std::to_string(post_id),
+        [&] {
+          return like_client.count_likes_of_post(request_metadata, post_id);
+        });
+  }
+
+  // Count the likes of several posts with a single call, once per request.
+  std::map<int32_t, int32_t> count_likes(like_service::Client& like_client,
+      const TRequestMetadata& request_metadata,
+      const std::vector<int32_t>& post_ids) {
+    std::ostringstream call_key;
+    call_key << "like:count_likes_of_posts:";
+    for (size_t i = 0; i < post_ids.size(); i++)
+      call_key << (i > 0 ? "," : "") << post_ids[i];
+    return memoize<std::map<int32_t, int32_t>>(request_metadata,
+        call_key.str(),
+        [&] {
+          return like_client.count_likes_of_posts(request_metadata, post_ids);
+        });
+  }
+
+  // Expand 'posts' with their author and like activity, and append them to
+  // '_return'. Authors (once each) and like counts (with a single call) are
+  // retrieved concurrently, each over a single connection.
+  void expand_posts(std::vector<TPost>& _return,
+      const TRequestMetadata& request_metadata, std::vector<TPost>& posts) {
+    if (posts.empty())
+      return;
+
+    // Retrieve authors.
+    auto authors = std::async(std::launch::async, [&] {
+      std::map<int32_t, TAccount> authors;
+      auto account_client = get_account_client();
+      for (const auto& post : posts)
+        if (authors.find(post.author_id) == authors.end())
+          authors[post.author_id] = retrieve_author(*account_client,
+              request_metadata, post.author_id);
+      account_client->close();
+      return authors;
+    });
+
+    // Retrieve like activity.
+    auto n_likes = std::async(std::launch::async, [&] {
+      std::vector<int32_t> post_ids;
+      for (const auto& post : posts)
+        post_ids.push_back(post.id);
+      auto like_client = get_like_client();
+      auto n_likes = count_likes(*like_client, request_metadata, post_ids);
+      like_client->close();
+      return n_likes;
+    });
+
+    // Build posts (expanded mode).
+    auto post_authors = authors.get();
+    auto post_n_likes = n_likes.get();
+    for (size_t i = 0; i < posts.size(); i++) {
+      posts[i].__set_author(post_authors[posts[i].author_id]);
+      posts[i].__set_n_likes(post_n_likes[posts[i].id]);
+      _return.push_back(posts[i]);
+    }
+  }
+
+  std::vector<TPost> retrieve_posts_of_shard(
+      const TRequestMetadata& request_metadata,
+      const std::vector<int32_t>& post_ids, const int shard) {
+    // Build query string.
+    std::ostringstream query_str;
+    query_str << "SELECT id, created_at, active, text, author_id "
+        << "FROM Posts "
+        << "WHERE id = ANY('{";
+    for (size_t i = 0; i < post_ids.size(); i++)
+      query_str << (i > 0 ? "," : "") << post_ids[i];
+    query_str << "}'::int[])";
+
+    // Execute query.
+    auto conn = connect_db_replica<pqxx::connection>("post",
+        request_metadata.requester_id, shard);
+    pqxx::work txn(*conn);
+    pqxx::result db_res(txn.exec(query_str.str()));
+    txn.commit();
+    conn->disconnect();
+
+    // Build posts (standard mode).
+    std::vector<TPost> posts;
+    for (auto row : db_res) {
+      TPost post;
+      post.id = row["id"].as<int>();
+      post.created_at = row["created_at"].as<int>();
+      post.active = row["active"].as<bool>();
+      post.text = row["text"].as<std::string>();
+      post.author_id = row["author_id"].as<int>();
+      posts.push_back(post);
+    }
+    return posts;
+  }
+
+  bool validate_search_query(const std::string& query) {
+    return (query.size() > 0 && query.size() <= 200);
+  }
+
+  // Parse a search cursor of the form "<rank>:<post id>", as returned in
+  // 'next_cursor'.
+  bool parse_search_cursor(const std::string& cursor, float& rank,
+      int32_t& post_id) {
+    char end;
+    return sscanf(cursor.c_str(), "%f:%d%c", &rank, &post_id, &end) == 2;
+  }
+
+  struct SearchMatch {
+    float rank;
+    TPost post;
+  };
+
+  std::vector<SearchMatch> search_posts_of_shard(
+      const TRequestMetadata& request_metadata, const std::string& query,
+      const std::string& cursor_clause, const int32_t limit, const int shard) {
+    auto conn = connect_db_replica<pqxx::connection>("post",
+        request_metadata.requester_id, shard);
+    pqxx::work txn(*conn);
+
+    // Build query string.
+    // NOTE: Matches are looked up in the GIN index on 'text_tsv', and pages
+    // are delimited by the (rank, id) of the last match of the previous page.
+    // Relevance cannot be indexed, so every page ranks and sorts all the
+    // matches of the query: the cursor avoids returning (and expanding) the
+    // previous pages, not scanning them.
+    char query_str[1024];
+    const char *query_fmt = \
+        "SELECT id, created_at, active, text, author_id, rank "
+        "FROM ("
+            "SELECT id, created_at, active, text, author_id, "
+                "ts_rank(text_tsv, query) AS rank "
+            "FROM Posts, plainto_tsquery('english', %s) AS query "
+            "WHERE active = true AND text_tsv @@ query"
+        ") AS matches "
+        "WHERE %s "
+        "ORDER BY rank DESC, id DESC "
+        "LIMIT %d";
+    sprintf(query_str, query_fmt, txn.quote(query).c_str(),
+        cursor_clause.c_str(), limit);
+
+    // Execute query.
+    pqxx::result db_res(txn.exec(query_str));
+    txn.commit();
+    conn->disconnect();
+
+    // Build matches (standard mode).
+    std::vector<SearchMatch> matches;
+    for (auto row : db_res) {
+      SearchMatch match;
+      match.rank = row["rank"].as<float>();
+      match.post.id = row["id"].as<int>();
+      match.post.created_at = row["created_at"].as<int>();
+      match.post.active = row["active"].as<bool>();
+      match.post.text = row["text"].as<std::string>();
+      match.post.author_id = row["author_id"].as<int>();
+      matches.push_back(match);
+    }
+    return matches;
+  }
+
+  // Add 'delta' to the number of active posts of 'author_id' and increment
+  // their version, in the transaction that creates or deletes a post.
+  void update_count(pqxx::work& txn, const int32_t author_id,
+      const int delta) {
+    // Build query string.
+    char query_str[1024];
+    const char *query_fmt = \
+        "INSERT INTO PostCounts (author_id, count, version) "
+        "VALUES (%d, %d, 1) "
+        "ON CONFLICT (author_id) "
+        "DO UPDATE SET count = PostCounts.count + EXCLUDED.count, "
+            "version = PostCounts.version + 1";
+    sprintf(query_str, query_fmt, author_id, delta);
+
+    // Execute query.
+    txn.exec(query_str);
+  }
+
+  // Log of the changes of posts (null if changes are not logged).
+  std::unique_ptr<ChangeLog> _change_log;
+
+  // Queue the creation or deletion of post 'post_id' in 'txn', if changes are
+  // logged. A post is created once and deleted at most once, so these are
+  // its changes 1 and 2.
+  void queue_change(pqxx::work& txn, const int32_t post_id,
+      const int32_t author_id, bool created) {
+    if (_change_log)
+      _change_log->queue(txn, Change{"post", post_id, created ? 1 : 2,
+          created ? "created" : "deleted", {{"author_id", author_id}}});
+  }
+
+  // Publish the changes queued by a committed transaction, if changes are
+  // logged.
+  void publish_changes() {
+    if (_change_log)
+      _change_log->notify();
+  }
+
+  // Increment the version of the posts of 'author_id' in the read model, in
+  // the transaction that rewrites any of them.
+  void update_read_model_version(pqxx::work& txn, const int32_t author_id) {
+    // Build query string.
+    char query_str[1024];
+    const char *query_fmt = \
+        "INSERT INTO ExpandedPostVersions (author_id, version) "
+        "VALUES (%d, 1) "
+        "ON CONFLICT (author_id) "
+        "DO UPDATE SET version = ExpandedPostVersions.version + 1";
+    sprintf(query_str, query_fmt, author_id);
+
+    // Execute query.
+    txn.exec(query_str);
+  }
+
+  // Write post 'post_id' to the read model with its current author and like
+  // activity.
+  void project_post(const int32_t post_id) {
+    auto shard = get_shard_of_post(post_id);
+
+    // Retrieve standard post from the primary, which has every committed
+    // change.
+    char query_str[1024];
+    const char *query_fmt = \
+        "SELECT created_at, active, text, author_id "
+        "FROM Posts "
+        "WHERE id = %d";
+    sprintf(query_str, query_fmt, post_id);
+    pqxx::connection conn(get_db_conn_str("post", shard));
+    pqxx::work txn(conn);
+    pqxx::result db_res(txn.exec(query_str));
+    txn.commit();
+    if (db_res.begin() == db_res.end())
+      return;
+    auto author_id = db_res[0][3].as<int>();
+
+    // Retrieve author and like activity.
+    TRequestMetadata request_metadata;
+    request_metadata.id = "read_model";
+    request_metadata.requester_id = author_id;
+    TAccount author;
+    auto account_client = get_account_client();
+    try {
+      author = account_client->retrieve_standard_account(request_metadata,
+          author_id);
+    }
+    catch (TAccountNotFoundException e) {
+      // A post without author cannot be expanded.
+      return;
+    }
+    account_client->close();
+    auto like_client = get_like_client();
+    auto n_likes = like_client->count_likes_of_post(request_metadata,
+        post_id);
+    like_client->close();
+
+    // Build query string.
+    pqxx::work upsert_txn(conn);
+    std::ostringstream upsert_str;
+    upsert_str << "INSERT INTO ExpandedPosts (" << EXPANDED_POST_COLUMNS
+        << ") VALUES (" << post_id << ", " << db_res[0][0].as<int>() << ", "
+        << (db_res[0][1].as<bool>() ? "TRUE" : "FALSE") << ", "
+        << upsert_txn.quote(db_res[0][2].as<std::string>()) << ", "
+        << author_id << ", " << author.created_at << ", "
+        << (author.active ? "TRUE" : "FALSE") << ", "
+        << upsert_txn.quote(author.username) << ", "
+        << upsert_txn.quote(author.first_name) << ", "
+        << upsert_txn.quote(author.last_name) << ", " << n_likes << ") "
+        << "ON CONFLICT (id) "
+        << "DO UPDATE SET active = EXCLUDED.active, "
+        << "author_created_at = EXCLUDED.author_created_at, "
+        << "author_active = EXCLUDED.author_active, "
+        << "author_username = EXCLUDED.author_username, "
+        << "author_first_name = EXCLUDED.author_first_name, "
+        << "author_last_name = EXCLUDED.author_last_name, "
+        << "n_likes = EXCLUDED.n_likes";
+
+    // Execute query.
+    upsert_txn.exec(upsert_str.str());
+    update_read_model_version(upsert_txn, author_id);
+    upsert_txn.commit();
+    conn.disconnect();
+  }
+
+  // Write the current account 'author_id' to the posts it authored in the
+  // read model.
+  void project_author(const int32_t author_id) {
+    // Retrieve author.
+    TRequestMetadata request_metadata;
+    request_metadata.id = "read_model";
+    request_metadata.requester_id = author_id;
+    TAccount author;
+    auto account_client = get_account_client();
+    try {
+      author = account_client->retrieve_standard_account(request_metadata,
+          author_id);
+    }
+    catch (TAccountNotFoundException e) {
+      return;
+    }
+    account_client->close();
+
+    // Build query string.
+    pqxx::connection conn(get_db_conn_str("post",
+        get_shard_of_author(author_id)));
+    pqxx::work txn(conn);
+    std::ostringstream query_str;
+    query_str << "UPDATE ExpandedPosts "
+        << "SET author_created_at = " << author.created_at << ", "
+        << "author_active = " << (author.active ? "TRUE" : "FALSE") << ", "
+        << "author_username = " << txn.quote(author.username) << ", "
+        << "author_first_name = " << txn.quote(author.first_name) << ", "
+        << "author_last_name = " << txn.quote(author.last_name) << " "
+        << "WHERE author_id = " << author_id;
+
+    // Execute query.
+    txn.exec(query_str.str());
+    update_read_model_version(txn, author_id);
+    txn.commit();
+    conn.disconnect();
+  }
+
+  // Write the current number of likes of post 'post_id' to the read model.
+  void project_likes(const int32_t post_id) {
+    // Count likes.
+    TRequestMetadata request_metadata;
+    request_metadata.id = "read_model";
+    request_metadata.requester_id = 0;
+    auto like_client = get_like_client();
+    auto n_likes = like_client->count_likes_of_post(request_metadata,
+        post_id);
+    like_client->close();
+
+    // Build query string.
+    char query_str[1024];
+    const char *query_fmt = \
+        "UPDATE ExpandedPosts "
+        "SET n_likes = %d "
+        "WHERE id = %d "
+        "RETURNING author_id";
+    sprintf(query_str, query_fmt, n_likes, post_id);
+
+    // Execute query.
+    pqxx::connection conn(get_db_conn_str("post", get_shard_of_post(post_id)));
+    pqxx::work txn(conn);
+    pqxx::result db_res(txn.exec(query_str));
+    if (db_res.begin() != db_res.end())
+      update_read_model_version(txn, db_res[0][0].as<int>());
+    txn.commit();
+    conn.disconnect();
+  }
+
+  // Keep the read model up to date with the changes of posts, accounts and
+  // likes published to the change log. A change is applied by writing the
+  // current state of what it changed (a post, the posts of an author, or the
+  // like activity of a post), so changes can be applied more than once and in
+  // any order.
+  void project_read_model(const std::string& change_log_dirpath) {
+    ChangeLogSubscriber subscriber(change_log_dirpath, "post-read-model");
+    while (true) {
+      auto changes = subscriber.read(READ_MODEL_BATCH_SIZE);
+      if (changes.empty()) {
+        std::this_thread::sleep_for(std::chrono::milliseconds(100));
+        continue;
+      }
+
+      // Apply the changes of each post, author and like activity once.
+      std::set<int32_t> post_ids, author_ids, liked_post_ids;
+      for (auto& change : changes) {
+        if (change.entity == "post")
+          post_ids.insert(change.id);
+        else if (change.entity == "account")
+          author_ids.insert(change.id);
+        else if (change.entity == "like" &&
+            change.attributes.count("second_elem"))
+          liked_post_ids.insert(change.attributes["second_elem"]);
+      }
+      try {
+        for (auto post_id : post_ids)
+          project_post(post_id);
+        for (auto author_id : author_ids)
+          project_author(author_id);
+        for (auto post_id : liked_post_ids)
+          if (post_ids.find(post_id) == post_ids.end())
+            project_likes(post_id);
+        subscriber.commit();
+      }
+      catch (const std::exception& e) {
+        // Retry the same changes later.
+        std::cout << "Failed to project changes: " << e.what() << std::endl;
+        std::this_thread::sleep_for(std::chrono::seconds(1));
+      }
+    }
+  }
+
 public:
   TPostServiceHandler(const std::string& backend_filepath,
       const std::string& postgres_user, const std::string& postgres_password,
-      const std::string& postgres_dbname)
+      const std::string& postgres_dbname, bool change_log,
+      const std::string& change_log_dirpath, bool read_model,
+      bool read_model_projector)
   : BaseServer(backend_filepath, postgres_user, postgres_password,
-      postgres_dbname) {
+      postgres_dbname),
+    _read_model(read_model) {
+    if (change_log)
+      _change_log = std::make_unique<ChangeLog>(change_log_dirpath, "post",
+          [this] { return list_db_conn_strs("post"); });
+    if (read_model_projector)
+      std::thread(&TPostServiceHandler::project_read_model, this,
+          change_log_dirpath).detach();
   }
 
   void create_post(TPost& _return, const TRequestMetadata& request_metadata,
@@ -51,20 +574,29 @@ public:
     if (!validate_attributes(text))
       throw TPostInvalidAttributesException();
 
+    auto shard = get_shard_of_author(request_metadata.requester_id);
+
     // Build query string.
     char query_str[1024];
     const char *query_fmt = \
-        "INSERT INTO Posts (text, author_id, created_at) "
-        "VALUES ('%s', %d, extract(epoch from now())) "
+        "INSERT INTO Posts (id, text, author_id, created_at) "
+        "VALUES (nextval('posts_id_seq') * %d + %d, '%s', %d, "
+            "extract(epoch from now())) "
         "RETURNING id, created_at";
-    sprintf(query_str, query_fmt, text.c_str(), request_metadata.requester_id);
+    sprintf(query_str, query_fmt, count_db_shards("post"), shard, text.c_str(),
+        request_metadata.requester_id);
 
     // Execute query.
-    pqxx::connection conn(post_db_conn_str);
+    pqxx::connection conn(get_db_conn_str("post", shard));
     pqxx::work txn(conn);
     pqxx::result db_res(txn.exec(query_str));
+    update_count(txn, request_metadata.requester_id, 1);
+    queue_change(txn, db_res[0][0].as<int>(), request_metadata.requester_id,
+        true);
     txn.commit();
     conn.disconnect();
+    mark_db_write("post", request_metadata.requester_id);
+    publish_changes();
 
     // Build account (standard mode).
     _return.id = db_res[0][0].as<int>();
@@ -85,11 +617,12 @@ public:
     sprintf(query_str, query_fmt, post_id);
 
     // Execute query.
-    pqxx::connection conn(post_db_conn_str);
-    pqxx::work txn(conn);
+    auto conn = connect_db_replica<pqxx::connection>("post",
+        request_metadata.requester_id, get_shard_of_post(post_id));
+    pqxx::work txn(*conn);
     pqxx::result db_res(txn.exec(query_str));
     txn.commit();
-    conn.disconnect();
+    conn->disconnect();
 
     // Check if post exists.
     if (db_res.begin() == db_res.end())
@@ -105,18 +638,43 @@ public:
 
   void retrieve_expanded_post(TPost& _return,
       const TRequestMetadata& request_metadata, const int32_t post_id) {
+    if (_read_model) {
+      // Build query string.
+      char query_str[1024];
+      const char *query_fmt = \
+          "SELECT %s "
+          "FROM ExpandedPosts "
+          "WHERE id = %d";
+      sprintf(query_str, query_fmt, EXPANDED_POST_COLUMNS.c_str(), post_id);
+
+      // Execute query.
+      auto conn = connect_db_replica<pqxx::connection>("post",
+          request_metadata.requester_id, get_shard_of_post(post_id));
+      pqxx::work txn(*conn);
+      pqxx::result db_res(txn.exec(query_str));
+      txn.commit();
+      conn->disconnect();
+
+      // Build post (expanded mode). Posts that are not in the read model yet
+      // are expanded below.
+      if (db_res.begin() != db_res.end()) {
+        _return = build_expanded_post(db_res[0]);
+        return;
+      }
+    }
+
     // Retrieve standard post.
     retrieve_standard_post(_return, request_metadata, post_id);
 
     // Retrieve author.
     auto account_client = get_account_client();
-    auto author = account_client->retrieve_standard_account(request_metadata,
+    auto author = retrieve_author(*account_client, request_metadata,
         _return.author_id);
     account_client->close();
 
     // Retrieve like activity.
     auto like_client = get_like_client();
-    auto n_likes = like_client->count_likes_of_post(request_metadata, post_id);
+    auto n_likes = count_likes(*like_client, request_metadata, post_id);
     like_client->close();
 
     // Build post (expanded mode).
@@ -124,6 +682,48 @@ public:
     _return.__set_n_likes(n_likes);
   }
 
+  void retrieve_posts(std::vector<TPost>& _return,
+      const TRequestMetadata& request_metadata,
+      const std::vector<int32_t>& post_ids, const bool expanded) {
+    // Validate attributes.
+    if (post_ids.size() > MAX_RETRIEVED_POSTS)
+      throw TPostInvalidAttributesException();
+
+    // Group post ids by shard. Post ids are positive.
+    auto n_shards = count_db_shards("post");
+    std::vector<std::vector<int32_t>> shard_post_ids(n_shards);
+    for (auto post_id : post_ids)
+      if (post_id > 0)
+        shard_post_ids[get_shard_of_post(post_id)].push_back(post_id);
+
+    // Fetch the posts of every shard in parallel, with one query per shard.
+    std::vector<std::future<std::vector<TPost>>> shard_results;
+    for (auto shard = 0; shard < n_shards; shard++)
+      if (!shard_post_ids[shard].empty())
+        shard_results.push_back(std::async(std::launch::async,
+            &TPostServiceHandler::retrieve_posts_of_shard, this,
+            std::cref(request_metadata), std::cref(shard_post_ids[shard]),
+            shard));
+    std::map<int32_t, TPost> posts_by_id;
+    for (auto& shard_result : shard_results)
+      for (auto& post : shard_result.get())
+        posts_by_id[post.id] = post;
+
+    // Order posts as their ids.
+    std::vector<TPost> posts;
+    for (auto post_id : post_ids) {
+      auto it = posts_by_id.find(post_id);
+      if (it != posts_by_id.end())
+        posts.push_back(it->second);
+    }
+
+    // Build posts.
+    if (expanded)
+      expand_posts(_return, request_metadata, posts);
+    else
+      _return = posts;
+  }
+
   void delete_post(const TRequestMetadata& request_metadata,
       const int32_t post_id) {
     {
@@ -141,64 +741,129 @@ public:
     const char *query_fmt = \
         "UPDATE Posts "
         "SET active = FALSE "
-        "WHERE id = %d";
+        "WHERE id = %d AND active = TRUE "
+        "RETURNING author_id";
     sprintf(query_str, query_fmt, post_id);
 
     // Execute query.
-    pqxx::connection conn(post_db_conn_str);
+    pqxx::connection conn(get_db_conn_str("post", get_shard_of_post(post_id)));
     pqxx::work txn(conn);
     pqxx::result db_res(txn.exec(query_str));
+    if (db_res.begin() != db_res.end()) {
+      update_count(txn, db_res[0][0].as<int>(), -1);
+      queue_change(txn, post_id, db_res[0][0].as<int>(), false);
+    }
     txn.commit();
     conn.disconnect();
+    mark_db_write("post", request_metadata.requester_id);
+    publish_changes();
   }
 
   void list_posts(std::vector<TPost>& _return,
       const TRequestMetadata& request_metadata, const TPostQuery& query,
       const int32_t limit, const int32_t offset) {
-    // Build query string.
-    char query_str[1024];
-    const char *query_fmt = \
-        "SELECT id, created_at, active, text, author_id "
-        "FROM Posts "
-        "WHERE %s "
-        "ORDER BY created_at DESC "
-        "LIMIT %d "
-        "OFFSET %d";
-    sprintf(query_str, query_fmt, build_where_clause(query).c_str(), limit,
-        offset);
-
-    // Execute query.
-    pqxx::connection conn(post_db_conn_str);
-    pqxx::work txn(conn);
-    pqxx::result db_res(txn.exec(query_str));
-    txn.commit();
-    conn.disconnect();
+    std::vector<TPost> posts;
+    auto n_shards = count_db_shards("post");
+    if (query.__isset.author_id || n_shards == 1) {
+      // Posts of an author are stored in a single shard.
+      auto shard = query.__isset.author_id ?
+          get_shard_of_author(query.author_id) : 0;
+      posts = list_posts_of_shard(request_metadata, query, limit, offset,
+          shard);
+    }
+    else {
+      // Fetch the first (offset + limit) posts of every shard in parallel.
+      std::vector<std::future<std::vector<TPost>>> shard_results;
+      for (auto shard = 0; shard < n_shards; shard++)
+        shard_results.push_back(std::async(std::launch::async,
+            &TPostServiceHandler::list_posts_of_shard, this,
+            std::cref(request_metadata), std::cref(query), limit + offset, 0,
+            shard));
+      std::vector<std::vector<TPost>> shard_posts;
+      for (auto& shard_result : shard_results)
+        shard_posts.push_back(shard_result.get());
+
+      // Merge posts in creation order, skipping the first 'offset'.
+      using Cursor = std::pair<int, size_t>;
+      auto older = [&shard_posts](const Cursor& a, const Cursor& b) {
+        return shard_posts[a.first][a.second].created_at <
+            shard_posts[b.first][b.second].created_at;
+      };
+      std::priority_queue<Cursor, std::vector<Cursor>, decltype(older)> heap(
+          older);
+      for (auto shard = 0; shard < n_shards; shard++)
+        if (!shard_posts[shard].empty())
+          heap.push(std::make_pair(shard, 0));
+      for (auto i = 0; i < offset + limit && !heap.empty(); i++) {
+        auto cursor = heap.top();
+        heap.pop();
+        if (i >= offset)
+          posts.push_back(shard_posts[cursor.first][cursor.second]);
+        if (cursor.second + 1 < shard_posts[cursor.first].size())
+          heap.push(std::make_pair(cursor.first, cursor.second + 1));
+      }
+    }
 
     // Build posts.
-    auto account_client = get_account_client();
-    auto like_client = get_like_client();
-    for (auto row : db_res) {
-      // Retrieve author.
-      auto author = account_client->retrieve_standard_account(request_metadata,
-          row["author_id"].as<int>());
+    if (_read_model)
+      _return = posts;
+    else
+      expand_posts(_return, request_metadata, posts);
+  }
 
-      // Retrieve like activity.
-      auto n_likes = like_client->count_likes_of_post(request_metadata,
-          row["id"].as<int>());
+  void search_posts(TPostSearchPage& _return,
+      const TRequestMetadata& request_metadata, const std::string& query,
+      const std::string& cursor, const int32_t limit) {
+    // Validate attributes.
+    if (!validate_search_query(query) || limit <= 0 ||
+        limit > MAX_SEARCHED_POSTS)
+      throw TPostInvalidAttributesException();
+    std::string cursor_clause = "TRUE";
+    if (!cursor.empty()) {
+      float cursor_rank;
+      int32_t cursor_id;
+      if (!parse_search_cursor(cursor, cursor_rank, cursor_id))
+        throw TPostInvalidAttributesException();
+      char cursor_clause_str[128];
+      sprintf(cursor_clause_str, "(rank, id) < (%.9g::real, %d)", cursor_rank,
+          cursor_id);
+      cursor_clause = cursor_clause_str;
+    }
 
-      // Build post (expanded mode).
-      TPost post;
-      post.id = row["id"].as<int>();
-      post.created_at = row["created_at"].as<int>();
-      post.active = row["active"].as<bool>();
-      post.text = row["text"].as<std::string>();
-      post.author_id = row["author_id"].as<int>();
-      post.__set_author(author);
-      post.__set_n_likes(n_likes);
-      _return.push_back(post);
+    // Search every shard in parallel, fetching one extra match to know if
+    // there is a next page.
+    auto n_shards = count_db_shards("post");
+    std::vector<std::future<std::vector<SearchMatch>>> shard_results;
+    for (auto shard = 0; shard < n_shards; shard++)
+      shard_results.push_back(std::async(std::launch::async,
+          &TPostServiceHandler::search_posts_of_shard, this,
+          std::cref(request_metadata), std::cref(query),
+          std::cref(cursor_clause), limit + 1, shard));
+    std::vector<SearchMatch> matches;
+    for (auto& shard_result : shard_results) {
+      auto shard_matches = shard_result.get();
+      matches.insert(matches.end(), shard_matches.begin(),
+          shard_matches.end());
     }
-    account_client->close();
-    like_client->close();
+
+    // Merge matches by decreasing rank.
+    std::sort(matches.begin(), matches.end(),
+        [](const SearchMatch& a, const SearchMatch& b) {
+          return std::make_pair(a.rank, a.post.id) >
+              std::make_pair(b.rank, b.post.id);
+        });
+    std::vector<TPost> posts;
+    for (auto i = 0; i < limit && i < static_cast<int>(matches.size()); i++)
+      posts.push_back(matches[i].post);
+    if (static_cast<int>(matches.size()) > limit) {
+      char next_cursor[64];
+      sprintf(next_cursor, "%.9g:%d", matches[limit - 1].rank,
+          matches[limit - 1].post.id);
+      _return.__set_next_cursor(next_cursor);
+    }
+
+    // Build posts.
+    expand_posts(_return.posts, request_metadata, posts);
   }
 
   int32_t count_posts_by_author(const TRequestMetadata& request_metadata,
@@ -206,20 +871,44 @@ public:
     // Build query string.
     char query_str[1024];
     const char *query_fmt = \
-        "SELECT COUNT(*) "
-        "FROM Posts "
+        "SELECT COALESCE(SUM(count), 0) "
+        "FROM PostCounts "
         "WHERE author_id = %d";
     sprintf(query_str, query_fmt, author_id);
 
     // Execute query.
-    pqxx::connection conn(post_db_conn_str);
-    pqxx::work txn(conn);
+    auto conn = connect_db_replica<pqxx::connection>("post",
+        request_metadata.requester_id, get_shard_of_author(author_id));
+    pqxx::work txn(*conn);
     pqxx::result db_res(txn.exec(query_str));
     txn.commit();
-    conn.disconnect();
+    conn->disconnect();
 
     return db_res[0][0].as<int>();
   }
+
+  int64_t get_version_of_posts_by_author(
+      const TRequestMetadata& request_metadata, const int32_t author_id) {
+    // Build query string. Lists read from the read model lag behind writes,
+    // so their version is the one of the read model.
+    char query_str[1024];
+    const char *query_fmt = \
+        "SELECT COALESCE(SUM(version), 0) "
+        "FROM %s "
+        "WHERE author_id = %d";
+    sprintf(query_str, query_fmt,
+        _read_model ? "ExpandedPostVersions" : "PostCounts", author_id);
+
+    // Execute query.
+    auto conn = connect_db_replica<pqxx::connection>("post",
+        request_metadata.requester_id, get_shard_of_author(author_id));
+    pqxx::work txn(*conn);
+    pqxx::result db_res(txn.exec(query_str));
+    txn.commit();
+    conn->disconnect();
+
+    return db_res[0][0].as<int64_t>();
+  }
 };
 
 
@@ -230,6 +919,10 @@ int main(int argc, char** argv) {
       ("host", "", cxxopts::value<std::string>()->default_value("0.0.0.0"))
       ("port", "", cxxopts::value<int>())
       ("threads", "", cxxopts::value<int>())
+      ("server_mode", "", cxxopts::value<std::string>()->default_value(
+          "threaded"))
+      ("io_threads", "", cxxopts::value<int>()->default_value("1"))
+      ("queue_depth", "", cxxopts::value<int>()->default_value("0"))
       ("backend_filepath", "", cxxopts::value<std::string>()->default_value(
           "/etc/opt/BuzzBlogApp/backend.yml"))
       ("postgres_user", "", cxxopts::value<std::string>()->default_value(
@@ -237,34 +930,47 @@ int main(int argc, char** argv) {
       ("postgres_password", "", cxxopts::value<std::string>()->default_value(
           "postgres"))
       ("postgres_dbname", "", cxxopts::value<std::string>()->default_value(
-          "postgres"));
+          "postgres"))
+      ("change_log", "", cxxopts::value<bool>()->default_value("false"))
+      ("change_log_dirpath", "", cxxopts::value<std::string>()->default_value(
+          "/var/opt/BuzzBlogApp/changes"))
+      ("read_model", "", cxxopts::value<bool>()->default_value("false"))
+      ("read_model_projector", "", cxxopts::value<bool>()->default_value(
+          "false"));
 
   // Parse command-line arguments.
   auto result = options.parse(argc, argv);
   std::string host = result["host"].as<std::string>();
   int port = result["port"].as<int>();
   int threads = result["threads"].as<int>();
+  std::string server_mode = result["server_mode"].as<std::string>();
+  int io_threads = result["io_threads"].as<int>();
+  int queue_depth = result["queue_depth"].as<int>();
   std::string backend_filepath = result["backend_filepath"].as<std::string>();
   std::string postgres_user = result["postgres_user"].as<std::string>();
   std::string postgres_password = result["postgres_password"].as<std::string>();
   std::string postgres_dbname = result["postgres_dbname"].as<std::string>();
+  bool change_log = result["change_log"].as<bool>();
+  std::string change_log_dirpath =
+      result["change_log_dirpath"].as<std::string>();
+  bool read_model = result["read_model"].as<bool>();
+  bool read_model_projector = result["read_model_projector"].as<bool>();
 
   // Initialize logger.
   auto logger = spdlog::basic_logger_mt("logger", "/tmp/calls.log");
   logger->set_pattern("[%H:%M:%S.%F] pid=%P tid=%t %v");
 
   // Create server.
-  TThreadedServer server(
+  auto server = BaseServer::create_server(
       std::make_shared<TPostServiceProcessor>(
           std::make_shared<TPostServiceHandler>(backend_filepath,
-              postgres_user, postgres_password, postgres_dbname)),
-      std::make_shared<TServerSocket>(host, port),
-      std::make_shared<TBufferedTransportFactory>(),
-      std::make_shared<TBinaryProtocolFactory>());
-  server.setConcurrentClientLimit(threads);
+              postgres_user, postgres_password, postgres_dbname, change_log,
+              change_log_dirpath, read_model, read_model_projector)),
+      backend_filepath, "post", host, port, server_mode, threads, io_threads,
+      queue_depth);
 
   // Serve requests.
-  server.serve();
+  server->serve();
 
   return 0;
 }
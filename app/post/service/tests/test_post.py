@@ -1,15 +1,53 @@
 # Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
 # Systems
 
+import subprocess
 import time
 import unittest
 
 from buzzblog.gen.ttypes import *
+from buzzblog.account_client import Client as AccountClient
+from buzzblog.like_client import Client as LikeClient
 from buzzblog.post_client import Client as PostClient
 
 
 IP_ADDRESS = "localhost"
 PORT = 9093
+# Post server that serves expanded posts from the read model and projects it.
+READ_MODEL_PORT = 9095
+ACCOUNT_PORT = 9090
+LIKE_PORT = 9092
+DATABASE_PORT = 5434
+# Max time (in seconds) for a change to be projected to the read model.
+PROJECTION_TIMEOUT = 10
+
+
+def wait_until(condition, timeout=PROJECTION_TIMEOUT):
+  """Return whether 'condition' holds within 'timeout' seconds."""
+  deadline = time.time() + timeout
+  while not condition():
+    if time.time() > deadline:
+      return False
+    time.sleep(0.2)
+  return True
+
+
+def select_expanded_post(post_id):
+  """Return the row of post 'post_id' in the read model, as a psql row."""
+  return subprocess.run(["psql", "-U", "postgres", "-h", IP_ADDRESS, "-p",
+      str(DATABASE_PORT), "-v", "ON_ERROR_STOP=1", "--quiet", "--tuples-only",
+      "--no-align", "-c", """
+          SELECT active, author_active, author_first_name, n_likes
+          FROM ExpandedPosts
+          WHERE id = %d""" % post_id], check=True, stdout=subprocess.PIPE,
+      universal_newlines=True).stdout.strip()
+
+
+def verify_read_model():
+  """Return whether 'utils/check_read_model.sh' finds no mismatch."""
+  return subprocess.run(["utils/check_read_model.sh", "--port",
+      str(DATABASE_PORT), "--mode", "verify"], stdout=subprocess.DEVNULL,
+      stderr=subprocess.DEVNULL).returncode == 0
 
 
 class TestService(unittest.TestCase):
@@ -31,6 +69,68 @@ class TestService(unittest.TestCase):
       self.assertEqual(post.text, retrieved_post.text)
       self.assertEqual(post.author_id, retrieved_post.author_id)
 
+  def test_search_posts(self):
+    with PostClient(IP_ADDRESS, PORT) as client:
+      # Create posts sharing a word that no other post contains.
+      word = "searchword%d" % int(time.time())
+      post_ids = set()
+      for i in range(3):
+        post = client.create_post(TRequestMetadata(id="1", requester_id=1),
+            "Post %d with %s" % (i, word))
+        post_ids.add(post.id)
+      # Search them two at a time and check that all of them are found.
+      found_ids = set()
+      cursor = ""
+      for _ in range(len(post_ids)):
+        page = client.search_posts(TRequestMetadata(id="2", requester_id=1),
+            word, cursor, 2)
+        self.assertLessEqual(len(page.posts), 2)
+        found_ids.update(post.id for post in page.posts)
+        if page.next_cursor is None:
+          break
+        cursor = page.next_cursor
+      self.assertEqual(post_ids, found_ids)
+      # An empty query, and pages that are too large, are rejected.
+      with self.assertRaises(TPostInvalidAttributesException):
+        client.search_posts(TRequestMetadata(id="3", requester_id=1), "", "",
+            2)
+      with self.assertRaises(TPostInvalidAttributesException):
+        client.search_posts(TRequestMetadata(id="4", requester_id=1), word,
+            "", 1000)
+
+  def test_retrieve_posts(self):
+    with PostClient(IP_ADDRESS, PORT) as client:
+      # Create posts.
+      posts = [client.create_post(TRequestMetadata(id="1", requester_id=1),
+          "Test message %d" % i) for i in range(3)]
+      # Retrieve them in one call, in the order of the ids, skipping ids that
+      # match no post.
+      post_ids = [posts[2].id, -1, posts[0].id, posts[1].id]
+      retrieved_posts = client.retrieve_posts(
+          TRequestMetadata(id="2", requester_id=1), post_ids, False)
+      self.assertEqual([posts[2].id, posts[0].id, posts[1].id],
+          [post.id for post in retrieved_posts])
+      self.assertEqual([post.text for post in [posts[2], posts[0], posts[1]]],
+          [post.text for post in retrieved_posts])
+      # Too many ids are rejected.
+      with self.assertRaises(TPostInvalidAttributesException):
+        client.retrieve_posts(TRequestMetadata(id="3", requester_id=1),
+            list(range(1, 10000)), False)
+
+  def test_get_version_of_posts_by_author(self):
+    with PostClient(IP_ADDRESS, PORT) as client:
+      # Creating and deleting a post of an author increases its version.
+      version = client.get_version_of_posts_by_author(
+          TRequestMetadata(id="1", requester_id=1), 1)
+      post = client.create_post(TRequestMetadata(id="2", requester_id=1),
+          "Test message")
+      created_version = client.get_version_of_posts_by_author(
+          TRequestMetadata(id="3", requester_id=1), 1)
+      self.assertGreater(created_version, version)
+      client.delete_post(TRequestMetadata(id="4", requester_id=1), post.id)
+      self.assertGreater(client.get_version_of_posts_by_author(
+          TRequestMetadata(id="5", requester_id=1), 1), created_version)
+
   def test_retrieve_expanded_post(self):
     # TODO
     pass
@@ -48,5 +148,66 @@ class TestService(unittest.TestCase):
     pass
 
 
+class TestReadModel(unittest.TestCase):
+  def test_project_post(self):
+    # Create an author and a post.
+    with AccountClient(IP_ADDRESS, ACCOUNT_PORT) as account_client:
+      author = account_client.create_account(TRequestMetadata(id="1"),
+          "read_model_%d" % int(time.time() * 1000), "password", "First",
+          "Last")
+    with PostClient(IP_ADDRESS, READ_MODEL_PORT) as client:
+      post = client.create_post(
+          TRequestMetadata(id="2", requester_id=author.id), "Test message")
+    self.assertTrue(wait_until(
+        lambda: select_expanded_post(post.id) == "t|t|First|0"))
+    with PostClient(IP_ADDRESS, READ_MODEL_PORT) as client:
+      version = client.get_version_of_posts_by_author(
+          TRequestMetadata(id="3", requester_id=author.id), author.id)
+    self.assertGreater(version, 0)
+    # Like it.
+    with LikeClient(IP_ADDRESS, LIKE_PORT) as like_client:
+      like_client.like_post(TRequestMetadata(id="3", requester_id=author.id),
+          post.id)
+    self.assertTrue(wait_until(
+        lambda: select_expanded_post(post.id) == "t|t|First|1"))
+    # The version of the posts of the author follows the read model.
+    with PostClient(IP_ADDRESS, READ_MODEL_PORT) as client:
+      self.assertGreater(client.get_version_of_posts_by_author(
+          TRequestMetadata(id="3", requester_id=author.id), author.id),
+          version)
+    # Update its author.
+    with AccountClient(IP_ADDRESS, ACCOUNT_PORT) as account_client:
+      account_client.update_account(
+          TRequestMetadata(id="4", requester_id=author.id), author.id,
+          "password", "Updated", "Last")
+    self.assertTrue(wait_until(
+        lambda: select_expanded_post(post.id) == "t|t|Updated|1"))
+    # Posts are read from the read model.
+    with PostClient(IP_ADDRESS, READ_MODEL_PORT) as client:
+      expanded_post = client.retrieve_expanded_post(
+          TRequestMetadata(id="5", requester_id=author.id), post.id)
+      self.assertEqual("Updated", expanded_post.author.first_name)
+      self.assertEqual(1, expanded_post.n_likes)
+      posts = client.list_posts(
+          TRequestMetadata(id="6", requester_id=author.id),
+          TPostQuery(author_id=author.id), 10, 0)
+      self.assertEqual([post.id], [listed_post.id for listed_post in posts])
+      self.assertEqual("Updated", posts[0].author.first_name)
+      self.assertEqual(1, posts[0].n_likes)
+      # Delete the post.
+      client.delete_post(TRequestMetadata(id="7", requester_id=author.id),
+          post.id)
+    self.assertTrue(wait_until(
+        lambda: select_expanded_post(post.id) == "f|t|Updated|1"))
+    # Delete its author.
+    with AccountClient(IP_ADDRESS, ACCOUNT_PORT) as account_client:
+      account_client.delete_account(
+          TRequestMetadata(id="8", requester_id=author.id), author.id)
+    self.assertTrue(wait_until(
+        lambda: select_expanded_post(post.id) == "f|f|Updated|1"))
+    # The read model matches its sources.
+    self.assertTrue(wait_until(verify_read_model))
+
+
 if __name__ == "__main__":
   unittest.main()
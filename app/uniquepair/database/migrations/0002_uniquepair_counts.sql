@@ -0,0 +1,24 @@
+-- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+-- Systems
+
+-- Number of unique pairs of each element of a domain ('count' by first or
+-- second element), updated in the transaction that adds or removes a pair.
+-- Counters are filled from the existing pairs, which are locked against writes
+-- meanwhile.
+CREATE TABLE UniquepairCounts(
+  domain VARCHAR(32) NOT NULL,
+  field VARCHAR(16) NOT NULL,
+  elem INTEGER NOT NULL,
+  count INTEGER NOT NULL,
+  PRIMARY KEY(domain, field, elem)
+);
+
+LOCK TABLE Uniquepairs IN SHARE MODE;
+INSERT INTO UniquepairCounts (domain, field, elem, count)
+SELECT domain, 'first_elem', first_elem, COUNT(*)
+FROM Uniquepairs
+GROUP BY domain, first_elem
+UNION ALL
+SELECT domain, 'second_elem', second_elem, COUNT(*)
+FROM Uniquepairs
+GROUP BY domain, second_elem;
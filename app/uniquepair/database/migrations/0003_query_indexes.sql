@@ -0,0 +1,19 @@
+-- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+-- Systems
+
+-- Unique pairs of a domain are fetched from newest to oldest, optionally
+-- filtered by first or second element ('fetch'), and counted with the same
+-- filters ('count'). Pairs are found by both elements through the unique
+-- constraint ('find').
+CREATE INDEX idx_domain_created_at ON Uniquepairs(domain, created_at DESC);
+CREATE INDEX idx_first_elem_created_at
+    ON Uniquepairs(domain, first_elem, created_at DESC);
+CREATE INDEX idx_second_elem_created_at
+    ON Uniquepairs(domain, second_elem, created_at DESC);
+
+-- 'idx_first_and_second_elem' duplicates the unique constraint, and the other
+-- indexes are prefixes of the ones above.
+DROP INDEX IF EXISTS idx_created_at;
+DROP INDEX IF EXISTS idx_first_elem;
+DROP INDEX IF EXISTS idx_second_elem;
+DROP INDEX IF EXISTS idx_first_and_second_elem;
@@ -0,0 +1,6 @@
+-- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+-- Systems
+
+-- Version of the unique pairs of each element, incremented whenever one of
+-- them is added or removed ('get_version').
+ALTER TABLE UniquepairCounts ADD COLUMN version BIGINT NOT NULL DEFAULT 0;
@@ -0,0 +1,9 @@
+-- Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+-- Systems
+
+-- Changes queued by the transactions that made them, until they are relayed to
+-- the change log.
+CREATE TABLE ChangeOutbox(
+  id BIGSERIAL PRIMARY KEY,
+  record TEXT NOT NULL
+);
@@ -2,12 +2,15 @@
 // Systems
 
 #include <chrono>
+#include <map>
 #include <memory>
 #include <string>
 
 #include <spdlog/spdlog.h>
 #include <spdlog/sinks/basic_file_sink.h>
 #include <thrift/protocol/TBinaryProtocol.h>
+#include <thrift/protocol/TCompactProtocol.h>
+#include <thrift/protocol/THeaderProtocol.h>
 #include <thrift/transport/TSocket.h>
 #include <thrift/transport/TTransportUtils.h>
 
@@ -31,13 +34,23 @@ namespace uniquepair_service {
     std::shared_ptr<TProtocol> _protocol;
     std::shared_ptr<TUniquepairServiceClient> _client;
    public:
-    Client(const std::string& ip_address, int port, int conn_timeout_ms) {
+    Client(const std::string& ip_address, int port, int conn_timeout_ms,
+        const std::string& transport = "buffered",
+        const std::string& protocol = "binary") {
       _ip_address = ip_address;
       _port = port;
       _socket = std::make_shared<TSocket>(ip_address, port);
       _socket->setConnTimeout(conn_timeout_ms);
-      _transport = std::make_shared<TBufferedTransport>(_socket);
-      _protocol = std::make_shared<TBinaryProtocol>(_transport);
+      if (transport == "framed")
+        _transport = std::make_shared<TFramedTransport>(_socket);
+      else
+        _transport = std::make_shared<TBufferedTransport>(_socket);
+      if (transport == "header")
+        _protocol = std::make_shared<THeaderProtocol>(_transport);
+      else if (protocol == "compact")
+        _protocol = std::make_shared<TCompactProtocol>(_transport);
+      else
+        _protocol = std::make_shared<TBinaryProtocol>(_transport);
       _client = std::make_shared<TUniquepairServiceClient>(_protocol);
       _transport->open();
     }
@@ -134,5 +147,34 @@ namespace uniquepair_service {
           _ip_address, _port, latency.count());
       return ret;
     }
+
+    std::map<int32_t, int32_t> count_by_second_elems(
+        const TRequestMetadata& request_metadata, const std::string& domain,
+        const std::vector<int32_t>& second_elems) {
+      std::map<int32_t, int32_t> _return;
+      auto logger = spdlog::get("logger");
+      auto start_time = std::chrono::steady_clock::now();
+      _client->count_by_second_elems(_return, request_metadata, domain,
+          second_elems);
+      std::chrono::duration<double> latency = \
+          std::chrono::steady_clock::now() - start_time;
+      logger->info("request_id={} server={}:{} "
+          "function=uniquepair:count_by_second_elems latency={}",
+          request_metadata.id, _ip_address, _port, latency.count());
+      return _return;
+    }
+
+    int64_t get_version(const TRequestMetadata& request_metadata,
+        const TUniquepairQuery& query) {
+      auto logger = spdlog::get("logger");
+      auto start_time = std::chrono::steady_clock::now();
+      auto ret = _client->get_version(request_metadata, query);
+      std::chrono::duration<double> latency = \
+          std::chrono::steady_clock::now() - start_time;
+      logger->info("request_id={} server={}:{} "
+          "function=uniquepair:get_version latency={}", request_metadata.id,
+          _ip_address, _port, latency.count());
+      return ret;
+    }
   };
 }
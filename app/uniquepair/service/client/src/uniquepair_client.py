@@ -4,9 +4,12 @@
 import time
 
 import spdlog as spd
+from thrift.transport import THeaderTransport
 from thrift.transport import TSocket
 from thrift.transport import TTransport
 from thrift.protocol import TBinaryProtocol
+from thrift.protocol import TCompactProtocol
+from thrift.protocol import THeaderProtocol
 
 from buzzblog.gen import TUniquepairService
 
@@ -28,13 +31,25 @@ def instrumented(func):
 
 
 class Client:
-  def __init__(self, ip_address, port, timeout=10000):
+  def __init__(self, ip_address, port, timeout=10000, transport="buffered",
+      protocol="binary"):
     self._ip_address = ip_address
     self._port = port
     self._socket = TSocket.TSocket(ip_address, port)
     self._socket.setTimeout(timeout)
-    self._transport = TTransport.TBufferedTransport(self._socket)
-    self._protocol = TBinaryProtocol.TBinaryProtocol(self._transport)
+    if transport == "framed":
+      self._transport = TTransport.TFramedTransport(self._socket)
+    else:
+      self._transport = TTransport.TBufferedTransport(self._socket)
+    if transport == "header":
+      self._protocol = THeaderProtocol.THeaderProtocol(self._transport,
+          [THeaderTransport.THeaderClientType.HEADERS])
+    elif protocol == "compact":
+      self._protocol = TCompactProtocol.TCompactProtocolAccelerated(
+          self._transport)
+    else:
+      self._protocol = TBinaryProtocol.TBinaryProtocolAccelerated(
+          self._transport)
     self._tclient = TUniquepairService.Client(self._protocol)
     self._transport.open()
 
@@ -79,3 +94,14 @@ class Client:
   @instrumented
   def count(self, request_metadata, query):
     return self._tclient.count(request_metadata=request_metadata, query=query)
+
+  @instrumented
+  def count_by_second_elems(self, request_metadata, domain, second_elems):
+    return self._tclient.count_by_second_elems(
+        request_metadata=request_metadata, domain=domain,
+        second_elems=second_elems)
+
+  @instrumented
+  def get_version(self, request_metadata, query):
+    return self._tclient.get_version(request_metadata=request_metadata,
+        query=query)
@@ -1,19 +1,29 @@
 // Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
 // Systems
 
+#include <algorithm>
+#include <chrono>
+#include <condition_variable>
+#include <deque>
+#include <exception>
+#include <future>
+#include <map>
+#include <memory>
+#include <shared_mutex>
 #include <sstream>
 #include <string>
+#include <thread>
+#include <tuple>
+#include <unordered_map>
+#include <vector>
 
 #include <cxxopts.hpp>
 #include <pqxx/pqxx>
 #include <spdlog/sinks/basic_file_sink.h>
-#include <thrift/protocol/TBinaryProtocol.h>
-#include <thrift/server/TThreadedServer.h>
-#include <thrift/transport/TBufferTransports.h>
-#include <thrift/transport/TServerSocket.h>
 
 #include <buzzblog/gen/TUniquepairService.h>
 #include <buzzblog/base_server.h>
+#include <buzzblog/change_log.h>
 
 
 using namespace apache::thrift;
@@ -24,6 +34,157 @@ using namespace apache::thrift::server;
 using namespace gen;
 
 
+// Memory-resident copy of the unique pairs, kept as sorted adjacency arrays
+// per domain. It answers membership checks and counts without querying the
+// database, which remains the durable store.
+class UniquepairIndex {
+ public:
+  struct Edge {
+    int32_t elem;
+    int32_t id;
+    int32_t created_at;
+  };
+
+  void insert(const std::string& domain, const int32_t first_elem,
+      const int32_t second_elem, const int32_t id, const int32_t created_at) {
+    std::unique_lock<std::shared_timed_mutex> lock(_mutex);
+    auto& domain_index = _domains[domain];
+    auto& edges = domain_index.forward[first_elem];
+    auto edge = lower_bound(edges, second_elem);
+    if (edge == edges.end() || edge->elem != second_elem)
+      edges.insert(edge, {second_elem, id, created_at});
+    auto& elems = domain_index.reverse[second_elem];
+    auto elem = std::lower_bound(elems.begin(), elems.end(), first_elem);
+    if (elem == elems.end() || *elem != first_elem)
+      elems.insert(elem, first_elem);
+  }
+
+  void erase(const std::string& domain, const int32_t first_elem,
+      const int32_t second_elem) {
+    std::unique_lock<std::shared_timed_mutex> lock(_mutex);
+    auto domain_index = _domains.find(domain);
+    if (domain_index == _domains.end())
+      return;
+    // Adjacency arrays left empty are removed, so that elements whose unique
+    // pairs were all erased take no memory.
+    auto& forward = domain_index->second.forward;
+    auto edges = forward.find(first_elem);
+    if (edges != forward.end()) {
+      auto edge = lower_bound(edges->second, second_elem);
+      if (edge != edges->second.end() && edge->elem == second_elem)
+        edges->second.erase(edge);
+      if (edges->second.empty())
+        forward.erase(edges);
+    }
+    auto& reverse = domain_index->second.reverse;
+    auto elems = reverse.find(second_elem);
+    if (elems != reverse.end()) {
+      auto elem = std::lower_bound(elems->second.begin(), elems->second.end(),
+          first_elem);
+      if (elem != elems->second.end() && *elem == first_elem)
+        elems->second.erase(elem);
+      if (elems->second.empty())
+        reverse.erase(elems);
+    }
+    if (forward.empty() && reverse.empty())
+      _domains.erase(domain_index);
+  }
+
+  // Look up unique pair (domain, first_elem, second_elem). Return true and
+  // set 'edge' if it exists.
+  bool find(const std::string& domain, const int32_t first_elem,
+      const int32_t second_elem, Edge& edge) {
+    std::shared_lock<std::shared_timed_mutex> lock(_mutex);
+    auto domain_index = _domains.find(domain);
+    if (domain_index == _domains.end())
+      return false;
+    auto edges = domain_index->second.forward.find(first_elem);
+    if (edges == domain_index->second.forward.end())
+      return false;
+    auto it = lower_bound(edges->second, second_elem);
+    if (it == edges->second.end() || it->elem != second_elem)
+      return false;
+    edge = *it;
+    return true;
+  }
+
+  // Count unique pairs matching 'query'. Return false if the index cannot
+  // answer it (i.e., no element is fixed).
+  bool count(const TUniquepairQuery& query, int32_t& count) {
+    if (query.__isset.first_elem && query.__isset.second_elem) {
+      Edge edge;
+      count = find(query.domain, query.first_elem, query.second_elem, edge);
+      return true;
+    }
+    std::shared_lock<std::shared_timed_mutex> lock(_mutex);
+    count = 0;
+    auto domain_index = _domains.find(query.domain);
+    if (query.__isset.first_elem) {
+      if (domain_index != _domains.end()) {
+        auto edges = domain_index->second.forward.find(query.first_elem);
+        if (edges != domain_index->second.forward.end())
+          count = edges->second.size();
+      }
+      return true;
+    }
+    if (query.__isset.second_elem) {
+      if (domain_index != _domains.end()) {
+        auto elems = domain_index->second.reverse.find(query.second_elem);
+        if (elems != domain_index->second.reverse.end())
+          count = elems->second.size();
+      }
+      return true;
+    }
+    return false;
+  }
+
+  // Load all unique pairs of a database with a COPY stream.
+  void load(const std::string& db_conn_str) {
+    pqxx::connection conn(db_conn_str);
+    pqxx::work txn(conn);
+    pqxx::stream_from stream(txn, "Uniquepairs", std::vector<std::string>{
+        "id", "created_at", "domain", "first_elem", "second_elem"});
+    std::tuple<int32_t, int32_t, std::string, int32_t, int32_t> row;
+    std::unique_lock<std::shared_timed_mutex> lock(_mutex);
+    while (stream >> row) {
+      auto& domain_index = _domains[std::get<2>(row)];
+      domain_index.forward[std::get<3>(row)].push_back(
+          {std::get<4>(row), std::get<0>(row), std::get<1>(row)});
+      domain_index.reverse[std::get<4>(row)].push_back(std::get<3>(row));
+    }
+    stream.complete();
+    txn.commit();
+    conn.disconnect();
+
+    // Sort adjacency arrays.
+    for (auto& domain_index : _domains) {
+      for (auto& edges : domain_index.second.forward)
+        std::sort(edges.second.begin(), edges.second.end(),
+            [](const Edge& a, const Edge& b) { return a.elem < b.elem; });
+      for (auto& elems : domain_index.second.reverse)
+        std::sort(elems.second.begin(), elems.second.end());
+    }
+  }
+
+ private:
+  struct DomainIndex {
+    // Second elements (with unique pair ids) of each first element.
+    std::unordered_map<int32_t, std::vector<Edge>> forward;
+    // First elements of each second element.
+    std::unordered_map<int32_t, std::vector<int32_t>> reverse;
+  };
+
+  static std::vector<Edge>::iterator lower_bound(std::vector<Edge>& edges,
+      const int32_t elem) {
+    return std::lower_bound(edges.begin(), edges.end(), elem,
+        [](const Edge& edge, const int32_t elem) { return edge.elem < elem; });
+  }
+
+  std::shared_timed_mutex _mutex;
+  std::map<std::string, DomainIndex> _domains;
+};
+
+
 class TUniquepairServiceHandler : public BaseServer,
     public TUniquepairServiceIf {
 private:
@@ -37,12 +198,420 @@ private:
     return where_clause.str();
   }
 
+  // Return the shard that stores the unique pairs of (domain, first_elem).
+  int get_shard(const std::string& domain, const int32_t first_elem) {
+    // Compute FNV-1a hash of domain and first element.
+    uint32_t hash = 2166136261u;
+    for (auto c : domain) {
+      hash ^= static_cast<uint8_t>(c);
+      hash *= 16777619u;
+    }
+    for (auto i = 0; i < 4; i++) {
+      hash ^= (static_cast<uint32_t>(first_elem) >> (8 * i)) & 0xff;
+      hash *= 16777619u;
+    }
+    return hash % count_db_shards("uniquepair");
+  }
+
+  // Return the shard that stores unique pair 'uniquepair_id'.
+  // NOTE: Unique pair ids are assigned as (sequence value * number of shards
+  // + shard), so the shard is encoded in the id.
+  int get_shard(const int32_t uniquepair_id) {
+    return uniquepair_id % count_db_shards("uniquepair");
+  }
+
+  std::vector<TUniquepair> fetch_shard(const TRequestMetadata& request_metadata,
+      const TUniquepairQuery& query, const int32_t limit, const int32_t offset,
+      const int shard) {
+    // Build query string.
+    char query_str[1024];
+    const char *query_fmt = \
+        "SELECT id, created_at, first_elem, second_elem "
+        "FROM Uniquepairs "
+        "WHERE %s "
+        "ORDER BY created_at DESC "
+        "LIMIT %d "
+        "OFFSET %d";
+    sprintf(query_str, query_fmt, build_where_clause(query).c_str(), limit,
+        offset);
+
+    // Execute query.
+    auto conn = connect_db_replica<pqxx::connection>("uniquepair",
+        request_metadata.requester_id, shard);
+    pqxx::work txn(*conn);
+    pqxx::result db_res(txn.exec(query_str));
+    txn.commit();
+    conn->disconnect();
+
+    // Build unique pairs.
+    std::vector<TUniquepair> uniquepairs;
+    for (auto row : db_res) {
+      // Build unique pair.
+      TUniquepair uniquepair;
+      uniquepair.id = row["id"].as<int>();
+      uniquepair.created_at = row["created_at"].as<int>();
+      uniquepair.domain = query.domain;
+      uniquepair.first_elem = row["first_elem"].as<int>();
+      uniquepair.second_elem = row["second_elem"].as<int>();
+      uniquepairs.push_back(uniquepair);
+    }
+    return uniquepairs;
+  }
+
+  int32_t count_shard(const TRequestMetadata& request_metadata,
+      const TUniquepairQuery& query, const int shard) {
+    // Build query string.
+    char query_str[1024];
+    if (query.__isset.first_elem != query.__isset.second_elem) {
+      // Read the counter of the element.
+      const char *query_fmt = \
+          "SELECT COALESCE(SUM(count), 0) "
+          "FROM UniquepairCounts "
+          "WHERE domain = '%s' AND field = '%s' AND elem = %d";
+      if (query.__isset.first_elem)
+        sprintf(query_str, query_fmt, query.domain.c_str(), "first_elem",
+            query.first_elem);
+      else
+        sprintf(query_str, query_fmt, query.domain.c_str(), "second_elem",
+            query.second_elem);
+    }
+    else {
+      const char *query_fmt = \
+          "SELECT COUNT(*) "
+          "FROM Uniquepairs "
+          "WHERE %s";
+      sprintf(query_str, query_fmt, build_where_clause(query).c_str());
+    }
+
+    // Execute query.
+    auto conn = connect_db_replica<pqxx::connection>("uniquepair",
+        request_metadata.requester_id, shard);
+    pqxx::work txn(*conn);
+    pqxx::result db_res(txn.exec(query_str));
+    txn.commit();
+    conn->disconnect();
+
+    return db_res[0][0].as<int>();
+  }
+
+  // Count the unique pairs of each of 'second_elems' in 'shard'.
+  std::map<int32_t, int32_t> count_by_second_elems_shard(
+      const TRequestMetadata& request_metadata, const std::string& domain,
+      const std::vector<int32_t>& second_elems, const int shard) {
+    // Build query string.
+    std::ostringstream query_str;
+    query_str << "SELECT elem, count "
+        << "FROM UniquepairCounts "
+        << "WHERE domain = '" << domain << "' AND field = 'second_elem' "
+        << "AND elem IN (";
+    for (size_t i = 0; i < second_elems.size(); i++)
+      query_str << (i > 0 ? ", " : "") << second_elems[i];
+    query_str << ")";
+
+    // Execute query.
+    auto conn = connect_db_replica<pqxx::connection>("uniquepair",
+        request_metadata.requester_id, shard);
+    pqxx::work txn(*conn);
+    pqxx::result db_res(txn.exec(query_str.str()));
+    txn.commit();
+    conn->disconnect();
+
+    std::map<int32_t, int32_t> counts;
+    for (auto row : db_res)
+      counts[row["elem"].as<int>()] = row["count"].as<int>();
+    return counts;
+  }
+
+  // Return the version of the counter of the element set in 'query'.
+  int64_t get_version_shard(const TRequestMetadata& request_metadata,
+      const TUniquepairQuery& query, const int shard) {
+    // Build query string.
+    char query_str[1024];
+    const char *query_fmt = \
+        "SELECT COALESCE(SUM(version), 0) "
+        "FROM UniquepairCounts "
+        "WHERE domain = '%s' AND field = '%s' AND elem = %d";
+    if (query.__isset.first_elem)
+      sprintf(query_str, query_fmt, query.domain.c_str(), "first_elem",
+          query.first_elem);
+    else
+      sprintf(query_str, query_fmt, query.domain.c_str(), "second_elem",
+          query.second_elem);
+
+    // Execute query.
+    auto conn = connect_db_replica<pqxx::connection>("uniquepair",
+        request_metadata.requester_id, shard);
+    pqxx::work txn(*conn);
+    pqxx::result db_res(txn.exec(query_str));
+    txn.commit();
+    conn->disconnect();
+
+    return db_res[0][0].as<int64_t>();
+  }
+
+  // Index of unique pairs (null if disabled).
+  std::unique_ptr<UniquepairIndex> _index;
+  // Log of the changes of unique pairs (null if changes are not logged).
+  std::unique_ptr<ChangeLog> _change_log;
+
+  // Queue the creation or deletion of 'uniquepair' in 'txn' as a change of an
+  // entity of its domain (e.g., "follow" 42), if changes are logged. A unique
+  // pair is created once and deleted at most once, so these are its changes
+  // 1 and 2.
+  void queue_change(pqxx::work& txn, const TUniquepair& uniquepair,
+      bool created) {
+    if (_change_log)
+      _change_log->queue(txn, Change{uniquepair.domain, uniquepair.id,
+          created ? 1 : 2, created ? "created" : "deleted",
+          {{"first_elem", uniquepair.first_elem},
+           {"second_elem", uniquepair.second_elem}}});
+  }
+
+  // Publish the changes queued by a committed transaction, if changes are
+  // logged.
+  void publish_changes() {
+    if (_change_log)
+      _change_log->notify();
+  }
+
+  // Counter deltas keyed by (domain, field, element).
+  using CountDeltas = std::map<std::tuple<std::string, std::string, int32_t>,
+      int>;
+
+  static void add_count_deltas(CountDeltas& deltas, const std::string& domain,
+      const int32_t first_elem, const int32_t second_elem, const int delta) {
+    deltas[std::make_tuple(domain, "first_elem", first_elem)] += delta;
+    deltas[std::make_tuple(domain, "second_elem", second_elem)] += delta;
+  }
+
+  // Apply 'deltas' to the counters of unique pair elements and increment their
+  // versions, in the transaction that adds or removes the unique pairs.
+  // NOTE: Counters of second elements are partial when unique pairs are
+  // sharded, as each shard only counts its own unique pairs.
+  void update_counts(pqxx::work& txn, const CountDeltas& deltas) {
+    if (deltas.empty())
+      return;
+
+    // Build query string. Counters are listed in key order, so that
+    // concurrent transactions lock them in the same order.
+    std::ostringstream query_str;
+    query_str << "INSERT INTO UniquepairCounts (domain, field, elem, count, "
+        "version) VALUES ";
+    for (auto it = deltas.begin(); it != deltas.end(); it++) {
+      if (it != deltas.begin())
+        query_str << ", ";
+      query_str << "('" << std::get<0>(it->first) << "', '" <<
+          std::get<1>(it->first) << "', " << std::get<2>(it->first) << ", " <<
+          it->second << ", 1)";
+    }
+    query_str << " ON CONFLICT (domain, field, elem) "
+        "DO UPDATE SET count = UniquepairCounts.count + EXCLUDED.count, "
+        "version = UniquepairCounts.version + 1";
+
+    // Execute query.
+    txn.exec(query_str.str());
+  }
+
+  // An add or remove waiting to be written in a group commit.
+  struct PendingWrite {
+    bool is_add;
+    int32_t requester_id;
+    // Unique pair to add, or the id of the unique pair to remove.
+    TUniquepair uniquepair;
+    std::promise<TUniquepair> result;
+  };
+
+  // Writes waiting for the group commit of a shard.
+  struct WriteQueue {
+    std::mutex mutex;
+    std::condition_variable cv;
+    std::deque<std::shared_ptr<PendingWrite>> writes;
+  };
+
+  // Group commit configuration (disabled if batch size is 1 or less).
+  size_t _batch_size;
+  std::chrono::microseconds _batch_delay;
+  std::vector<std::unique_ptr<WriteQueue>> _write_queues;
+
+  // Queue 'write' for the group commit of 'shard' and wait for its result.
+  TUniquepair submit_write(const int shard,
+      std::shared_ptr<PendingWrite> write) {
+    auto result = write->result.get_future();
+    auto& queue = *_write_queues[shard];
+    {
+      std::lock_guard<std::mutex> lock(queue.mutex);
+      queue.writes.push_back(write);
+    }
+    queue.cv.notify_one();
+    return result.get();
+  }
+
+  void run_write_queue(const int shard) {
+    auto& queue = *_write_queues[shard];
+    while (true) {
+      std::vector<std::shared_ptr<PendingWrite>> batch;
+      {
+        // Wait for a write, then give concurrent writes up to the batch delay
+        // to join it.
+        std::unique_lock<std::mutex> lock(queue.mutex);
+        queue.cv.wait(lock, [&queue] { return !queue.writes.empty(); });
+        queue.cv.wait_for(lock, _batch_delay, [this, &queue] {
+          return queue.writes.size() >= _batch_size;
+        });
+        while (!queue.writes.empty() && batch.size() < _batch_size) {
+          batch.push_back(queue.writes.front());
+          queue.writes.pop_front();
+        }
+      }
+      write_batch(shard, batch);
+    }
+  }
+
+  // Write a batch of adds and removes in a single transaction. Removes are
+  // applied first, so that a pair removed and added again in the same batch
+  // is re-created.
+  void write_batch(const int shard,
+      std::vector<std::shared_ptr<PendingWrite>>& batch) {
+    std::map<int32_t, TUniquepair> removed;
+    std::map<std::tuple<std::string, int32_t, int32_t>, TUniquepair> added;
+    try {
+      pqxx::connection conn(get_db_conn_str("uniquepair", shard));
+      pqxx::work txn(conn);
+      CountDeltas deltas;
+
+      // Remove unique pairs.
+      std::ostringstream ids;
+      for (auto& write : batch) {
+        if (!write->is_add)
+          ids << (ids.tellp() > 0 ? ", " : "") << write->uniquepair.id;
+      }
+      if (ids.tellp() > 0) {
+        auto query_str = "DELETE FROM Uniquepairs "
+            "WHERE id IN (" + ids.str() + ") "
+            "RETURNING id, domain, first_elem, second_elem";
+        for (auto row : txn.exec(query_str)) {
+          auto& uniquepair = removed[row["id"].as<int>()];
+          uniquepair.id = row["id"].as<int>();
+          uniquepair.domain = row["domain"].as<std::string>();
+          uniquepair.first_elem = row["first_elem"].as<int>();
+          uniquepair.second_elem = row["second_elem"].as<int>();
+          add_count_deltas(deltas, uniquepair.domain, uniquepair.first_elem,
+              uniquepair.second_elem, -1);
+        }
+      }
+
+      // Add unique pairs. Pairs that already exist are skipped.
+      std::ostringstream values;
+      auto n_shards = count_db_shards("uniquepair");
+      for (auto& write : batch) {
+        if (write->is_add)
+          values << (values.tellp() > 0 ? ", " : "") <<
+              "(nextval('uniquepairs_id_seq') * " << n_shards << " + " <<
+              shard << ", '" << write->uniquepair.domain << "', " <<
+              write->uniquepair.first_elem << ", " <<
+              write->uniquepair.second_elem << ", extract(epoch from now()))";
+      }
+      if (values.tellp() > 0) {
+        auto query_str = "INSERT INTO Uniquepairs (id, domain, first_elem, "
+            "second_elem, created_at) "
+            "VALUES " + values.str() + " "
+            "ON CONFLICT DO NOTHING "
+            "RETURNING id, created_at, domain, first_elem, second_elem";
+        for (auto row : txn.exec(query_str)) {
+          TUniquepair uniquepair;
+          uniquepair.id = row["id"].as<int>();
+          uniquepair.created_at = row["created_at"].as<int>();
+          uniquepair.domain = row["domain"].as<std::string>();
+          uniquepair.first_elem = row["first_elem"].as<int>();
+          uniquepair.second_elem = row["second_elem"].as<int>();
+          added[std::make_tuple(uniquepair.domain, uniquepair.first_elem,
+              uniquepair.second_elem)] = uniquepair;
+          add_count_deltas(deltas, uniquepair.domain, uniquepair.first_elem,
+              uniquepair.second_elem, 1);
+        }
+      }
+
+      update_counts(txn, deltas);
+      for (auto& it : removed)
+        queue_change(txn, it.second, false);
+      for (auto& it : added)
+        queue_change(txn, it.second, true);
+      txn.commit();
+      conn.disconnect();
+    }
+    catch (...) {
+      // Fail the whole batch.
+      for (auto& write : batch)
+        write->result.set_exception(std::current_exception());
+      return;
+    }
+
+    // Update index.
+    if (_index) {
+      for (auto& it : removed)
+        _index->erase(it.second.domain, it.second.first_elem,
+            it.second.second_elem);
+      for (auto& it : added)
+        _index->insert(it.second.domain, it.second.first_elem,
+            it.second.second_elem, it.second.id, it.second.created_at);
+    }
+
+    publish_changes();
+
+    // Return each caller its unique pair or error. If a batch has the same
+    // write more than once, only its first occurrence succeeds.
+    for (auto& write : batch) {
+      mark_db_write("uniquepair", write->requester_id);
+      if (write->is_add) {
+        auto it = added.find(std::make_tuple(write->uniquepair.domain,
+            write->uniquepair.first_elem, write->uniquepair.second_elem));
+        if (it == added.end()) {
+          write->result.set_exception(std::make_exception_ptr(
+              TUniquepairAlreadyExistsException()));
+          continue;
+        }
+        write->result.set_value(it->second);
+        added.erase(it);
+      }
+      else {
+        auto it = removed.find(write->uniquepair.id);
+        if (it == removed.end()) {
+          write->result.set_exception(std::make_exception_ptr(
+              TUniquepairNotFoundException()));
+          continue;
+        }
+        write->result.set_value(it->second);
+        removed.erase(it);
+      }
+    }
+  }
+
 public:
   TUniquepairServiceHandler(const std::string& backend_filepath,
       const std::string& postgres_user, const std::string& postgres_password,
-      const std::string& postgres_dbname)
+      const std::string& postgres_dbname, bool use_index, int batch_size,
+      int batch_delay_us, bool change_log,
+      const std::string& change_log_dirpath)
   : BaseServer(backend_filepath, postgres_user, postgres_password,
-      postgres_dbname) {
+      postgres_dbname),
+    _batch_size(batch_size), _batch_delay(batch_delay_us) {
+    if (change_log)
+      _change_log = std::make_unique<ChangeLog>(change_log_dirpath,
+          "uniquepair", [this] { return list_db_conn_strs("uniquepair"); });
+    if (use_index) {
+      // Load the unique pairs of every shard.
+      _index = std::make_unique<UniquepairIndex>();
+      for (auto shard = 0; shard < count_db_shards("uniquepair"); shard++)
+        _index->load(get_db_conn_str("uniquepair", shard));
+    }
+    if (batch_size > 1) {
+      // Start a group commit thread for every shard.
+      for (auto shard = 0; shard < count_db_shards("uniquepair"); shard++) {
+        _write_queues.push_back(std::make_unique<WriteQueue>());
+        std::thread(&TUniquepairServiceHandler::run_write_queue, this,
+            shard).detach();
+      }
+    }
   }
 
   void get(TUniquepair& _return, const TRequestMetadata& request_metadata,
@@ -56,11 +625,12 @@ public:
     sprintf(query_str, query_fmt, uniquepair_id);
 
     // Execute query.
-    pqxx::connection conn(uniquepair_db_conn_str);
-    pqxx::work txn(conn);
+    auto conn = connect_db_replica<pqxx::connection>("uniquepair",
+        request_metadata.requester_id, get_shard(uniquepair_id));
+    pqxx::work txn(*conn);
     pqxx::result db_res(txn.exec(query_str));
     txn.commit();
-    conn.disconnect();
+    conn->disconnect();
 
     // Check if unique pair exists.
     if (db_res.begin() == db_res.end())
@@ -77,16 +647,33 @@ public:
   void add(TUniquepair& _return, const TRequestMetadata& request_metadata,
       const std::string& domain, const int32_t first_elem,
       const int32_t second_elem) {
+    auto shard = get_shard(domain, first_elem);
+
+    // Write in a group commit.
+    if (!_write_queues.empty()) {
+      auto write = std::make_shared<PendingWrite>();
+      write->is_add = true;
+      write->requester_id = request_metadata.requester_id;
+      write->uniquepair.domain = domain;
+      write->uniquepair.first_elem = first_elem;
+      write->uniquepair.second_elem = second_elem;
+      _return = submit_write(shard, write);
+      return;
+    }
+
     // Build query string.
     char query_str[1024];
     const char *query_fmt = \
-        "INSERT INTO Uniquepairs (domain, first_elem, second_elem, created_at) "
-        "VALUES ('%s', %d, %d, extract(epoch from now())) "
+        "INSERT INTO Uniquepairs (id, domain, first_elem, second_elem, "
+            "created_at) "
+        "VALUES (nextval('uniquepairs_id_seq') * %d + %d, '%s', %d, %d, "
+            "extract(epoch from now())) "
         "RETURNING id, created_at";
-    sprintf(query_str, query_fmt, domain.c_str(), first_elem, second_elem);
+    sprintf(query_str, query_fmt, count_db_shards("uniquepair"), shard,
+        domain.c_str(), first_elem, second_elem);
 
     // Execute query.
-    pqxx::connection conn(uniquepair_db_conn_str);
+    pqxx::connection conn(get_db_conn_str("uniquepair", shard));
     pqxx::work txn(conn);
     pqxx::result db_res;
     try {
@@ -95,8 +682,9 @@ public:
     catch (pqxx::sql_error& e) {
       throw TUniquepairAlreadyExistsException();
     }
-    txn.commit();
-    conn.disconnect();
+    CountDeltas deltas;
+    add_count_deltas(deltas, domain, first_elem, second_elem, 1);
+    update_counts(txn, deltas);
 
     // Build unique pair.
     _return.id = db_res[0][0].as<int>();
@@ -104,33 +692,85 @@ public:
     _return.domain = domain;
     _return.first_elem = first_elem;
     _return.second_elem = second_elem;
+    queue_change(txn, _return, true);
+    txn.commit();
+    conn.disconnect();
+    mark_db_write("uniquepair", request_metadata.requester_id);
+    if (_index)
+      _index->insert(domain, first_elem, second_elem, _return.id,
+          _return.created_at);
+    publish_changes();
   }
 
   void remove(const TRequestMetadata& request_metadata,
       const int32_t uniquepair_id) {
+    // Write in a group commit.
+    if (!_write_queues.empty()) {
+      auto write = std::make_shared<PendingWrite>();
+      write->is_add = false;
+      write->requester_id = request_metadata.requester_id;
+      write->uniquepair.id = uniquepair_id;
+      submit_write(get_shard(uniquepair_id), write);
+      return;
+    }
+
     // Build query string.
     char query_str[1024];
     const char *query_fmt = \
         "DELETE FROM Uniquepairs "
         "WHERE id = %d "
-        "RETURNING id";
+        "RETURNING domain, first_elem, second_elem";
     sprintf(query_str, query_fmt, uniquepair_id);
 
     // Execute query.
-    pqxx::connection conn(uniquepair_db_conn_str);
+    pqxx::connection conn(get_db_conn_str("uniquepair",
+        get_shard(uniquepair_id)));
     pqxx::work txn(conn);
     pqxx::result db_res(txn.exec(query_str));
+    TUniquepair uniquepair;
+    if (db_res.begin() != db_res.end()) {
+      CountDeltas deltas;
+      add_count_deltas(deltas, db_res[0][0].as<std::string>(),
+          db_res[0][1].as<int>(), db_res[0][2].as<int>(), -1);
+      update_counts(txn, deltas);
+
+      // Build unique pair.
+      uniquepair.id = uniquepair_id;
+      uniquepair.domain = db_res[0][0].as<std::string>();
+      uniquepair.first_elem = db_res[0][1].as<int>();
+      uniquepair.second_elem = db_res[0][2].as<int>();
+      queue_change(txn, uniquepair, false);
+    }
     txn.commit();
     conn.disconnect();
+    mark_db_write("uniquepair", request_metadata.requester_id);
 
     // Check if unique pair exists.
     if (db_res.begin() == db_res.end())
       throw TUniquepairNotFoundException();
+
+    if (_index)
+      _index->erase(uniquepair.domain, uniquepair.first_elem,
+          uniquepair.second_elem);
+    publish_changes();
   }
 
   void find(TUniquepair& _return, const TRequestMetadata& request_metadata,
       const std::string& domain, const int32_t first_elem,
       const int32_t second_elem) {
+    // Check index.
+    if (_index) {
+      UniquepairIndex::Edge edge;
+      if (!_index->find(domain, first_elem, second_elem, edge))
+        throw TUniquepairNotFoundException();
+      _return.id = edge.id;
+      _return.created_at = edge.created_at;
+      _return.domain = domain;
+      _return.first_elem = first_elem;
+      _return.second_elem = second_elem;
+      return;
+    }
+
     // Build query string.
     char query_str[1024];
     const char *query_fmt = \
@@ -140,11 +780,12 @@ public:
     sprintf(query_str, query_fmt, domain.c_str(), first_elem, second_elem);
 
     // Execute query.
-    pqxx::connection conn(uniquepair_db_conn_str);
-    pqxx::work txn(conn);
+    auto conn = connect_db_replica<pqxx::connection>("uniquepair",
+        request_metadata.requester_id, get_shard(domain, first_elem));
+    pqxx::work txn(*conn);
     pqxx::result db_res(txn.exec(query_str));
     txn.commit();
-    conn.disconnect();
+    conn->disconnect();
 
     // Check if unique pair exists.
     if (db_res.begin() == db_res.end())
@@ -161,56 +802,127 @@ public:
   void fetch(std::vector<TUniquepair>& _return,
       const TRequestMetadata& request_metadata, const TUniquepairQuery& query,
       const int32_t limit, const int32_t offset) {
-    // Build query string.
-    char query_str[1024];
-    const char *query_fmt = \
-        "SELECT id, created_at, first_elem, second_elem "
-        "FROM Uniquepairs "
-        "WHERE %s "
-        "ORDER BY created_at DESC "
-        "LIMIT %d "
-        "OFFSET %d";
-    sprintf(query_str, query_fmt, build_where_clause(query).c_str(), limit,
-        offset);
-
-    // Execute query.
-    pqxx::connection conn(uniquepair_db_conn_str);
-    pqxx::work txn(conn);
-    pqxx::result db_res(txn.exec(query_str));
-    txn.commit();
-    conn.disconnect();
+    // Queries by first element are served by a single shard.
+    auto n_shards = count_db_shards("uniquepair");
+    if (query.__isset.first_elem || n_shards == 1) {
+      auto shard = query.__isset.first_elem ?
+          get_shard(query.domain, query.first_elem) : 0;
+      _return = fetch_shard(request_metadata, query, limit, offset, shard);
+      return;
+    }
 
-    // Build unique pairs.
-    for (auto row : db_res) {
-      // Build unique pair.
-      TUniquepair uniquepair;
-      uniquepair.id = row["id"].as<int>();
-      uniquepair.created_at = row["created_at"].as<int>();
-      uniquepair.domain = query.domain;
-      uniquepair.first_elem = row["first_elem"].as<int>();
-      uniquepair.second_elem = row["second_elem"].as<int>();
-      _return.push_back(uniquepair);
+    // Fetch the first (offset + limit) unique pairs of every shard in
+    // parallel.
+    std::vector<std::future<std::vector<TUniquepair>>> shard_results;
+    for (auto shard = 0; shard < n_shards; shard++)
+      shard_results.push_back(std::async(std::launch::async,
+          &TUniquepairServiceHandler::fetch_shard, this,
+          std::cref(request_metadata), std::cref(query), limit + offset, 0,
+          shard));
+
+    // Merge unique pairs in creation order.
+    std::vector<TUniquepair> uniquepairs;
+    for (auto& shard_result : shard_results) {
+      auto shard_uniquepairs = shard_result.get();
+      auto middle = uniquepairs.size();
+      uniquepairs.insert(uniquepairs.end(), shard_uniquepairs.begin(),
+          shard_uniquepairs.end());
+      std::inplace_merge(uniquepairs.begin(), uniquepairs.begin() + middle,
+          uniquepairs.end(), [](const TUniquepair& a, const TUniquepair& b) {
+            return a.created_at > b.created_at;
+          });
     }
+
+    // Apply limit and offset.
+    for (auto i = offset; i < offset + limit &&
+        i < static_cast<int32_t>(uniquepairs.size()); i++)
+      _return.push_back(uniquepairs[i]);
   }
 
   int32_t count(const TRequestMetadata& request_metadata,
       const TUniquepairQuery& query) {
-    // Build query string.
-    char query_str[1024];
-    const char *query_fmt = \
-        "SELECT COUNT(*) "
-        "FROM Uniquepairs "
-        "WHERE %s";
-    sprintf(query_str, query_fmt, build_where_clause(query).c_str());
+    // Check index.
+    int32_t n_uniquepairs;
+    if (_index && _index->count(query, n_uniquepairs))
+      return n_uniquepairs;
+
+    // Queries by first element are served by a single shard.
+    auto n_shards = count_db_shards("uniquepair");
+    if (query.__isset.first_elem || n_shards == 1) {
+      auto shard = query.__isset.first_elem ?
+          get_shard(query.domain, query.first_elem) : 0;
+      return count_shard(request_metadata, query, shard);
+    }
 
-    // Execute query.
-    pqxx::connection conn(uniquepair_db_conn_str);
-    pqxx::work txn(conn);
-    pqxx::result db_res(txn.exec(query_str));
-    txn.commit();
-    conn.disconnect();
+    // Count unique pairs of every shard in parallel.
+    std::vector<std::future<int32_t>> shard_results;
+    for (auto shard = 0; shard < n_shards; shard++)
+      shard_results.push_back(std::async(std::launch::async,
+          &TUniquepairServiceHandler::count_shard, this,
+          std::cref(request_metadata), std::cref(query), shard));
+    int32_t total = 0;
+    for (auto& shard_result : shard_results)
+      total += shard_result.get();
+    return total;
+  }
 
-    return db_res[0][0].as<int>();
+  void count_by_second_elems(std::map<int32_t, int32_t>& _return,
+      const TRequestMetadata& request_metadata, const std::string& domain,
+      const std::vector<int32_t>& second_elems) {
+    if (second_elems.empty())
+      return;
+    for (auto second_elem : second_elems)
+      _return[second_elem] = 0;
+
+    // Check index.
+    if (_index) {
+      TUniquepairQuery query;
+      query.__set_domain(domain);
+      for (auto& it : _return) {
+        query.__set_second_elem(it.first);
+        _index->count(query, it.second);
+      }
+      return;
+    }
+
+    // Counters of second elements are partial in every shard, so the counts
+    // of every shard are read in parallel and added up.
+    auto n_shards = count_db_shards("uniquepair");
+    std::vector<std::future<std::map<int32_t, int32_t>>> shard_results;
+    for (auto shard = 0; shard < n_shards; shard++)
+      shard_results.push_back(std::async(std::launch::async,
+          &TUniquepairServiceHandler::count_by_second_elems_shard, this,
+          std::cref(request_metadata), std::cref(domain),
+          std::cref(second_elems), shard));
+    for (auto& shard_result : shard_results)
+      for (auto& it : shard_result.get())
+        _return[it.first] += it.second;
+  }
+
+  int64_t get_version(const TRequestMetadata& request_metadata,
+      const TUniquepairQuery& query) {
+    if (query.__isset.first_elem == query.__isset.second_elem)
+      return 0;
+
+    // Counters of first elements are stored in a single shard.
+    auto n_shards = count_db_shards("uniquepair");
+    if (query.__isset.first_elem || n_shards == 1) {
+      auto shard = query.__isset.first_elem ?
+          get_shard(query.domain, query.first_elem) : 0;
+      return get_version_shard(request_metadata, query, shard);
+    }
+
+    // Counters of second elements are partial in every shard, and so are
+    // their versions, which are added up.
+    std::vector<std::future<int64_t>> shard_results;
+    for (auto shard = 0; shard < n_shards; shard++)
+      shard_results.push_back(std::async(std::launch::async,
+          &TUniquepairServiceHandler::get_version_shard, this,
+          std::cref(request_metadata), std::cref(query), shard));
+    int64_t version = 0;
+    for (auto& shard_result : shard_results)
+      version += shard_result.get();
+    return version;
   }
 };
 
@@ -222,6 +934,10 @@ int main(int argc, char** argv) {
       ("host", "", cxxopts::value<std::string>()->default_value("0.0.0.0"))
       ("port", "", cxxopts::value<int>())
       ("threads", "", cxxopts::value<int>())
+      ("server_mode", "", cxxopts::value<std::string>()->default_value(
+          "threaded"))
+      ("io_threads", "", cxxopts::value<int>()->default_value("1"))
+      ("queue_depth", "", cxxopts::value<int>()->default_value("0"))
       ("backend_filepath", "", cxxopts::value<std::string>()->default_value(
           "/etc/opt/BuzzBlogApp/backend.yml"))
       ("postgres_user", "", cxxopts::value<std::string>()->default_value(
@@ -229,34 +945,48 @@ int main(int argc, char** argv) {
       ("postgres_password", "", cxxopts::value<std::string>()->default_value(
           "postgres"))
       ("postgres_dbname", "", cxxopts::value<std::string>()->default_value(
-          "postgres"));
+          "postgres"))
+      ("use_index", "", cxxopts::value<bool>()->default_value("false"))
+      ("batch_size", "", cxxopts::value<int>()->default_value("1"))
+      ("batch_delay_us", "", cxxopts::value<int>()->default_value("200"))
+      ("change_log", "", cxxopts::value<bool>()->default_value("false"))
+      ("change_log_dirpath", "", cxxopts::value<std::string>()->default_value(
+          "/var/opt/BuzzBlogApp/changes"));
 
   // Parse command-line arguments.
   auto result = options.parse(argc, argv);
   std::string host = result["host"].as<std::string>();
   int port = result["port"].as<int>();
   int threads = result["threads"].as<int>();
+  std::string server_mode = result["server_mode"].as<std::string>();
+  int io_threads = result["io_threads"].as<int>();
+  int queue_depth = result["queue_depth"].as<int>();
   std::string backend_filepath = result["backend_filepath"].as<std::string>();
   std::string postgres_user = result["postgres_user"].as<std::string>();
   std::string postgres_password = result["postgres_password"].as<std::string>();
   std::string postgres_dbname = result["postgres_dbname"].as<std::string>();
+  bool use_index = result["use_index"].as<bool>();
+  int batch_size = result["batch_size"].as<int>();
+  int batch_delay_us = result["batch_delay_us"].as<int>();
+  bool change_log = result["change_log"].as<bool>();
+  std::string change_log_dirpath =
+      result["change_log_dirpath"].as<std::string>();
 
   // Initialize logger.
   auto logger = spdlog::basic_logger_mt("logger", "/tmp/calls.log");
   logger->set_pattern("[%H:%M:%S.%F] pid=%P tid=%t %v");
 
   // Create server.
-  TThreadedServer server(
+  auto server = BaseServer::create_server(
       std::make_shared<TUniquepairServiceProcessor>(
           std::make_shared<TUniquepairServiceHandler>(backend_filepath,
-              postgres_user, postgres_password, postgres_dbname)),
-      std::make_shared<TServerSocket>(host, port),
-      std::make_shared<TBufferedTransportFactory>(),
-      std::make_shared<TBinaryProtocolFactory>());
-  server.setConcurrentClientLimit(threads);
+              postgres_user, postgres_password, postgres_dbname, use_index,
+              batch_size, batch_delay_us, change_log, change_log_dirpath)),
+      backend_filepath, "uniquepair", host, port, server_mode, threads,
+      io_threads, queue_depth);
 
   // Serve requests.
-  server.serve();
+  server->serve();
 
   return 0;
 }
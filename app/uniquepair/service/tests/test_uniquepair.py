@@ -111,6 +111,17 @@ class TestService(unittest.TestCase):
       self.assertEqual(1, client.count(TRequestMetadata(id="5"),
           TUniquepairQuery(domain="test_count", second_elem=0)))
 
+  def test_count_by_second_elems(self):
+    with UniquepairClient(IP_ADDRESS, PORT) as client:
+      # Add 2 uniquepairs whose second element is 1, and 1 whose second
+      # element is 2.
+      client.add(TRequestMetadata(id="1"), "test_count_by_second_elems", 1, 1)
+      client.add(TRequestMetadata(id="2"), "test_count_by_second_elems", 2, 1)
+      client.add(TRequestMetadata(id="3"), "test_count_by_second_elems", 1, 2)
+      # Elements without unique pairs are counted as 0.
+      self.assertEqual({1: 2, 2: 1, 3: 0}, client.count_by_second_elems(
+          TRequestMetadata(id="4"), "test_count_by_second_elems", [1, 2, 3]))
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,147 @@
+#!/bin/bash
+
+# Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+# Systems
+
+# This script checks the read model of expanded posts of a post database
+# ('ExpandedPosts') against the sources of truth: the posts of that database,
+# the accounts of the account database, and the likes of the uniquepair
+# databases (all shards, as a comma-separated list). It lists posts whose
+# expanded form differs from the sources and exits with status 1 if there is
+# any. In 'rebuild' mode, it rebuilds the read model from the sources instead,
+# which also fills it with posts created before it existed.
+# Example: utils/check_read_model.sh --port 5434 --account_database localhost:5433 --uniquepair_databases localhost:5435
+
+# Change to the parent directory.
+cd "$(dirname "$(dirname "$(readlink -fm "$0")")")"
+
+# Process command-line arguments.
+set -u
+HOST=localhost
+ACCOUNT_DATABASE=localhost:5433
+UNIQUEPAIR_DATABASES=localhost:5435
+MODE=verify
+while [[ $# > 1 ]]; do
+  case $1 in
+    --host )
+      HOST=$2
+      ;;
+    --port )
+      PORT=$2
+      ;;
+    --account_database )
+      ACCOUNT_DATABASE=$2
+      ;;
+    --uniquepair_databases )
+      UNIQUEPAIR_DATABASES=$2
+      ;;
+    --mode )
+      MODE=$2
+      ;;
+    * )
+      echo "Invalid argument: $1"
+      exit 1
+  esac
+  shift
+  shift
+done
+
+# Copy the accounts and the like counts of posts into temporary tables of the
+# post database, each with a command run by psql on this machine.
+copy_from() {
+  echo "\\copy $1 FROM PROGRAM 'psql -U postgres -h ${2%:*} -p ${2#*:}" \
+      "-v ON_ERROR_STOP=1 -c \"COPY ($3) TO STDOUT\"'"
+}
+COPY_SOURCES="
+CREATE TEMPORARY TABLE SourceAccounts(
+  id INTEGER PRIMARY KEY,
+  created_at INTEGER NOT NULL,
+  active BOOLEAN NOT NULL,
+  username VARCHAR(64) NOT NULL,
+  first_name VARCHAR(64) NOT NULL,
+  last_name VARCHAR(64) NOT NULL
+) ON COMMIT DROP;
+$(copy_from SourceAccounts $ACCOUNT_DATABASE "
+    SELECT id, created_at, COALESCE(active, TRUE), username, first_name,
+        last_name
+    FROM Accounts" | tr '\n' ' ')
+CREATE TEMPORARY TABLE SourceLikes(
+  post_id INTEGER NOT NULL,
+  n_likes INTEGER NOT NULL
+) ON COMMIT DROP;"
+for UNIQUEPAIR_DATABASE in ${UNIQUEPAIR_DATABASES//,/ }
+do
+  COPY_SOURCES="$COPY_SOURCES
+$(copy_from SourceLikes $UNIQUEPAIR_DATABASE "
+    SELECT second_elem, COUNT(*)
+    FROM Uniquepairs
+    WHERE domain = ''like''
+    GROUP BY second_elem" | tr '\n' ' ')"
+done
+
+# Define the expected read model. Posts without author cannot be expanded.
+COLUMNS="id, created_at, active, text, author_id, author_created_at,
+    author_active, author_username, author_first_name, author_last_name,
+    n_likes"
+EXPECTED="
+    SELECT Posts.id, Posts.created_at, COALESCE(Posts.active, TRUE) AS active,
+        Posts.text, Posts.author_id,
+        SourceAccounts.created_at AS author_created_at,
+        SourceAccounts.active AS author_active,
+        SourceAccounts.username AS author_username,
+        SourceAccounts.first_name AS author_first_name,
+        SourceAccounts.last_name AS author_last_name,
+        COALESCE(Likes.n_likes, 0)::integer AS n_likes
+    FROM Posts
+    JOIN SourceAccounts ON SourceAccounts.id = Posts.author_id
+    LEFT JOIN (
+      SELECT post_id, SUM(n_likes) AS n_likes
+      FROM SourceLikes
+      GROUP BY post_id
+    ) AS Likes ON Likes.post_id = Posts.id"
+
+PSQL="psql -U postgres -h $HOST -p $PORT -v ON_ERROR_STOP=1"
+case $MODE in
+  rebuild )
+    # Block the read model projector while the read model is rebuilt. Changes
+    # that it applies afterwards read the sources again, so none is lost. The
+    # versions of all authors are incremented, so that lists cached before are
+    # not reused.
+    $PSQL <<EOF
+BEGIN;
+LOCK TABLE ExpandedPosts IN EXCLUSIVE MODE;
+$COPY_SOURCES
+DELETE FROM ExpandedPosts;
+INSERT INTO ExpandedPosts ($COLUMNS) $EXPECTED;
+UPDATE ExpandedPostVersions SET version = version + 1;
+INSERT INTO ExpandedPostVersions (author_id, version)
+    SELECT DISTINCT author_id, 1 FROM ExpandedPosts
+    ON CONFLICT (author_id) DO NOTHING;
+COMMIT;
+EOF
+    ;;
+  verify )
+    MISMATCHES=$($PSQL --quiet --tuples-only --no-align <<EOF
+BEGIN ISOLATION LEVEL REPEATABLE READ;
+$COPY_SOURCES
+SELECT COALESCE(expected.id, actual.id)
+FROM ($EXPECTED) AS expected
+FULL OUTER JOIN (SELECT $COLUMNS FROM ExpandedPosts) AS actual
+    ON actual.id = expected.id
+WHERE expected IS DISTINCT FROM actual
+ORDER BY 1;
+COMMIT;
+EOF
+    ) || exit 1
+    MISMATCHES=$(echo "$MISMATCHES" | grep -v "^BEGIN$\|^COMMIT$\|^$")
+    if [[ -n "$MISMATCHES" ]]; then
+      echo "Posts that differ from the sources (id):"
+      echo "$MISMATCHES"
+      exit 1
+    fi
+    echo "The read model matches the sources."
+    ;;
+  * )
+    echo "Invalid mode: $MODE"
+    exit 1
+esac
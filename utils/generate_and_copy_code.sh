@@ -37,10 +37,17 @@ do
   thrift -r --gen py -out app/$service/service/tests/site-packages/buzzblog app/common/thrift/buzzblog.thrift
 done
 
-# Copy 'base_server.h'.
+# Copy common headers.
 for service in $SERVICES
 do
-  cp app/common/include/base_server.h app/$service/service/server/include/buzzblog
+  cp app/common/include/*.h app/$service/service/server/include/buzzblog
+done
+
+# Copy common Python modules.
+cp app/common/python/*.py app/apigateway/server/site-packages/buzzblog
+for service in $SERVICES
+do
+  cp app/common/python/*.py app/$service/service/tests/site-packages/buzzblog
 done
 
 # Copy service client libraries.
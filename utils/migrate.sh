@@ -0,0 +1,79 @@
+#!/bin/bash
+
+# Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+# Systems
+
+# This script applies the schema migrations of a service database
+# ('app/<service>/database/migrations/<version>_<name>.sql') that were not
+# applied yet, in version order. Each migration runs in its own transaction,
+# together with its record in table 'SchemaMigrations'. In 'status' mode, it
+# only lists migrations and whether they were applied.
+# Example: utils/migrate.sh --service post --port 5434
+
+# Change to the parent directory.
+cd "$(dirname "$(dirname "$(readlink -fm "$0")")")"
+
+# Process command-line arguments.
+set -u
+HOST=localhost
+DBNAME=postgres
+MODE=apply
+while [[ $# > 1 ]]; do
+  case $1 in
+    --service )
+      SERVICE=$2
+      ;;
+    --host )
+      HOST=$2
+      ;;
+    --port )
+      PORT=$2
+      ;;
+    --dbname )
+      DBNAME=$2
+      ;;
+    --mode )
+      MODE=$2
+      ;;
+    * )
+      echo "Invalid argument: $1"
+      exit 1
+  esac
+  shift
+  shift
+done
+
+MIGRATIONS_DIR=app/$SERVICE/database/migrations
+if [[ ! -d $MIGRATIONS_DIR ]]; then
+  echo "Invalid service: $SERVICE"
+  exit 1
+fi
+if [[ $MODE != apply && $MODE != status ]]; then
+  echo "Invalid mode: $MODE"
+  exit 1
+fi
+
+PSQL="psql -U postgres -h $HOST -p $PORT -d $DBNAME -v ON_ERROR_STOP=1 --quiet"
+$PSQL <<EOF2 || exit 1
+CREATE TABLE IF NOT EXISTS SchemaMigrations(
+  version VARCHAR(64) PRIMARY KEY,
+  applied_at INTEGER NOT NULL
+);
+EOF2
+APPLIED=$($PSQL --tuples-only --no-align \
+    --command "SELECT version FROM SchemaMigrations") || exit 1
+
+# Migrations are listed in version order.
+for filepath in $MIGRATIONS_DIR/*.sql; do
+  VERSION=$(basename $filepath .sql)
+  if echo "$APPLIED" | grep -qx "$VERSION"; then
+    [[ $MODE == status ]] && echo "$VERSION applied"
+  elif [[ $MODE == status ]]; then
+    echo "$VERSION pending"
+  else
+    echo "Applying $VERSION"
+    (cat $filepath; echo "INSERT INTO SchemaMigrations (version, applied_at)
+        VALUES ('$VERSION', extract(epoch from now()));") | \
+        $PSQL --single-transaction || exit 1
+  fi
+done
@@ -0,0 +1,118 @@
+#!/bin/bash
+
+# Copyright (C) 2020 Georgia Tech Center for Experimental Research in Computer
+# Systems
+
+# This script rebuilds the counter tables of a post or uniquepair database
+# ('PostCounts' or 'UniquepairCounts') from the rows they count, incrementing
+# their versions. In 'verify'
+# mode, it only lists counters that differ from the rows and exits with status
+# 1 if there is any.
+# Example: utils/rebuild_counters.sh --service uniquepair --port 5435 --mode verify
+
+# Change to the parent directory.
+cd "$(dirname "$(dirname "$(readlink -fm "$0")")")"
+
+# Process command-line arguments.
+set -u
+HOST=localhost
+MODE=rebuild
+while [[ $# > 1 ]]; do
+  case $1 in
+    --service )
+      SERVICE=$2
+      ;;
+    --host )
+      HOST=$2
+      ;;
+    --port )
+      PORT=$2
+      ;;
+    --mode )
+      MODE=$2
+      ;;
+    * )
+      echo "Invalid argument: $1"
+      exit 1
+  esac
+  shift
+  shift
+done
+
+# Define the table locked while counting, and the expected counters.
+case $SERVICE in
+  post )
+    TABLE=Posts
+    COUNTERS=PostCounts
+    KEY="author_id"
+    EXPECTED="
+        SELECT author_id, COUNT(*) AS count
+        FROM Posts
+        WHERE active = TRUE
+        GROUP BY author_id"
+    ;;
+  uniquepair )
+    TABLE=Uniquepairs
+    COUNTERS=UniquepairCounts
+    KEY="domain, field, elem"
+    EXPECTED="
+        SELECT domain, 'first_elem' AS field, first_elem AS elem,
+            COUNT(*) AS count
+        FROM Uniquepairs
+        GROUP BY domain, first_elem
+        UNION ALL
+        SELECT domain, 'second_elem' AS field, second_elem AS elem,
+            COUNT(*) AS count
+        FROM Uniquepairs
+        GROUP BY domain, second_elem"
+    ;;
+  * )
+    echo "Invalid service: $SERVICE"
+    exit 1
+esac
+
+PSQL="psql -U postgres -h $HOST -p $PORT -v ON_ERROR_STOP=1"
+case $MODE in
+  rebuild )
+    # Block writes while counters are rebuilt, so that none is lost. Every
+    # version is incremented and none is reset, so that no version is reused
+    # for other contents (which would make clients reuse stale lists). Counters
+    # of elements without rows are kept with count 0 for the same reason.
+    $PSQL <<EOF
+BEGIN;
+LOCK TABLE $TABLE IN SHARE MODE;
+LOCK TABLE $COUNTERS IN EXCLUSIVE MODE;
+CREATE TEMPORARY TABLE previous_counters ON COMMIT DROP AS
+    SELECT * FROM $COUNTERS;
+DELETE FROM $COUNTERS;
+INSERT INTO $COUNTERS ($KEY, count, version)
+    SELECT $KEY, COALESCE(expected.count, 0),
+        COALESCE(previous.version, 0) + 1
+    FROM ($EXPECTED) AS expected
+    FULL OUTER JOIN previous_counters AS previous USING ($KEY);
+COMMIT;
+EOF
+    ;;
+  verify )
+    MISMATCHES=$($PSQL --tuples-only --no-align <<EOF
+BEGIN ISOLATION LEVEL REPEATABLE READ;
+SELECT $KEY, COALESCE(expected.count, 0) AS expected,
+    COALESCE(counters.count, 0) AS actual
+FROM ($EXPECTED) AS expected
+FULL OUTER JOIN $COUNTERS AS counters USING ($KEY)
+WHERE COALESCE(expected.count, 0) <> COALESCE(counters.count, 0);
+COMMIT;
+EOF
+    ) || exit 1
+    MISMATCHES=$(echo "$MISMATCHES" | grep -v "^BEGIN$\|^COMMIT$\|^$")
+    if [[ -n "$MISMATCHES" ]]; then
+      echo "Counters that differ from $TABLE ($KEY|expected|actual):"
+      echo "$MISMATCHES"
+      exit 1
+    fi
+    echo "All counters match $TABLE."
+    ;;
+  * )
+    echo "Invalid mode: $MODE"
+    exit 1
+esac
@@ -43,11 +43,18 @@ cd ../../..
 docker run \
     --name apigateway \
     --publish 8080:81 \
+    --publish 9080:82 \
+    --publish 9080:82/udp \
     --volume $(pwd)/conf/backend.yml:/etc/opt/BuzzBlogApp/backend.yml \
     --volume $(pwd)/conf/uwsgi.ini:/etc/uwsgi/uwsgi.ini \
+    --volume $(pwd)/conf/apigateway.yml:/etc/opt/BuzzBlogApp/apigateway.yml \
     --detach \
     apigateway:latest
 
+# Create the change log volume, shared by the services that publish changes and
+# the read model projector.
+docker volume create changes
+
 # Deploy Account Service (1 PostgreSQL database server + 1 Thrift multithreaded
 # server).
 docker volume create pg_account
@@ -63,7 +70,7 @@ docker run \
     postgres:13.1 \
     -c max_connections=128
 sleep 4
-psql -U postgres -h localhost -p 5433 -f app/account/database/account_schema.sql
+utils/migrate.sh --service account --port 5433
 cd app/account/service/server
 docker build -t account:latest .
 cd ../../../..
@@ -76,7 +83,9 @@ docker run \
     --env postgres_user=postgres \
     --env postgres_password=postgres \
     --env postgres_dbname=postgres \
+    --env change_log=true \
     --volume $(pwd)/conf/backend.yml:/etc/opt/BuzzBlogApp/backend.yml \
+    --volume changes:/var/opt/BuzzBlogApp/changes \
     --detach \
     account:latest
 
@@ -106,6 +115,7 @@ docker run \
     --publish 9092:9092 \
     --env port=9092 \
     --env threads=8 \
+    --env address=172.17.0.1:9092 \
     --env backend_filepath=/etc/opt/BuzzBlogApp/backend.yml \
     --env postgres_user=postgres \
     --env postgres_password=postgres \
@@ -113,6 +123,21 @@ docker run \
     --volume $(pwd)/conf/backend.yml:/etc/opt/BuzzBlogApp/backend.yml \
     --detach \
     like:latest
+# Add likes asynchronously with a second server.
+docker run \
+    --name like_async_service \
+    --publish 9096:9096 \
+    --env port=9096 \
+    --env threads=8 \
+    --env address=172.17.0.1:9096 \
+    --env backend_filepath=/etc/opt/BuzzBlogApp/backend.yml \
+    --env postgres_user=postgres \
+    --env postgres_password=postgres \
+    --env postgres_dbname=postgres \
+    --env async_likes=true \
+    --volume $(pwd)/conf/backend.yml:/etc/opt/BuzzBlogApp/backend.yml \
+    --detach \
+    like:latest
 
 # Deploy Post Service (1 PostgreSQL database server + 1 Thrift multithreaded
 # server).
@@ -129,7 +154,7 @@ docker run \
     postgres:13.1 \
     -c max_connections=128
 sleep 4
-psql -U postgres -h localhost -p 5434 -f app/post/database/post_schema.sql
+utils/migrate.sh --service post --port 5434
 cd app/post/service/server
 docker build -t post:latest .
 cd ../../../..
@@ -142,7 +167,27 @@ docker run \
     --env postgres_user=postgres \
     --env postgres_password=postgres \
     --env postgres_dbname=postgres \
+    --env change_log=true \
+    --volume $(pwd)/conf/backend.yml:/etc/opt/BuzzBlogApp/backend.yml \
+    --volume changes:/var/opt/BuzzBlogApp/changes \
+    --detach \
+    post:latest
+# Serve expanded posts from the read model, and keep it up to date, with a
+# second server.
+docker run \
+    --name post_read_model_service \
+    --publish 9095:9095 \
+    --env port=9095 \
+    --env threads=8 \
+    --env backend_filepath=/etc/opt/BuzzBlogApp/backend.yml \
+    --env postgres_user=postgres \
+    --env postgres_password=postgres \
+    --env postgres_dbname=postgres \
+    --env change_log=true \
+    --env read_model=true \
+    --env read_model_projector=true \
     --volume $(pwd)/conf/backend.yml:/etc/opt/BuzzBlogApp/backend.yml \
+    --volume changes:/var/opt/BuzzBlogApp/changes \
     --detach \
     post:latest
 
@@ -161,7 +206,7 @@ docker run \
     postgres:13.1 \
     -c max_connections=128
 sleep 4
-psql -U postgres -h localhost -p 5435 -f app/uniquepair/database/uniquepair_schema.sql
+utils/migrate.sh --service uniquepair --port 5435
 cd app/uniquepair/service/server
 docker build -t uniquepair:latest .
 cd ../../../..
@@ -174,7 +219,9 @@ docker run \
     --env postgres_user=postgres \
     --env postgres_password=postgres \
     --env postgres_dbname=postgres \
+    --env change_log=true \
     --volume $(pwd)/conf/backend.yml:/etc/opt/BuzzBlogApp/backend.yml \
+    --volume changes:/var/opt/BuzzBlogApp/changes \
     --detach \
     uniquepair:latest
 
@@ -185,3 +232,21 @@ do
   python3 app/$service/service/tests/test_$service.py
 done
 python3 app/apigateway/tests/test_api.py
+
+# Check that databases created before migrations are migrated like new ones.
+python3 app/common/tests/test_migrations.py
+
+# Check that the queries of all services are served by indexes.
+python3 app/common/tests/test_query_plans.py
+
+# Run unit tests for common modules.
+python3 app/common/tests/test_change_log.py
+g++ -std=c++14 -I app/common/include -o /tmp/test_append_log \
+    app/common/tests/test_append_log.cpp
+/tmp/test_append_log
+g++ -std=c++14 -I app/common/include -o /tmp/test_heavy_hitters \
+    app/common/tests/test_heavy_hitters.cpp -pthread
+/tmp/test_heavy_hitters
+g++ -std=c++14 -I app/common/include -o /tmp/test_lru_cache \
+    app/common/tests/test_lru_cache.cpp
+/tmp/test_lru_cache